@@ -1,13 +1,42 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, g, request, jsonify
 from flask_cors import CORS
 import mysql.connector
 import requests
 import os
 import re
 import json
-from datetime import datetime
+import bisect
+import codecs
+import csv
+import functools
+import gzip
+import hashlib
+import html
+import io
+import math
+import sqlite3
+import threading
+import time
+import uuid
+import zipfile
+import zlib
+import multiprocessing
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures import BrokenExecutor, TimeoutError as FuturesTimeoutError
+from datetime import datetime, timedelta
+from xml.etree import ElementTree
+from werkzeug.exceptions import RequestEntityTooLarge
 import logging
 
+import numpy as np
+
+try:
+    import brotli  # optional: enables Content-Encoding: br
+except ImportError:
+    brotli = None
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -15,21 +44,855 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__, static_folder="frontend", static_url_path="")
 CORS(app)  # allows frontend to talk to backend
 
-# --- MySQL Connection ---
-def get_db_connection():
+# --- Metrics ---
+# A small Prometheus-compatible registry: histograms, counters and gauges
+# kept per process and rendered in the text exposition format on /metrics.
+# Collectors add samples computed at scrape time from existing stats().
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def samples(self):
+        with self._lock:
+            return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                    for key, value in sorted(self._values.items())]
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def track(self, **labels):
+        """Context manager counting the block as in progress"""
+        gauge = self
+
+        class _Tracker:
+            def __enter__(self):
+                gauge.inc(**labels)
+
+            def __exit__(self, *exc_info):
+                gauge.dec(**labels)
+
+        return _Tracker()
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [[0] * len(self.buckets), 0, 0.0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += 1
+            series[2] += value
+
+    def time(self, **labels):
+        """Context manager observing the block's duration in seconds"""
+        histogram = self
+
+        class _Timer:
+            def __enter__(self):
+                self.started = time.perf_counter()
+
+            def __exit__(self, *exc_info):
+                histogram.observe(time.perf_counter() - self.started, **labels)
+
+        return _Timer()
+
+    def samples(self):
+        lines = []
+        with self._lock:
+            for key, (counts, count, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    le = _format_labels(self.labelnames, key, [("le", _format_value(float(bound)))])
+                    lines.append(f"{self.name}_bucket{le} {cumulative}")
+                le = _format_labels(self.labelnames, key, [("le", "+Inf")])
+                lines.append(f"{self.name}_bucket{le} {count}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+        return lines
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        """Register a callable returning (name, kind, help, [(labels dict, value)])"""
+        self._collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.header())
+            lines.extend(metric.samples())
+        for collector in self._collectors:
+            try:
+                families = collector()
+            except Exception as e:
+                logger.warning(f"Metrics collector failed: {e}")
+                continue
+            for name, kind, documentation, samples in families:
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(list(labels), list(labels.values()))} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+
+HTTP_REQUEST_SECONDS = metrics.register(Histogram(
+    "flashcards_http_request_duration_seconds", "Time to produce a response, by route",
+    ["method", "route", "status"]))
+HTTP_REQUESTS_IN_FLIGHT = metrics.register(Gauge(
+    "flashcards_http_requests_in_flight", "Requests currently being handled"))
+STAGE_SECONDS = metrics.register(Histogram(
+    "flashcards_generation_stage_seconds", "Time spent in each flashcard generation stage", ["stage"]))
+INFERENCE_SECONDS = metrics.register(Histogram(
+    "flashcards_inference_call_seconds", "Duration of inference backend calls", ["backend", "model"]))
+INFERENCE_CALLS = metrics.register(Counter(
+    "flashcards_inference_inputs_total", "Inference inputs by outcome (ok, failed, cached)", ["backend", "outcome"]))
+INFERENCE_IN_FLIGHT = metrics.register(Gauge(
+    "flashcards_inference_calls_in_flight", "Inference backend calls currently running", ["backend"]))
+DB_QUERY_SECONDS = metrics.register(Histogram(
+    "flashcards_db_query_seconds", "Database time in route handlers, by operation", ["operation"]))
+ADMISSION_REJECTED = metrics.register(Counter(
+    "flashcards_admission_rejected_total", "Generation requests turned away, by reason", ["reason"]))
+AI_GENERATIONS_IN_FLIGHT = metrics.register(Gauge(
+    "flashcards_ai_generations_in_flight", "Generations holding an AI generation slot"))
+
+def timed_stage(stage):
+    """Decorator recording a function's run time under STAGE_SECONDS{stage}"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with STAGE_SECONDS.time(stage=stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# --- Database Configuration ---
+# DB_BACKEND selects the driver: "mysql" for production, "sqlite" for a local
+# stand-in that needs no server (handy for development and testing).
+DB_BACKEND = os.getenv('DB_BACKEND', 'mysql').lower()
+
+DB_CONFIG = {
+    "host": os.getenv('DB_HOST', 'localhost'),
+    "port": int(os.getenv('DB_PORT', '3306')),
+    "user": os.getenv('DB_USER', 'root'),                 # change if you set another MySQL user
+    "password": os.getenv('DB_PASSWORD', 'Ronald@2001'),  # ✅ your MySQL password
+    "database": os.getenv('DB_NAME', 'flashcards_db'),
+    "charset": 'utf8mb4',
+    "collation": 'utf8mb4_unicode_ci'
+}
+
+SQLITE_PATH = os.getenv('SQLITE_PATH', 'flashcards.db')
+
+# Connection pool tuning
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '10'))              # max open connections per worker
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '5'))       # seconds to wait for a free connection
+DB_POOL_RECYCLE = float(os.getenv('DB_POOL_RECYCLE', '3600'))    # close connections older than this
+DB_POOL_PING_AFTER = float(os.getenv('DB_POOL_PING_AFTER', '30'))  # validate connections idle longer than this
+
+class PoolTimeoutError(Exception):
+    """Raised when no pooled connection becomes available in time"""
+
+class ConnectionPool:
+    """Thread-safe pool of reusable DB-API connections.
+
+    Connections are created lazily up to ``max_size``. A checkout blocks for
+    at most ``timeout`` seconds when the pool is exhausted. Connections idle
+    for longer than ``ping_after`` seconds are validated before being handed
+    out, and connections older than ``recycle`` seconds are replaced.
+    """
+
+    def __init__(self, factory, max_size=10, timeout=5.0, recycle=3600.0, ping_after=30.0):
+        self._factory = factory
+        self.max_size = max(1, max_size)
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_after = ping_after
+        self._cond = threading.Condition()
+        self._idle = deque()  # (connection, created_at, last_used)
+        self._created_at = {}
+        self._open = 0
+        self._in_use = 0
+        self._stats = {
+            "checkouts": 0,
+            "created": 0,
+            "discarded": 0,
+            "waits": 0,
+            "timeouts": 0
+        }
+
+    def acquire(self):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            conn = None
+            with self._cond:
+                while not self._idle and self._open >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise PoolTimeoutError(
+                            f"No database connection available after {self.timeout}s "
+                            f"(pool size {self.max_size})"
+                        )
+                    self._stats["waits"] += 1
+                    self._cond.wait(remaining)
+
+                if self._idle:
+                    conn, created_at, last_used = self._idle.pop()
+                else:
+                    self._open += 1
+                    created_at = last_used = None
+                self._in_use += 1
+
+            if conn is None:
+                try:
+                    conn = self._factory()
+                except Exception:
+                    with self._cond:
+                        self._open -= 1
+                        self._in_use -= 1
+                        self._cond.notify()
+                    raise
+                with self._cond:
+                    self._created_at[id(conn)] = time.monotonic()
+                    self._stats["created"] += 1
+                    self._stats["checkouts"] += 1
+                return PooledConnection(self, conn)
+
+            now = time.monotonic()
+            if now - created_at > self.recycle or (
+                now - last_used > self.ping_after and not _ping_connection(conn)
+            ):
+                self._discard(conn)
+                continue
+
+            with self._cond:
+                self._stats["checkouts"] += 1
+            return PooledConnection(self, conn)
+
+    def release(self, conn):
+        try:
+            # Never hand out a connection with an open transaction
+            conn.rollback()
+        except Exception:
+            self._discard(conn)
+            return
+        with self._cond:
+            self._in_use -= 1
+            self._idle.append((conn, self._created_at.get(id(conn), time.monotonic()), time.monotonic()))
+            self._cond.notify()
+
+    def _discard(self, conn, in_use=True):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._created_at.pop(id(conn), None)
+            self._open -= 1
+            if in_use:
+                self._in_use -= 1
+            self._stats["discarded"] += 1
+            self._cond.notify()
+
+    def close_all(self):
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+        for conn, _, _ in idle:
+            self._discard(conn, in_use=False)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "backend": DB_BACKEND,
+                "max_size": self.max_size,
+                "open": self._open,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                **self._stats
+            }
+
+class PooledConnection:
+    """Proxy around a pooled connection; close() returns it to the pool"""
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise RuntimeError("Connection has already been returned to the pool")
+        return getattr(self._conn, name)
+
+    def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.release(conn)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def _ping_connection(conn):
+    """Return True if the connection still answers a trivial query"""
     try:
-        return mysql.connector.connect(
-            host="localhost",
-            user="root",              # change if you set another MySQL user
-            password="Ronald@2001",   # ✅ your MySQL password
-            database="flashcards_db",
-            charset='utf8mb4',
-            collation='utf8mb4_unicode_ci'
+        cursor = conn.cursor()
+        with DB_QUERY_SECONDS.time(operation="ping"):
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+        cursor.close()
+        return True
+    except Exception as e:
+        logger.warning(f"Discarding stale database connection: {e}")
+        return False
+
+# --- SQLite Stand-in ---
+# Wraps sqlite3 so route code can keep using the mysql.connector style API
+# (%s placeholders and cursor(dictionary=True)).
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(" "))
+sqlite3.register_converter("TIMESTAMP", lambda value: datetime.fromisoformat(value.decode()))
+
+class SQLiteCursor:
+    def __init__(self, cursor, dictionary=False):
+        self._cursor = cursor
+        self._dictionary = dictionary
+
+    @staticmethod
+    def _translate(sql):
+        return sql.replace("%s", "?")
+
+    def execute(self, sql, params=()):
+        self._cursor.execute(self._translate(sql), params)
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        self._cursor.executemany(self._translate(sql), seq_of_params)
+        return self
+
+    def _convert(self, row):
+        if row is None or not self._dictionary:
+            return row
+        columns = [col[0] for col in self._cursor.description]
+        return dict(zip(columns, row))
+
+    def fetchone(self):
+        return self._convert(self._cursor.fetchone())
+
+    def fetchall(self):
+        return [self._convert(row) for row in self._cursor.fetchall()]
+
+    def fetchmany(self, size=1):
+        return [self._convert(row) for row in self._cursor.fetchmany(size)]
+
+    def __iter__(self):
+        for row in self._cursor:
+            yield self._convert(row)
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    def close(self):
+        self._cursor.close()
+
+class SQLiteConnection:
+    def __init__(self, path):
+        # Pooled connections are only used by one thread at a time
+        self._conn = sqlite3.connect(
+            path,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            check_same_thread=False,
+            timeout=DB_POOL_TIMEOUT
         )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+
+    def cursor(self, dictionary=False):
+        return SQLiteCursor(self._conn.cursor(), dictionary=dictionary)
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def close(self):
+        self._conn.close()
+
+# --- Database Connection ---
+def _create_raw_connection():
+    if DB_BACKEND == "sqlite":
+        return SQLiteConnection(SQLITE_PATH)
+    try:
+        return mysql.connector.connect(**DB_CONFIG)
     except mysql.connector.Error as err:
         logger.error(f"Database connection error: {err}")
         raise
 
+_db_pool = None
+_db_pool_lock = threading.Lock()
+
+def get_db_pool():
+    """Return the per-process connection pool, creating it on first use"""
+    global _db_pool
+    if _db_pool is None:
+        with _db_pool_lock:
+            if _db_pool is None:
+                _db_pool = ConnectionPool(
+                    _create_raw_connection,
+                    max_size=DB_POOL_SIZE,
+                    timeout=DB_POOL_TIMEOUT,
+                    recycle=DB_POOL_RECYCLE,
+                    ping_after=DB_POOL_PING_AFTER
+                )
+    return _db_pool
+
+def get_db_connection():
+    """Check out a pooled connection; call close() to return it to the pool"""
+    try:
+        return get_db_pool().acquire()
+    except PoolTimeoutError as err:
+        logger.error(f"Database pool exhausted: {err}")
+        raise
+
+# --- Result Caching ---
+_MISSING = object()  # cache miss sentinel, so None can be cached
+
+class SQLiteCacheStore:
+    """Shared on-disk cache tier so every worker process sees the same entries"""
+
+    def __init__(self, path, table="cache_entries", max_entries=10000):
+        self.path = path
+        self.table = table
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes = 0
+        conn = self._connection()
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {self.table} (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
+        conn.commit()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._connection().execute(
+            f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None or row[1] < time.time():
+            return _MISSING
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl):
+        conn = self._connection()
+        conn.execute(
+            f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value), time.time() + ttl)
+        )
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self._prune(conn)
+        conn.commit()
+
+    def _prune(self, conn):
+        conn.execute(f"DELETE FROM {self.table} WHERE expires_at < ?", (time.time(),))
+        conn.execute(f"""
+            DELETE FROM {self.table} WHERE key IN (
+                SELECT key FROM {self.table} ORDER BY expires_at DESC LIMIT -1 OFFSET ?
+            )
+        """, (self.max_entries,))
+
+class ResultCache:
+    """In-process LRU cache with per-entry TTL and an optional shared tier.
+
+    Lookups check the local LRU first, then the shared store (if
+    configured), promoting shared hits into the local tier. Values stored
+    in the shared tier must be JSON serializable.
+    """
+
+    def __init__(self, name, max_size=256, ttl=3600.0, shared_path=None, shared_max_entries=10000):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self._shared = None
+        if shared_path:
+            try:
+                self._shared = SQLiteCacheStore(shared_path, table=f"{name}_cache", max_entries=shared_max_entries)
+            except sqlite3.Error as e:
+                logger.warning(f"Shared {name} cache disabled: {e}")
+        self._stats = {"hits": 0, "shared_hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return entry[1]
+                del self._entries[key]
+
+        if self._shared is not None:
+            try:
+                value = self._shared.get(key)
+            except sqlite3.Error as e:
+                logger.warning(f"Shared {self.name} cache read failed: {e}")
+                value = _MISSING
+            if value is not _MISSING:
+                self._store_local(key, value, self.ttl)
+                with self._lock:
+                    self._stats["shared_hits"] += 1
+                return value
+
+        with self._lock:
+            self._stats["misses"] += 1
+        return _MISSING
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        self._store_local(key, value, ttl)
+        if self._shared is not None:
+            try:
+                self._shared.set(key, value, ttl)
+            except sqlite3.Error as e:
+                logger.warning(f"Shared {self.name} cache write failed: {e}")
+
+    def _store_local(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["shared_hits"] + self._stats["misses"]
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "shared": self._shared is not None,
+                "hit_rate": round((lookups - self._stats["misses"]) / lookups, 3) if lookups else 0.0,
+                **self._stats
+            }
+
+class SingleFlight:
+    """Coalesce concurrent calls for the same key into one execution.
+
+    The first caller runs the function; callers arriving while it is in
+    flight wait for and share its result instead of repeating the work.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}  # key -> [done event, result]
+        self.coalesced = 0
+
+    def do(self, key, fn, timeout=None):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = [threading.Event(), None]
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call[0].wait(timeout)
+            return call[1]
+
+        try:
+            call[1] = fn()
+            return call[1]
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call[0].set()
+
+# --- Circuit Breaker ---
+# Stops calling a failing dependency for a while instead of making every
+# request wait through its retries. State lives in memory, or in a SQLite
+# file (BREAKER_STATE_PATH) so all workers open and close together. The
+# same state stores back the per-client rate limiter.
+BREAKER_FAILURE_THRESHOLD = int(os.getenv('BREAKER_FAILURE_THRESHOLD', '5'))  # consecutive failures that open it
+BREAKER_RESET_TIMEOUT = float(os.getenv('BREAKER_RESET_TIMEOUT', '30'))       # seconds open before a trial call
+BREAKER_MAX_RESET_TIMEOUT = float(os.getenv('BREAKER_MAX_RESET_TIMEOUT', '300'))  # cap for the doubling timeout
+BREAKER_STATE_PATH = os.getenv('BREAKER_STATE_PATH', '')                       # SQLite file shared by workers
+
+class InMemoryStateStore:
+    """Named JSON-like states in this process, least recently used dropped
+    first once there are more than ``max_entries`` (if given)"""
+
+    def __init__(self, max_entries=None):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._states = OrderedDict()
+
+    def update(self, name, fn):
+        """Apply ``fn`` to the named state atomically and return its result"""
+        with self._lock:
+            state = self._states.setdefault(name, {})
+            self._states.move_to_end(name)
+            if self.max_entries and len(self._states) > self.max_entries:
+                self._states.popitem(last=False)
+            return fn(state)
+
+    def get(self, name):
+        """A copy of the named state, without creating or touching it"""
+        with self._lock:
+            return dict(self._states.get(name, {}))
+
+class SQLiteStateStore:
+    """Named states in a SQLite file, updated under an immediate write lock"""
+
+    def __init__(self, path, table="circuit_breakers", max_entries=None):
+        self.path = path
+        self.table = table
+        self.max_entries = max_entries
+        self._writes = 0
+        self._local = threading.local()
+        conn = self._connection()
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                name TEXT PRIMARY KEY,
+                state TEXT NOT NULL
+            )
+        """)
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def update(self, name, fn):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(f"SELECT state FROM {self.table} WHERE name = ?", (name,)).fetchone()
+            state = json.loads(row[0]) if row else {}
+            result = fn(state)
+            conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (name, state) VALUES (?, ?)",
+                (name, json.dumps(state))
+            )
+            self._writes += 1
+            if self.max_entries and self._writes % 100 == 0:
+                # REPLACE gives the row a new rowid, so low rowids are the
+                # states updated least recently
+                conn.execute(f"""
+                    DELETE FROM {self.table} WHERE rowid IN (
+                        SELECT rowid FROM {self.table} ORDER BY rowid DESC LIMIT -1 OFFSET ?
+                    )
+                """, (self.max_entries,))
+            conn.execute("COMMIT")
+            return result
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def get(self, name):
+        """The named state, read without taking the write lock"""
+        row = self._connection().execute(f"SELECT state FROM {self.table} WHERE name = ?", (name,)).fetchone()
+        return json.loads(row[0]) if row else {}
+
+class CircuitBreaker:
+    """Closed / open / half-open breaker around calls to one dependency.
+
+    Opens after ``failure_threshold`` consecutive failures. While open,
+    allow() refuses calls until ``reset_timeout`` has passed, then lets a
+    single trial call through (half-open): success closes the breaker, and
+    failure re-opens it with the timeout doubled, up to ``max_reset_timeout``.
+
+    The state is read without locking the store and only written when it
+    changes (a failure, the first success after failures, or an open
+    breaker letting a trial through), so a closed breaker shared through
+    SQLite costs each call a plain read. Call counts are kept per process.
+    """
+
+    def __init__(self, name, store, failure_threshold=5, reset_timeout=30.0,
+                 max_reset_timeout=300.0, probe_timeout=30.0):
+        self.name = name
+        self.store = store
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.probe_timeout = probe_timeout  # a trial call not reported by then is presumed lost
+        self._counts = {"calls": 0, "rejected": 0, "failed": 0}
+        self._counts_lock = threading.Lock()
+
+    def _defaults(self, state):
+        state.setdefault("state", "closed")
+        state.setdefault("failures", 0)
+        state.setdefault("opened_at", 0.0)
+        state.setdefault("timeout", self.reset_timeout)
+        state.setdefault("probe_until", 0.0)
+        return state
+
+    def _count(self, key):
+        with self._counts_lock:
+            self._counts[key] += 1
+
+    def _refusing(self, state):
+        return state["state"] == "open" and time.time() < state["opened_at"] + state["timeout"]
+
+    def allow(self):
+        """Whether a call may go ahead now; a True from half-open is the trial call"""
+        state = self._defaults(self.store.get(self.name))
+        if state["state"] == "closed" or self._refusing(state):
+            allowed = state["state"] == "closed"
+        else:
+            def decide(state):
+                self._defaults(state)
+                now = time.time()
+                if state["state"] == "open" and now >= state["opened_at"] + state["timeout"]:
+                    state["state"] = "half_open"
+                    logger.info(f"Circuit breaker {self.name} half-open, sending a trial call")
+                if state["state"] == "half_open":
+                    if now < state["probe_until"]:
+                        return False
+                    state["probe_until"] = now + self.probe_timeout
+                elif state["state"] == "open":
+                    return False
+                return True
+            allowed = self.store.update(self.name, decide)
+        self._count("calls" if allowed else "rejected")
+        return allowed
+
+    def is_open(self):
+        """True while calls would be refused outright (open, no trial due yet)"""
+        return self._refusing(self._defaults(self.store.get(self.name)))
+
+    def reject(self):
+        """Count a call skipped by the caller because the breaker is open"""
+        self._count("rejected")
+
+    def record_success(self):
+        state = self._defaults(self.store.get(self.name))
+        if state["state"] == "closed" and state["failures"] == 0:
+            return
+
+        def close(state):
+            self._defaults(state)
+            if state["state"] != "closed":
+                logger.info(f"Circuit breaker {self.name} closed")
+            state.update(state="closed", failures=0, timeout=self.reset_timeout, probe_until=0.0)
+        self.store.update(self.name, close)
+
+    def record_failure(self):
+        self._count("failed")
+
+        def fail(state):
+            self._defaults(state)
+            state["failures"] += 1
+            if state["state"] == "half_open":
+                state["timeout"] = min(state["timeout"] * 2, self.max_reset_timeout)
+            elif state["state"] == "open" or state["failures"] < self.failure_threshold:
+                return
+            state.update(state="open", opened_at=time.time(), probe_until=0.0)
+            logger.warning(f"Circuit breaker {self.name} opened for {state['timeout']:.0f}s "
+                           f"after {state['failures']} consecutive failures")
+        self.store.update(self.name, fail)
+
+    def stats(self):
+        state = self._defaults(self.store.get(self.name))
+        with self._counts_lock:
+            counts = dict(self._counts)
+        attempts = counts["calls"] + counts["rejected"]
+        return {
+            "state": state["state"],
+            "consecutive_failures": state["failures"],
+            "reset_timeout": state["timeout"],
+            **counts,
+            "fallback_rate": round((counts["rejected"] + counts["failed"]) / attempts, 4) if attempts else 0.0
+        }
+
+breaker_store = SQLiteStateStore(BREAKER_STATE_PATH) if BREAKER_STATE_PATH else InMemoryStateStore()
+
 # --- Enhanced Hugging Face AI Setup ---
 HF_API_TOKEN = os.getenv('HF_API_TOKEN')  # Get API token from environment variable
 
@@ -42,132 +905,960 @@ MODELS = {
 
 headers = {"Authorization": f"Bearer {HF_API_TOKEN}"}
 
-# --- AI Helper Functions ---
-def clean_and_split_text(text):
-    """Clean and split text into meaningful chunks for processing"""
-    # Remove extra whitespace and normalize
-    text = re.sub(r'\s+', ' ', text.strip())
-    
-    # Split by sentences, paragraphs, or logical breaks
-    chunks = []
-    
-    # Split by paragraphs first
-    paragraphs = text.split('\n')
-    
-    for paragraph in paragraphs:
-        paragraph = paragraph.strip()
-        if len(paragraph) > 20:  # Only process substantial paragraphs
-            # Split long paragraphs into sentences
-            sentences = re.split(r'[.!?]+', paragraph)
-            
-            current_chunk = ""
-            for sentence in sentences:
-                sentence = sentence.strip()
-                if sentence:
-                    if len(current_chunk + sentence) < 200:  # Keep chunks manageable
-                        current_chunk += sentence + ". "
-                    else:
-                        if current_chunk:
-                            chunks.append(current_chunk.strip())
-                        current_chunk = sentence + ". "
-            
-            if current_chunk:
-                chunks.append(current_chunk.strip())
-    
-    return chunks
+# Inference endpoint base URL; point it at a local mock server for testing
+HF_API_BASE_URL = os.getenv('HF_API_BASE_URL', 'https://api-inference.huggingface.co/models').rstrip('/')
+HF_REQUEST_TIMEOUT = float(os.getenv('HF_REQUEST_TIMEOUT', '30'))  # per HTTP call
+AI_MAX_WORKERS = int(os.getenv('AI_MAX_WORKERS', '5'))              # concurrent inference calls per worker
+AI_REQUEST_DEADLINE = float(os.getenv('AI_REQUEST_DEADLINE', '20'))  # seconds allowed for AI enhancement
+INFERENCE_BATCH_SIZE = int(os.getenv('INFERENCE_BATCH_SIZE', '8'))        # chunk inputs per model call
+INFERENCE_BATCH_TOKENS = int(os.getenv('INFERENCE_BATCH_TOKENS', '2048'))  # estimated input tokens per model call
 
-def extract_key_concepts(text):
-    """Extract key concepts, terms, and facts from text"""
-    concepts = []
-    
-    # Look for definitions (X is Y, X means Y, etc.)
-    definition_patterns = [
-        r'(\w+(?:\s+\w+)*)\s+(?:is|are|means?|refers?\s+to|defined?\s+as)\s+([^.!?]+)',
-        r'(\w+(?:\s+\w+)*):\s*([^.!?]+)',
-        r'Definition:\s*(\w+(?:\s+\w+)*)\s*[-–]\s*([^.!?]+)'
-    ]
-    
-    for pattern in definition_patterns:
-        matches = re.finditer(pattern, text, re.IGNORECASE)
-        for match in matches:
-            term = match.group(1).strip()
-            definition = match.group(2).strip()
-            if len(term) > 2 and len(definition) > 10:
-                concepts.append({
-                    "type": "definition",
-                    "term": term,
-                    "content": definition
-                })
-    
-    # Look for numbered lists or bullet points
-    list_patterns = [
-        r'(?:^|\n)\s*(?:\d+\.|\*|\-|\•)\s*([^.\n]+(?:\.[^.\n]*)*)',
-        r'(?:Steps?|Processes?|Stages?):\s*\n((?:\s*(?:\d+\.|\*|\-)\s*[^\n]+\n?)+)'
-    ]
-    
-    for pattern in list_patterns:
-        matches = re.finditer(pattern, text, re.MULTILINE | re.IGNORECASE)
-        for match in matches:
-            item = match.group(1).strip()
-            if len(item) > 15:
-                concepts.append({
-                    "type": "list_item",
-                    "content": item
-                })
-    
-    # Look for important facts or statements
-    fact_patterns = [
-        r'(?:Important|Key|Note|Remember):\s*([^.!?]+)',
-        r'(?:According to|Research shows|Studies indicate)\s+([^.!?]+)',
-        r'(\w+(?:\s+\w+)*)\s+(?:causes?|results?\s+in|leads?\s+to)\s+([^.!?]+)'
-    ]
-    
-    for pattern in fact_patterns:
-        matches = re.finditer(pattern, text, re.IGNORECASE)
-        for match in matches:
-            if len(match.groups()) == 2:
-                fact = f"{match.group(1)} {match.group(2)}"
-            else:
-                fact = match.group(1)
-            
-            if len(fact) > 20:
-                concepts.append({
-                    "type": "fact",
-                    "content": fact.strip()
-                })
-    
-    return concepts
+# Where model calls run: "huggingface" (remote Inference API), "local"
+# (ONNX models on this machine's CPU) or "stub" (deterministic, offline)
+INFERENCE_BACKEND = os.getenv('INFERENCE_BACKEND', 'huggingface').lower()
+LOCAL_MODEL_DIR = os.getenv('LOCAL_MODEL_DIR', 'models')             # ONNX exports, one folder per model
+LOCAL_BATCH_SIZE = int(os.getenv('LOCAL_BATCH_SIZE', '8'))            # inputs per local generate() call
+LOCAL_MAX_NEW_TOKENS = int(os.getenv('LOCAL_MAX_NEW_TOKENS', '64'))   # output length for local models
+LOCAL_NUM_THREADS = int(os.getenv('LOCAL_NUM_THREADS', '0'))          # ONNX Runtime intra-op threads; 0 = auto
 
-def generate_questions_from_concepts(concepts):
-    """Generate question-answer pairs from extracted concepts"""
-    flashcards = []
-    
-    for concept in concepts:
-        if concept["type"] == "definition":
-            # Create definition-based questions
-            term = concept["term"]
-            definition = concept["content"]
-            
-            # Multiple question formats for variety
-            question_formats = [
-                f"What is {term}?",
-                f"Define {term}.",
-                f"How would you explain {term}?",
-                f"What does {term} mean?"
-            ]
-            
-            # Choose the most appropriate format
-            question = question_formats[0]  # Default to "What is X?"
-            
-            flashcards.append({
-                "question": question,
-                "answer": definition,
-                "type": "definition"
-            })
-            
-            # Create reverse question (definition to term)
-            if len(definition) < 100:  # Only for shorter definitions
-                flashcards.append({
+MAX_SESSION_CARDS = 15   # cards kept by the comprehensive pass
+MAX_RESPONSE_CARDS = 12  # cards returned to the client
+
+# One keep-alive session shared by all inference calls in this process
+hf_session = requests.Session()
+hf_session.headers.update(headers)
+hf_session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=AI_MAX_WORKERS))
+hf_session.mount("http://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=AI_MAX_WORKERS))
+
+inference_breaker = CircuitBreaker(
+    "huggingface",
+    breaker_store,
+    failure_threshold=BREAKER_FAILURE_THRESHOLD,
+    reset_timeout=BREAKER_RESET_TIMEOUT,
+    max_reset_timeout=BREAKER_MAX_RESET_TIMEOUT,
+    probe_timeout=HF_REQUEST_TIMEOUT
+)
+
+_ai_executor = None
+_ai_executor_lock = threading.Lock()
+
+def get_ai_executor():
+    """Thread pool used to fan out inference calls, created on first use"""
+    global _ai_executor
+    if _ai_executor is None:
+        with _ai_executor_lock:
+            if _ai_executor is None:
+                _ai_executor = ThreadPoolExecutor(max_workers=AI_MAX_WORKERS, thread_name_prefix="hf-api")
+    return _ai_executor
+
+# Inference responses are memoized per (model URL, input text). Successful
+# responses are kept for INFERENCE_CACHE_TTL; 4xx errors are cached as None
+# for INFERENCE_NEGATIVE_TTL so bad inputs don't keep hitting the API.
+INFERENCE_CACHE_SIZE = int(os.getenv('INFERENCE_CACHE_SIZE', '2048'))
+INFERENCE_CACHE_TTL = float(os.getenv('INFERENCE_CACHE_TTL', str(7 * 24 * 3600)))
+INFERENCE_NEGATIVE_TTL = float(os.getenv('INFERENCE_NEGATIVE_TTL', '300'))
+INFERENCE_CACHE_PATH = os.getenv('INFERENCE_CACHE_PATH', '')  # SQLite file kept across restarts; empty disables it
+INFERENCE_CACHE_MAX_ENTRIES = int(os.getenv('INFERENCE_CACHE_MAX_ENTRIES', '100000'))
+
+inference_cache = ResultCache(
+    "inference",
+    max_size=INFERENCE_CACHE_SIZE,
+    ttl=INFERENCE_CACHE_TTL,
+    shared_path=INFERENCE_CACHE_PATH or None,
+    shared_max_entries=INFERENCE_CACHE_MAX_ENTRIES
+)
+inference_calls = SingleFlight()
+
+def model_url(model):
+    """Inference URL for a model id such as 'facebook/bart-large-cnn'"""
+    return f"{HF_API_BASE_URL}/{model}"
+
+# Generated flashcards are cached by a hash of the normalized input and the
+# model config. GENERATION_CACHE_PATH enables a SQLite tier shared by workers.
+GENERATION_CACHE_SIZE = int(os.getenv('GENERATION_CACHE_SIZE', '256'))
+GENERATION_CACHE_TTL = float(os.getenv('GENERATION_CACHE_TTL', '3600'))
+GENERATION_DEGRADED_TTL = float(os.getenv('GENERATION_DEGRADED_TTL', '60'))  # results made without the AI
+GENERATION_CACHE_PATH = os.getenv('GENERATION_CACHE_PATH', '')
+
+generation_cache = ResultCache(
+    "generation",
+    max_size=GENERATION_CACHE_SIZE,
+    ttl=GENERATION_CACHE_TTL,
+    shared_path=GENERATION_CACHE_PATH or None
+)
+
+# Rule-based results are also cached per note segment (a blank-line
+# separated paragraph) under a fingerprint of its text, so a resubmitted
+# note only re-extracts the paragraphs that changed. Chunks never cross a
+# segment boundary, which keeps the AI inputs of unchanged paragraphs
+# identical and lets the inference cache answer them. The shared tier
+# lives in the GENERATION_CACHE_PATH file.
+SEGMENT_CACHE_SIZE = int(os.getenv('SEGMENT_CACHE_SIZE', '4096'))
+SEGMENT_CACHE_TTL = float(os.getenv('SEGMENT_CACHE_TTL', str(24 * 3600)))
+
+segment_cache = ResultCache(
+    "segment",
+    max_size=SEGMENT_CACHE_SIZE,
+    ttl=SEGMENT_CACHE_TTL,
+    shared_path=GENERATION_CACHE_PATH or None,
+    shared_max_entries=100000
+)
+
+def normalize_input_text(text):
+    """Canonical form of submitted notes: unified newlines, no trailing spaces"""
+    lines = text.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+    return '\n'.join(line.rstrip() for line in lines).strip()
+
+def generation_cache_key(text):
+    """Content address for a generation result: normalized text + active models"""
+    digest = hashlib.sha256()
+    digest.update(json.dumps({"backend": INFERENCE_BACKEND, "models": MODELS}, sort_keys=True).encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(text.encode('utf-8'))
+    return digest.hexdigest()
+
+def cache_generation_result(cache_key, done):
+    """Cache a pipeline's "done" event. Degraded results (AI calls missed
+    the deadline, failed or were skipped by the open breaker, or only
+    fallback cards came out) expire after GENERATION_DEGRADED_TTL so the
+    next request can get the full result once the model is back."""
+    ttl = GENERATION_DEGRADED_TTL if done.get("degraded") else None
+    generation_cache.set(cache_key, done["cards"], ttl=ttl)
+
+# --- Inference Backends ---
+# Every model call goes through an InferenceBackend. infer() takes a model
+# id and a list of inputs and returns one (result, cache TTL or None) pair
+# per input, with results shaped like Inference API responses
+# ([{"generated_text": ...}] or [{"summary_text": ...}]) so the parsers
+# don't care where the model ran. A None TTL means "don't cache".
+SUMMARIZATION_MODELS = {MODELS['text_analysis']}
+
+class InferenceBackend(ABC):
+    name = "base"
+
+    @abstractmethod
+    def infer(self, model, inputs, max_retries=3, deadline=None):
+        """(result, cache TTL or None) for each of ``inputs``, in order"""
+
+    def stats(self):
+        return {"backend": self.name}
+
+class HuggingFaceBackend(InferenceBackend):
+    """Remote Hugging Face Inference API over the shared keep-alive session"""
+    name = "huggingface"
+
+    def infer(self, model, inputs, max_retries=3, deadline=None):
+        url = model_url(model)
+        if len(inputs) == 1:
+            return [self._request(inputs[0], url, max_retries, deadline)]
+
+        # The API takes a list of inputs and answers with one item per input
+        result, cache_ttl = self._request(list(inputs), url, max_retries, deadline)
+        if isinstance(result, list) and len(result) == len(inputs):
+            return [(item if isinstance(item, list) else [item], cache_ttl) for item in result]
+        if cache_ttl is None:
+            return [(None, None)] * len(inputs)
+        # Rejected or unexpected batch: retry the inputs one by one so a
+        # single bad input doesn't fail (and negative-cache) the others
+        logger.warning(f"Batched call to {model} failed, retrying {len(inputs)} inputs individually")
+        return [self._request(text, url, max_retries, deadline) for text in inputs]
+
+    def _request(self, inputs, url, max_retries, deadline):
+        """POST to the inference API; returns (result, cache TTL or None).
+
+        Every attempt goes through inference_breaker: while it is open the
+        call returns at once, and 5xx, 429 and connection errors count as
+        failures. 503 retries wait for the API's estimated_time (or an
+        exponential backoff) but never past the deadline.
+        """
+        for attempt in range(max_retries):
+            timeout = HF_REQUEST_TIMEOUT
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logger.warning("Deadline reached before inference call completed")
+                    return None, None
+                timeout = min(timeout, remaining)
+
+            if not inference_breaker.allow():
+                logger.info("Inference API circuit breaker is open, skipping call")
+                return None, None
+
+            try:
+                response = hf_session.post(
+                    url,
+                    json={"inputs": inputs},
+                    timeout=timeout
+                )
+            except requests.exceptions.RequestException as e:
+                logger.error(f"Request error on attempt {attempt + 1}: {e}")
+                inference_breaker.record_failure()
+                if attempt == max_retries - 1:
+                    return None, None
+                continue
+
+            if response.status_code == 200:
+                inference_breaker.record_success()
+                return response.json(), INFERENCE_CACHE_TTL
+            elif 400 <= response.status_code < 500 and response.status_code != 429:
+                # The API is up; the input was rejected
+                inference_breaker.record_success()
+                logger.error(f"API error: {response.status_code} - {response.text}")
+                return None, INFERENCE_NEGATIVE_TTL
+
+            inference_breaker.record_failure()
+            if response.status_code != 503:
+                logger.error(f"API error: {response.status_code} - {response.text}")
+                return None, None
+
+            logger.warning(f"Model loading, attempt {attempt + 1}/{max_retries}")
+            if attempt < max_retries - 1:
+                backoff = self._retry_delay(response, attempt)
+                if deadline is not None and time.monotonic() + backoff >= deadline:
+                    return None, None
+                time.sleep(backoff)
+        
+        return None, None
+
+    @staticmethod
+    def _retry_delay(response, attempt):
+        """Seconds to wait before retrying a 503: the API's own estimate if given"""
+        try:
+            estimate = float(response.headers.get("Retry-After") or response.json().get("estimated_time"))
+        except (TypeError, ValueError, AttributeError):
+            estimate = None
+        return min(estimate, HF_REQUEST_TIMEOUT) if estimate and estimate > 0 else 2 ** attempt  # Exponential backoff
+
+    def stats(self):
+        return {"backend": self.name, "circuit_breaker": inference_breaker.stats()}
+
+class LocalONNXBackend(InferenceBackend):
+    """Seq2seq models exported to ONNX, run on the local CPU.
+
+    Each model is loaded once per worker process on first use, from
+    LOCAL_MODEL_DIR/<org>--<name> when that folder exists (e.g. a quantized
+    `optimum-cli export onnx` output) and otherwise exported from the Hub.
+    Inputs are tokenized and generated LOCAL_BATCH_SIZE at a time. Needs the
+    optional `optimum[onnxruntime]` and `transformers` packages.
+    """
+    name = "local"
+
+    def __init__(self):
+        self._models = {}
+        self._failed = set()
+        self._load_lock = threading.Lock()
+        self._run_lock = threading.Lock()  # one generate() at a time; ORT already uses every core
+        self.batches = 0
+        self.inputs = 0
+
+    def _load(self, model):
+        if model in self._models or model in self._failed:
+            return self._models.get(model)
+        with self._load_lock:
+            if model in self._models or model in self._failed:
+                return self._models.get(model)
+            try:
+                import onnxruntime
+                from optimum.onnxruntime import ORTModelForSeq2SeqLM
+                from transformers import AutoTokenizer
+            except ImportError as e:
+                logger.error(f"Local inference backend unavailable: {e}")
+                self._failed.add(model)
+                return None
+
+            local_path = os.path.join(LOCAL_MODEL_DIR, model.replace('/', '--'))
+            source = local_path if os.path.isdir(local_path) else model
+            options = onnxruntime.SessionOptions()
+            if LOCAL_NUM_THREADS:
+                options.intra_op_num_threads = LOCAL_NUM_THREADS
+            started = time.monotonic()
+            try:
+                tokenizer = AutoTokenizer.from_pretrained(source)
+                onnx_model = ORTModelForSeq2SeqLM.from_pretrained(
+                    source, export=source == model, session_options=options, provider="CPUExecutionProvider"
+                )
+            except Exception as e:
+                logger.error(f"Failed to load local model {model}: {e}")
+                self._failed.add(model)
+                return None
+            logger.info(f"Loaded local model {model} from {source} in {time.monotonic() - started:.1f}s")
+            self._models[model] = (tokenizer, onnx_model)
+            return self._models[model]
+
+    def infer(self, model, inputs, max_retries=3, deadline=None):
+        loaded = self._load(model)
+        if loaded is None:
+            return [(None, None)] * len(inputs)
+        tokenizer, onnx_model = loaded
+        key = "summary_text" if model in SUMMARIZATION_MODELS else "generated_text"
+
+        results = []
+        for i in range(0, len(inputs), LOCAL_BATCH_SIZE):
+            batch = inputs[i:i + LOCAL_BATCH_SIZE]
+            if deadline is not None and time.monotonic() >= deadline:
+                logger.warning("Deadline reached before local inference completed")
+                results.extend([(None, None)] * len(batch))
+                continue
+            try:
+                encoded = tokenizer(batch, padding=True, truncation=True, max_length=512, return_tensors="pt")
+                with self._run_lock:
+                    output_ids = onnx_model.generate(**encoded, max_new_tokens=LOCAL_MAX_NEW_TOKENS)
+                self.batches += 1
+                self.inputs += len(batch)
+            except Exception as e:
+                logger.error(f"Local inference failed for {model}: {e}")
+                results.extend([(None, None)] * len(batch))
+                continue
+            texts = tokenizer.batch_decode(output_ids, skip_special_tokens=True)
+            results.extend(([{key: text.strip()}], INFERENCE_CACHE_TTL) for text in texts)
+        return results
+
+    def stats(self):
+        return {
+            "backend": self.name,
+            "loaded_models": sorted(self._models),
+            "failed_models": sorted(self._failed),
+            "batches": self.batches,
+            "inputs": self.inputs
+        }
+
+class StubBackend(InferenceBackend):
+    """Deterministic offline backend for tests and local development.
+
+    Answers with text derived only from the input, in the formats the
+    response parsers expect, and never touches the network.
+    """
+    name = "stub"
+
+    def infer(self, model, inputs, max_retries=3, deadline=None):
+        return [(self._respond(model, text), None) for text in inputs]
+
+    @staticmethod
+    def _respond(model, text):
+        sentences = [s.strip() for s in SENTENCE_SPLIT_RE.split(' '.join(text.split())) if s.strip()]
+        if not sentences:
+            return None
+        if model in SUMMARIZATION_MODELS:
+            return [{"summary_text": '. '.join(sentences[:2]).rstrip('.') + '.'}]
+        words = sentences[0].split()
+        topic = ' '.join(words[:6]).rstrip('.,;:')
+        return [{"generated_text": f"Question: What does the text say about {topic}? Answer: {sentences[0]}"}]
+
+INFERENCE_BACKENDS = {
+    "huggingface": HuggingFaceBackend,
+    "local": LocalONNXBackend,
+    "stub": StubBackend
+}
+if INFERENCE_BACKEND not in INFERENCE_BACKENDS:
+    raise ValueError(f"Unknown INFERENCE_BACKEND {INFERENCE_BACKEND!r}, expected one of {', '.join(INFERENCE_BACKENDS)}")
+
+_inference_backend = None
+_inference_backend_lock = threading.Lock()
+
+def get_inference_backend():
+    """The configured InferenceBackend, created on first use"""
+    global _inference_backend
+    if _inference_backend is None:
+        with _inference_backend_lock:
+            if _inference_backend is None:
+                _inference_backend = INFERENCE_BACKENDS[INFERENCE_BACKEND]()
+    return _inference_backend
+
+# --- Concept Extraction Patterns ---
+# Compiled once at import. Definition/fact patterns never cross a sentence
+# terminator, so extraction works sentence by sentence: one anchor scan per
+# sentence finds every keyword, then the term in front of it is resolved by
+# walking back over whitespace instead of letting a `\w+(?:\s+\w+)*` group
+# backtrack across the whole text.
+WHITESPACE_RE = re.compile(r'\s+')
+SENTENCE_SPLIT_RE = re.compile(r'[.!?]+')
+SENTENCE_RE = re.compile(r'[^.!?]+')
+LEADING_SPACE_RE = re.compile(r'\s*')
+TERM_BREAK_RE = re.compile(r'[^\w\s]')
+CAUSE_SPLIT_RE = re.compile(r'\s+(?:causes?|results?\s+in|leads?\s+to)\s+', re.IGNORECASE)
+
+# Zero-width alternation: every anchor starts with a distinct prefix, so one
+# finditer over a sentence reports each anchor exactly once.
+CONCEPT_ANCHOR_RE = re.compile(r"""
+    (?=
+        (?P<definition>(?<=\s)(?:is|are|means?|refers?\s+to|defined?\s+as)(?=\s))
+      | (?P<cause>(?<=\s)(?:causes?|results?\s+in|leads?\s+to)(?=\s))
+      | (?P<labeled>Definition:)
+      | (?P<note>(?:Important|Key|Note|Remember):)
+      | (?P<source>(?:According\ to|Research\ shows|Studies\ indicate)(?=\s))
+      | (?P<colon>:)
+    )
+""", re.IGNORECASE | re.VERBOSE)
+
+LABELED_DEFINITION_TAIL_RE = re.compile(r'\s*(\w+(?:\s+\w+)*)\s*[-–]\s*([^.!?]+)')
+
+# Bullets are matched from their own line start; `[^\S\n]*` keeps the
+# leading indent from sliding across blank lines (quadratic on long gaps).
+LIST_ITEM_RE = re.compile(r'(?:^|\n)[^\S\n]*(?:\d+\.|\*|\-|\•)\s*([^.\n]+(?:\.[^.\n]*)*)', re.MULTILINE)
+LIST_BLOCK_RE = re.compile(r'(?:Steps?|Processes?|Stages?):\s*\n((?:\s*(?:\d+\.|\*|\-)\s*[^\n]+\n?)+)', re.MULTILINE | re.IGNORECASE)
+
+AI_QA_PATTERNS = [
+    re.compile(r'(?:Question|Q):\s*([^?\n]+\?)\s*(?:Answer|A):\s*([^\n]+)', re.MULTILINE | re.IGNORECASE),
+    re.compile(r'(\d+\.\s*[^?\n]+\?)\s*([^\d\n]+?)(?=\d+\.|$)', re.MULTILINE | re.IGNORECASE),
+    re.compile(r'([^?\n]+\?)\s*([^\?\n]+?)(?=[^?\n]+\?|$)', re.MULTILINE | re.IGNORECASE)
+]
+
+QUESTION_NORMALIZE_RE = re.compile(r'[^\w\s]')
+ANSWER_PREFIX_RE = re.compile(r'^(Answer:|A:)\s*', re.IGNORECASE)
+
+# --- Near-Duplicate Detection ---
+# Questions are fingerprinted with a 64-bit SimHash over word unigrams and
+# bigrams (stopwords dropped), so paraphrases land a few bits apart. The
+# index splits each fingerprint into NEAR_DUP_MAX_DISTANCE + 1 bands; by the
+# pigeonhole principle any two fingerprints within that Hamming distance
+# share at least one band, so lookups only compare against bucket mates.
+NEAR_DUP_MAX_DISTANCE = int(os.getenv('NEAR_DUP_MAX_DISTANCE', '3'))  # 0 disables near-dup checks
+
+QUESTION_TOKEN_RE = re.compile(r'\w+')
+QUESTION_STOPWORDS = frozenset(
+    "a an the of to in on for and or is are was were be been does do did what which who whom "
+    "how why when where this that these those it its as by with about from into you your "
+    "would should could can s".split()
+)
+
+def question_simhash(question):
+    """64-bit SimHash of a question, as a signed int (fits BIGINT/INTEGER)"""
+    tokens = [t for t in QUESTION_TOKEN_RE.findall(question.lower()) if t not in QUESTION_STOPWORDS]
+    features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    if not features:
+        features = [question.lower().strip()]
+    bits = [
+        format(int.from_bytes(hashlib.blake2b(f.encode('utf-8'), digest_size=8).digest(), 'big'), '064b')
+        for f in features
+    ]
+    value = 0
+    for column in zip(*bits):
+        value = (value << 1) | (2 * column.count('1') > len(features))
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+def hamming_distance(a, b):
+    return bin((a ^ b) & 0xFFFFFFFFFFFFFFFF).count('1')
+
+class NearDuplicateIndex:
+    """LSH index over SimHash fingerprints for sublinear near-dup lookups"""
+
+    def __init__(self, max_distance=3):
+        self.max_distance = max_distance
+        bands = max_distance + 1
+        widths = [64 // bands + (1 if i < 64 % bands else 0) for i in range(bands)]
+        self._bands = []
+        offset = 0
+        for width in widths:
+            self._bands.append((offset, (1 << width) - 1))
+            offset += width
+        self._buckets = [{} for _ in self._bands]
+        self._hashes = {}
+
+    def _band_keys(self, value):
+        value &= 0xFFFFFFFFFFFFFFFF
+        return [(value >> offset) & mask for offset, mask in self._bands]
+
+    def add(self, key, value):
+        self.remove(key)
+        self._hashes[key] = value
+        for buckets, band in zip(self._buckets, self._band_keys(value)):
+            buckets.setdefault(band, set()).add(key)
+
+    def remove(self, key):
+        value = self._hashes.pop(key, None)
+        if value is None:
+            return
+        for buckets, band in zip(self._buckets, self._band_keys(value)):
+            bucket = buckets.get(band)
+            if bucket:
+                bucket.discard(key)
+                if not bucket:
+                    del buckets[band]
+
+    def find(self, value):
+        """Keys whose fingerprint is within max_distance bits of ``value``"""
+        candidates = set()
+        for buckets, band in zip(self._buckets, self._band_keys(value)):
+            candidates.update(buckets.get(band, ()))
+        return [key for key in candidates if hamming_distance(self._hashes[key], value) <= self.max_distance]
+
+    def clear(self):
+        self._hashes.clear()
+        for buckets in self._buckets:
+            buckets.clear()
+
+    def __len__(self):
+        return len(self._hashes)
+
+class QuestionDeduper:
+    """Exact + near-duplicate filter for questions seen during one generation"""
+
+    def __init__(self, max_distance=None):
+        max_distance = NEAR_DUP_MAX_DISTANCE if max_distance is None else max_distance
+        self._exact = set()
+        self._near = NearDuplicateIndex(max_distance) if max_distance > 0 else None
+
+    def add_if_new(self, question):
+        """Record the question; False if it duplicates one already seen"""
+        normalized = QUESTION_NORMALIZE_RE.sub('', question.lower())
+        if normalized in self._exact:
+            return False
+        fingerprint = None
+        if self._near is not None:
+            fingerprint = question_simhash(question)
+            if self._near.find(fingerprint):
+                return False
+        self._exact.add(normalized)
+        if fingerprint is not None:
+            self._near.add(normalized, fingerprint)
+        return True
+
+class SavedQuestionIndex:
+    """Near-duplicate indexes over saved cards, one per deck.
+
+    Each deck is loaded lazily from the persisted question_simhash column
+    and remembered with the deck version it was read at. While the version
+    is unchanged nothing is queried; once it moves, rows newer than the
+    highest id seen are fetched by a cheap range query, and the deck's card
+    count and id sum are compared with the table. A mismatch means rows
+    committed out of id order or were deleted by another worker, and the
+    deck is reloaded. Matches are still re-checked against the table before
+    being reported.
+    """
+
+    def __init__(self, max_distance):
+        self.max_distance = max_distance
+        self.enabled = max_distance > 0
+        self._decks = {}  # deck id -> NearDuplicateIndex
+        self._deck_state = {}  # deck id -> {"version", "last_id", "count", "id_sum"}
+        self._card_decks = {}  # card id -> deck id
+        self._rebuilds = 0
+        self._lock = threading.Lock()
+
+    def _add(self, card_id, deck_id, fingerprint):
+        if card_id in self._card_decks:
+            return
+        self._decks[deck_id].add(card_id, fingerprint)
+        self._card_decks[card_id] = deck_id
+        state = self._deck_state[deck_id]
+        state["last_id"] = max(state["last_id"], card_id)
+        state["count"] += 1
+        state["id_sum"] += card_id
+
+    def _remove(self, card_id):
+        deck_id = self._card_decks.pop(card_id, None)
+        if deck_id is not None:
+            self._decks[deck_id].remove(card_id)
+            state = self._deck_state[deck_id]
+            state["count"] -= 1
+            state["id_sum"] -= card_id
+
+    def _install(self, deck_id, version, rows):
+        """Replace a deck's entries with freshly read rows, unless a refresh
+        that saw a newer deck version got there first"""
+        state = self._deck_state.get(deck_id)
+        if state is not None and (state["version"] or 0) > (version or 0):
+            return
+        for card_id in [card_id for card_id, owner in self._card_decks.items() if owner == deck_id]:
+            del self._card_decks[card_id]
+        self._decks[deck_id] = NearDuplicateIndex(self.max_distance)
+        self._deck_state[deck_id] = {"version": version, "last_id": 0, "count": 0, "id_sum": 0}
+        for card_id, fingerprint in rows:
+            self._add(card_id, deck_id, fingerprint)
+
+    def _fetch(self, cursor, deck_id, after_id):
+        cursor.execute(
+            "SELECT id, question_simhash FROM flashcards "
+            "WHERE deck_id = %s AND id > %s AND question_simhash IS NOT NULL ORDER BY id",
+            (deck_id, after_id)
+        )
+        return cursor.fetchall()
+
+    def refresh(self, cursor, deck_id):
+        # Queries run without the lock, which is only held to read and apply
+        # state, so saves in other decks never wait on this connection
+        if not self.enabled:
+            return
+        version = deck_version(cursor, deck_id)
+        with self._lock:
+            state = self._deck_state.get(deck_id)
+            if state is not None and state["version"] == version:
+                return
+            last_id = state["last_id"] if state is not None else None
+
+        if last_id is not None:
+            rows = self._fetch(cursor, deck_id, last_id)
+            cursor.execute(
+                "SELECT COUNT(*), COALESCE(SUM(id), 0) FROM flashcards "
+                "WHERE deck_id = %s AND question_simhash IS NOT NULL",
+                (deck_id,)
+            )
+            count, id_sum = cursor.fetchone()
+            with self._lock:
+                for card_id, fingerprint in rows:
+                    self._add(card_id, deck_id, fingerprint)
+                state = self._deck_state[deck_id]
+                if (int(count), int(id_sum)) == (state["count"], state["id_sum"]):
+                    if (version or 0) >= (state["version"] or 0):
+                        state["version"] = version
+                    return
+                self._rebuilds += 1
+
+        rows = self._fetch(cursor, deck_id, 0)
+        with self._lock:
+            self._install(deck_id, version, rows)
+
+    def find_existing(self, cursor, deck_id, fingerprints):
+        """Map position -> id of a saved near-duplicate in the deck, for each fingerprint"""
+        if not self.enabled or not fingerprints:
+            return {}
+        self.refresh(cursor, deck_id)
+        with self._lock:
+            index = self._decks.get(deck_id)
+            if index is None:
+                return {}
+            matches = {i: index.find(fp) for i, fp in enumerate(fingerprints)}
+        candidate_ids = sorted({card_id for ids in matches.values() for card_id in ids})
+        if not candidate_ids:
+            return {}
+        placeholders = ", ".join(["%s"] * len(candidate_ids))
+        cursor.execute(
+            f"SELECT id FROM flashcards WHERE deck_id = %s AND id IN ({placeholders})",
+            (deck_id, *candidate_ids)
+        )
+        alive = {row[0] for row in cursor.fetchall()}
+        with self._lock:
+            for card_id in set(candidate_ids) - alive:
+                self._remove(card_id)
+        return {
+            i: min(ids_alive)
+            for i, ids in matches.items()
+            if (ids_alive := [card_id for card_id in ids if card_id in alive])
+        }
+
+    def remove(self, card_ids):
+        if self.enabled:
+            with self._lock:
+                for card_id in card_ids:
+                    self._remove(card_id)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "max_distance": NEAR_DUP_MAX_DISTANCE,
+                "indexed": len(self._card_decks),
+                "decks": len(self._decks),
+                "rebuilds": self._rebuilds
+            }
+
+saved_question_index = SavedQuestionIndex(NEAR_DUP_MAX_DISTANCE)
+
+# --- Salience Ranking ---
+# Which cards survive the session cap, and which chunks get AI calls, is
+# decided by TF-IDF over the document's own chunks rather than extraction
+# order. Each card is scored by how close it sits to the document centroid
+# (salience) and how much of its question is made of the document's terms
+# (coverage), then picked greedily with maximal marginal relevance so
+# near-identical cards do not crowd out the rest of the material.
+SALIENCE_MMR_LAMBDA = float(os.getenv('SALIENCE_MMR_LAMBDA', '0.7'))  # 1 = pure relevance, 0 = pure diversity
+SALIENCE_AI_CHUNKS = int(os.getenv('SALIENCE_AI_CHUNKS', '3'))        # top-ranked chunks sent for AI enhancement
+
+def salience_tokens(text):
+    return [t for t in QUESTION_TOKEN_RE.findall(text.lower()) if t not in QUESTION_STOPWORDS and not t.isdigit()]
+
+class SalienceRanker:
+    """TF-IDF model of one document, built from its chunks.
+
+    Term counts are assembled from flat (row, term) index arrays with
+    np.add.at and weighted with smoothed IDF; rows are L2-normalised so
+    dot products are cosine similarities. The vocabulary is the document's
+    own, so matrices stay small for anything below STREAMING_THRESHOLD.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+        self.vocabulary = {}
+        rows, cols = [], []
+        for row, chunk in enumerate(self.chunks):
+            for token in salience_tokens(chunk):
+                rows.append(row)
+                cols.append(self.vocabulary.setdefault(token, len(self.vocabulary)))
+
+        counts = np.zeros((len(self.chunks), len(self.vocabulary)))
+        np.add.at(counts, (np.array(rows, dtype=np.intp), np.array(cols, dtype=np.intp)), 1.0)
+        document_frequency = np.count_nonzero(counts, axis=0)
+        self.idf = np.log((1.0 + len(self.chunks)) / (1.0 + document_frequency)) + 1.0
+        self.chunk_vectors = self._normalise(counts * self.idf)
+        centroid = self.chunk_vectors.sum(axis=0)
+        norm = np.linalg.norm(centroid)
+        self.centroid = centroid / norm if norm else centroid
+
+    @staticmethod
+    def _normalise(matrix):
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+
+    def vectorize(self, texts):
+        """TF-IDF rows for new texts; words outside the document are ignored"""
+        rows, cols = [], []
+        for row, text in enumerate(texts):
+            for token in salience_tokens(text):
+                col = self.vocabulary.get(token)
+                if col is not None:
+                    rows.append(row)
+                    cols.append(col)
+        counts = np.zeros((len(texts), len(self.vocabulary)))
+        np.add.at(counts, (np.array(rows, dtype=np.intp), np.array(cols, dtype=np.intp)), 1.0)
+        return self._normalise(counts * self.idf)
+
+    def card_scores(self, cards):
+        """Relevance of each card: centroid similarity weighted by coverage"""
+        vectors = self.vectorize([f"{card['question']} {card['answer']}" for card in cards])
+        salience = vectors @ self.centroid
+        coverage = np.array([
+            sum(token in self.vocabulary for token in tokens) / len(tokens) if tokens else 0.0
+            for tokens in (salience_tokens(card["question"]) for card in cards)
+        ])
+        return vectors, salience * (0.5 + 0.5 * coverage)
+
+    def _mmr_order(self, vectors, scores, k):
+        """Indexes of the k best rows by maximal marginal relevance"""
+        k = min(k, len(scores))
+        if not len(self.vocabulary) or not scores.any():
+            return list(range(k))
+        similarity = vectors @ vectors.T
+        chosen = []
+        redundancy = np.zeros(len(scores))
+        available = np.ones(len(scores), dtype=bool)
+        for _ in range(k):
+            marginal = SALIENCE_MMR_LAMBDA * scores - (1.0 - SALIENCE_MMR_LAMBDA) * redundancy
+            best = int(np.argmax(np.where(available, marginal, -np.inf)))
+            chosen.append(best)
+            available[best] = False
+            redundancy = np.maximum(redundancy, similarity[best])
+        return chosen
+
+    def select_cards(self, cards, k):
+        """The k cards to keep, most relevant first"""
+        if not cards:
+            return []
+        vectors, scores = self.card_scores(cards)
+        return [cards[i] for i in self._mmr_order(vectors, scores, k)]
+
+    def top_chunks(self, k):
+        """The k most central, mutually diverse chunks, in document order"""
+        scores = self.chunk_vectors @ self.centroid
+        return [self.chunks[i] for i in sorted(self._mmr_order(self.chunk_vectors, scores, k))]
+
+@timed_stage("rank")
+def rank_flashcards(ranker, flashcards, limit):
+    """Keep the ``limit`` most salient, least redundant cards for the document"""
+    return ranker.select_cards(flashcards, limit)
+
+# --- AI Helper Functions ---
+@timed_stage("split")
+def clean_and_split_text(text):
+    """Clean and split text into meaningful chunks for processing"""
+    # Remove extra whitespace and normalize
+    text = WHITESPACE_RE.sub(' ', text.strip())
+    
+    # Split by sentences, paragraphs, or logical breaks
+    chunks = []
+    
+    # Split by paragraphs first
+    paragraphs = text.split('\n')
+    
+    for paragraph in paragraphs:
+        paragraph = paragraph.strip()
+        if len(paragraph) > 20:  # Only process substantial paragraphs
+            # Split long paragraphs into sentences
+            sentences = SENTENCE_SPLIT_RE.split(paragraph)
+            
+            current_chunk = ""
+            for sentence in sentences:
+                sentence = sentence.strip()
+                if sentence:
+                    if len(current_chunk + sentence) < 200:  # Keep chunks manageable
+                        current_chunk += sentence + ". "
+                    else:
+                        if current_chunk:
+                            chunks.append(current_chunk.strip())
+                        current_chunk = sentence + ". "
+            
+            if current_chunk:
+                chunks.append(current_chunk.strip())
+    
+    return chunks
+
+def _sentence_tail(sentence, start, min_space):
+    r"""Text captured by `\s{min_space,}([^.!?]+)` at ``start``, or None.
+
+    Mirrors the regex: leading whitespace is skipped, but gives one
+    character back when nothing else is left to capture.
+    """
+    rest = sentence[start:]
+    space = LEADING_SPACE_RE.match(rest).end()
+    if space < min_space or len(rest) <= min_space:
+        return None
+    return rest[space:] or rest[-1:]
+
+def _term_start(sentence, breaks, pos):
+    r"""Index of the first word character of the [\w\s] run containing ``pos``"""
+    i = bisect.bisect_left(breaks, pos)
+    run_start = breaks[i - 1] + 1 if i else 0
+    return LEADING_SPACE_RE.match(sentence, run_start).end()
+
+def _term_before_keyword(sentence, breaks, anchors):
+    r"""Resolve `(\w+(?:\s+\w+)*)\s+KEYWORD\s+([^.!?]+)` within one sentence.
+
+    The regex matches from the first word of the earliest run of words that
+    contains a usable keyword, and its greedy term stops at the last such
+    keyword in that run. Returns (term, tail) or None.
+    """
+    best = None
+    best_run = None
+    for start, end in anchors:
+        i = start - 1
+        while i >= 0 and sentence[i].isspace():
+            i -= 1
+        if i < 0 or not (sentence[i].isalnum() or sentence[i] == '_'):
+            continue
+        tail = _sentence_tail(sentence, end, 1)
+        if tail is None:
+            continue
+        run = _term_start(sentence, breaks, start)
+        if best_run is not None and run != best_run:
+            break
+        best_run = run
+        best = (sentence[run:i + 1], tail)
+    return best
+
+def _scan_sentence(sentence, found):
+    """Find every definition/fact concept in one sentence, appending the raw
+    regex-equivalent groups to the per-pattern lists in ``found``"""
+    anchors = {}
+    for match in CONCEPT_ANCHOR_RE.finditer(sentence):
+        kind = match.lastgroup
+        anchors.setdefault(kind, []).append(match.span(kind))
+    if not anchors:
+        return
+
+    breaks = None
+    if "definition" in anchors or "cause" in anchors or "colon" in anchors:
+        breaks = [m.start() for m in TERM_BREAK_RE.finditer(sentence)]
+
+    if "definition" in anchors:
+        groups = _term_before_keyword(sentence, breaks, anchors["definition"])
+        if groups:
+            found["definition"].append(groups)
+
+    for start, end in anchors.get("colon", []):
+        # `(\w+(?:\s+\w+)*):\s*([^.!?]+)` - the term must touch the colon
+        if start == 0 or not (sentence[start - 1].isalnum() or sentence[start - 1] == '_'):
+            continue
+        tail = _sentence_tail(sentence, end, 0)
+        if tail is not None:
+            found["colon"].append((sentence[_term_start(sentence, breaks, start - 1):start], tail))
+            break
+
+    for start, end in anchors.get("labeled", []):
+        match = LABELED_DEFINITION_TAIL_RE.match(sentence, end)
+        if match:
+            found["labeled"].append(match.groups())
+            break
+
+    for kind in ("note", "source"):
+        for start, end in anchors.get(kind, []):
+            tail = _sentence_tail(sentence, end, 0 if kind == "note" else 1)
+            if tail is not None:
+                found[kind].append((tail,))
+                break
+
+    if "cause" in anchors:
+        groups = _term_before_keyword(sentence, breaks, anchors["cause"])
+        if groups:
+            found["cause"].append(groups)
+
+@timed_stage("extract")
+def extract_key_concepts(text):
+    """Extract key concepts, terms, and facts from text.
+
+    Runs in linear time: each sentence is scanned once for every pattern
+    anchor. Concepts come out grouped in the same pattern order as before
+    (definitions, lists, facts), each group in text order.
+    """
+    concepts = []
+    found = {kind: [] for kind in ("definition", "colon", "labeled", "note", "source", "cause")}
+    for sentence in SENTENCE_RE.finditer(text):
+        _scan_sentence(sentence.group(), found)
+    
+    # Look for definitions (X is Y, X: Y, Definition: X - Y)
+    for kind in ("definition", "colon", "labeled"):
+        for term, definition in found[kind]:
+            term = term.strip()
+            definition = definition.strip()
+            if len(term) > 2 and len(definition) > 10:
+                concepts.append({
+                    "type": "definition",
+                    "term": term,
+                    "content": definition
+                })
+    
+    # Look for numbered lists or bullet points
+    for pattern in (LIST_ITEM_RE, LIST_BLOCK_RE):
+        for match in pattern.finditer(text):
+            item = match.group(1).strip()
+            if len(item) > 15:
+                concepts.append({
+                    "type": "list_item",
+                    "content": item
+                })
+    
+    # Look for important facts or statements
+    for kind in ("note", "source", "cause"):
+        for groups in found[kind]:
+            fact = " ".join(groups)
+            
+            if len(fact) > 20:
+                concepts.append({
+                    "type": "fact",
+                    "content": fact.strip()
+                })
+    
+    return concepts
+
+@timed_stage("questions")
+def generate_questions_from_concepts(concepts):
+    """Generate question-answer pairs from extracted concepts"""
+    flashcards = []
+    
+    for concept in concepts:
+        if concept["type"] == "definition":
+            # Create definition-based questions
+            term = concept["term"]
+            definition = concept["content"]
+            
+            # Multiple question formats for variety
+            question_formats = [
+                f"What is {term}?",
+                f"Define {term}.",
+                f"How would you explain {term}?",
+                f"What does {term} mean?"
+            ]
+            
+            # Choose the most appropriate format
+            question = question_formats[0]  # Default to "What is X?"
+            
+            flashcards.append({
+                "question": question,
+                "answer": definition,
+                "type": "definition"
+            })
+            
+            # Create reverse question (definition to term)
+            if len(definition) < 100:  # Only for shorter definitions
+                flashcards.append({
                     "question": f"What term is defined as: '{definition}'?",
                     "answer": term,
                     "type": "reverse_definition"
@@ -179,7 +1870,7 @@ def generate_questions_from_concepts(concepts):
             # Generate fact-based questions
             if "causes" in content.lower() or "results in" in content.lower():
                 # Cause-effect questions
-                parts = re.split(r'\s+(?:causes?|results?\s+in|leads?\s+to)\s+', content, flags=re.IGNORECASE)
+                parts = CAUSE_SPLIT_RE.split(content)
                 if len(parts) == 2:
                     flashcards.append({
                         "question": f"What causes {parts[1].strip()}?",
@@ -211,94 +1902,245 @@ def generate_questions_from_concepts(concepts):
     
     return flashcards
 
-def call_huggingface_api(text, model_url, max_retries=3):
-    """Make API call to Hugging Face with retry logic"""
-    for attempt in range(max_retries):
-        try:
-            response = requests.post(
-                model_url,
-                headers=headers,
-                json={"inputs": text[:1000]},  # Limit input length
-                timeout=30
-            )
-            
-            if response.status_code == 200:
-                return response.json()
-            elif response.status_code == 503:
-                logger.warning(f"Model loading, attempt {attempt + 1}/{max_retries}")
-                if attempt < max_retries - 1:
-                    import time
-                    time.sleep(2 ** attempt)  # Exponential backoff
-                continue
-            else:
-                logger.error(f"API error: {response.status_code} - {response.text}")
-                return None
+def inference_cache_key(text, model):
+    digest = hashlib.sha256()
+    digest.update(f"{INFERENCE_BACKEND}:{model}".encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(text.encode('utf-8'))
+    return digest.hexdigest()
+
+def call_huggingface_api(text, model, max_retries=3, deadline=None):
+    """Run a model on ``text`` through the configured inference backend.
+
+    Responses are memoized per (backend, model, input) and concurrent calls
+    for the same input share a single backend call. ``deadline`` is an
+    optional time.monotonic() value; request timeouts and retry backoff are
+    clipped to it and None is returned once it passes.
+    """
+    return call_huggingface_api_batch([text], model, max_retries, deadline)[0]
+
+def estimate_tokens(text):
+    """Rough model token count (about four characters per token)"""
+    return len(text) // 4 + 1
+
+def plan_inference_batches(texts):
+    """Group input indexes into batches bounded by INFERENCE_BATCH_SIZE inputs
+    and INFERENCE_BATCH_TOKENS estimated tokens, keeping input order"""
+    batches = []
+    batch, batch_tokens = [], 0
+    for index, text in enumerate(texts):
+        tokens = estimate_tokens(text)
+        if batch and (len(batch) >= INFERENCE_BATCH_SIZE or batch_tokens + tokens > INFERENCE_BATCH_TOKENS):
+            batches.append(batch)
+            batch, batch_tokens = [], 0
+        batch.append(index)
+        batch_tokens += tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+def call_huggingface_api_batch(texts, model, max_retries=3, deadline=None):
+    """Batched form of call_huggingface_api; returns one result per text.
+
+    Cached inputs are answered from the inference cache and the rest go to
+    the backend in a single call, which the caller should keep within the
+    limits of plan_inference_batches. Each result is cached under its own
+    input, so later single or batched calls reuse it.
+    """
+    texts = [text[:1000] for text in texts]  # Limit input length
+    keys = [inference_cache_key(text, model) for text in texts]
+    results = [inference_cache.get(key) for key in keys]
+    missing = [i for i, result in enumerate(results) if result is _MISSING]
+    if len(missing) < len(texts):
+        INFERENCE_CALLS.inc(len(texts) - len(missing), backend=INFERENCE_BACKEND, outcome="cached")
+    if not missing:
+        return results
+
+    def fetch():
+        with INFERENCE_IN_FLIGHT.track(backend=INFERENCE_BACKEND), \
+                INFERENCE_SECONDS.time(backend=INFERENCE_BACKEND, model=model):
+            answers = get_inference_backend().infer(model, [texts[i] for i in missing], max_retries, deadline)
+        for i, (result, cache_ttl) in zip(missing, answers):
+            if cache_ttl:
+                inference_cache.set(keys[i], result, ttl=cache_ttl)
+            INFERENCE_CALLS.inc(backend=INFERENCE_BACKEND, outcome="ok" if result is not None else "failed")
+        return [result for result, _ in answers]
+
+    flight_key = keys[missing[0]] if len(missing) == 1 else hashlib.sha256(
+        '\0'.join(keys[i] for i in missing).encode('utf-8')).hexdigest()
+    timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+    answers = inference_calls.do(flight_key, fetch, timeout=timeout) or [None] * len(missing)
+    for i, result in zip(missing, answers):
+        results[i] = result
+    return results
+
+def parse_generated_qa(ai_response):
+    """Extract 'Question: ... Answer: ...' cards from a text-generation response"""
+    cards = []
+    if ai_response and isinstance(ai_response, list):
+        for item in ai_response:
+            if isinstance(item, dict) and "generated_text" in item:
+                generated = item["generated_text"]
                 
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Request error on attempt {attempt + 1}: {e}")
-            if attempt == max_retries - 1:
-                return None
-    
-    return None
+                # Parse AI-generated Q&A if formatted correctly
+                if "Question:" in generated and "Answer:" in generated:
+                    parts = generated.split("Answer:")
+                    if len(parts) == 2:
+                        question = parts[0].replace("Question:", "").strip()
+                        answer = parts[1].strip()
+                        
+                        cards.append({
+                            "question": question,
+                            "answer": answer,
+                            "type": "ai_generated"
+                        })
+    return cards
 
-def enhance_flashcards_with_ai(text_chunks):
-    """Use AI to enhance and generate better flashcards"""
-    enhanced_cards = []
+def iter_ai_enhancements(text_chunks, deadline=None):
+    """Yield (chunk index, cards) for each chunk as soon as its AI call completes.
+
+    Chunks are grouped into batches (see plan_inference_batches), one model
+    call per batch, and the batches are sent concurrently through the
+    shared inference thread pool. Calls still running at the deadline are
+    abandoned.
+    """
+    if deadline is None:
+        deadline = time.monotonic() + AI_REQUEST_DEADLINE
     
     # Try to use AI for question generation
-    qa_model_url = f"https://api-inference.huggingface.co/models/{MODELS['qa_generation']}"
+    qa_model = MODELS['qa_generation']
+    text_chunks = text_chunks[:5]  # Limit to prevent overload
+    if INFERENCE_BACKEND == "huggingface" and inference_breaker.is_open():
+        logger.info("Inference API circuit breaker is open, using rule-based cards only")
+        inference_breaker.reject()
+        return
     
-    for chunk in text_chunks[:5]:  # Limit to prevent overload
-        # Try AI-enhanced question generation
-        ai_response = call_huggingface_api(chunk, qa_model_url)
-        
-        if ai_response and isinstance(ai_response, list):
-            for item in ai_response:
-                if isinstance(item, dict) and "generated_text" in item:
-                    generated = item["generated_text"]
-                    
-                    # Parse AI-generated Q&A if formatted correctly
-                    if "Question:" in generated and "Answer:" in generated:
-                        parts = generated.split("Answer:")
-                        if len(parts) == 2:
-                            question = parts[0].replace("Question:", "").strip()
-                            answer = parts[1].strip()
-                            
-                            enhanced_cards.append({
-                                "question": question,
-                                "answer": answer,
-                                "type": "ai_generated"
-                            })
-    
-    return enhanced_cards
+    executor = get_ai_executor()
+    futures = {
+        executor.submit(
+            call_huggingface_api_batch, [text_chunks[i] for i in batch], qa_model, deadline=deadline
+        ): batch
+        for batch in plan_inference_batches(text_chunks)
+    }
+    pending = set(futures)
+    started = time.perf_counter()
+    try:
+        for future in as_completed(futures, timeout=max(0.0, deadline - time.monotonic())):
+            pending.discard(future)
+            if future.exception() is None:
+                for index, response in zip(futures[future], future.result()):
+                    if response is not None:  # failed calls count as unfinished
+                        yield index, parse_generated_qa(response)
+    except FuturesTimeoutError:
+        logger.warning(f"{len(pending)} of {len(futures)} AI calls missed the deadline")
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage="ai_enhance")
+        for future in pending:
+            future.cancel()
 
-def create_comprehensive_flashcards(text):
-    """Main function to create comprehensive flashcards from text"""
+def enhance_flashcards_with_ai(text_chunks, deadline=None):
+    """Use AI to enhance and generate better flashcards.
+
+    Returns the cards from every call that finished before the deadline,
+    in chunk order.
+    """
+    results = dict(iter_ai_enhancements(text_chunks, deadline=deadline))
+    enhanced_cards = []
+    for index in sorted(results):
+        enhanced_cards.extend(results[index])
+    return enhanced_cards
+
+NOTE_SEGMENT_RE = re.compile(r'\n[^\S\n]*\n')
+
+def split_note_segments(text):
+    """Blank-line separated paragraphs of a note, the unit of incremental reuse"""
+    return [segment for segment in NOTE_SEGMENT_RE.split(text) if segment.strip()]
+
+def segment_fingerprint(segment):
+    return hashlib.blake2b(normalize_input_text(segment).encode('utf-8'), digest_size=16).hexdigest()
+
+def process_note_segments(text):
+    """Chunks and rule-based cards for a note, segment by segment.
+
+    Segments seen before (in this or an earlier submission) come from the
+    segment cache; only new or edited ones are split and extracted.
+    Returns (text_chunks, rule_based_cards) in document order.
+    """
+    text_chunks = []
+    rule_based_cards = []
+    extracted = 0
+    for segment in split_note_segments(text):
+        key = segment_fingerprint(segment)
+        result = segment_cache.get(key)
+        if result is _MISSING:
+            extracted += 1
+            result = {
+                "chunks": clean_and_split_text(segment),
+                "cards": generate_questions_from_concepts(extract_key_concepts(segment))
+            }
+            segment_cache.set(key, result)
+        text_chunks.extend(result["chunks"])
+        rule_based_cards.extend(result["cards"])
+    if extracted:
+        logger.info(f"Extracted {extracted} new or changed note segments")
+    return text_chunks, rule_based_cards
+
+def iter_comprehensive_flashcards(text):
+    """Generator form of create_comprehensive_flashcards.
+
+    Yields progress events as the pipeline advances: a "rules" event with
+    the rule-based cards, one "ai_chunk" event per finished AI call, and a
+    final "done" event holding the deduplicated, capped card list. Partial
+    events carry quality-checked cards; the final list is authoritative.
+    """
     flashcards = []
     
-    # Step 1: Clean and prepare text
-    text_chunks = clean_and_split_text(text)
+    # Step 1: Clean, split and extract concepts segment by segment,
+    # reusing the results for paragraphs that have not changed
+    text_chunks, rule_based_cards = process_note_segments(text)
     
     if not text_chunks:
-        return [{
+        yield {"stage": "done", "cards": [{
             "question": "Unable to process the provided text",
             "answer": "Please provide more structured content with clear concepts, definitions, or facts."
-        }]
+        }]}
+        return
     
-    # Step 2: Extract concepts using rule-based approach
-    concepts = extract_key_concepts(text)
-    rule_based_cards = generate_questions_from_concepts(concepts)
+    # Step 2: Start from the rule-based cards
     flashcards.extend(rule_based_cards)
     
+    ranker = SalienceRanker(text_chunks)
+    ai_chunks = ranker.top_chunks(SALIENCE_AI_CHUNKS)  # Limit for performance
+    yield {
+        "stage": "rules",
+        "cards": improve_flashcard_quality(remove_duplicate_flashcards(rule_based_cards)),
+        "chunks_done": 0,
+        "chunks_total": len(ai_chunks)
+    }
+    
     # Step 3: Try to enhance with AI (if available)
+    ai_results = {}
     try:
-        ai_cards = enhance_flashcards_with_ai(text_chunks[:3])  # Limit for performance
-        flashcards.extend(ai_cards)
+        for index, cards in iter_ai_enhancements(ai_chunks):
+            ai_results[index] = cards
+            yield {
+                "stage": "ai_chunk",
+                "chunk": index,
+                "cards": improve_flashcard_quality(cards),
+                "chunks_done": len(ai_results),
+                "chunks_total": len(ai_chunks)
+            }
     except Exception as e:
         logger.warning(f"AI enhancement failed: {e}")
+    # Chunks without a result missed the deadline, failed or were skipped
+    # by the open circuit breaker
+    degraded = len(ai_results) < len(ai_chunks)
+    for index in sorted(ai_results):
+        flashcards.extend(ai_results[index])
     
     # Step 4: Create fallback flashcards if nothing was extracted
     if not flashcards:
+        degraded = True
         # Create basic comprehension questions
         for i, chunk in enumerate(text_chunks[:5]):
             if len(chunk) > 50:
@@ -312,8 +2154,7 @@ def create_comprehensive_flashcards(text):
         if len(text) > 100:
             try:
                 # Try to get AI summary
-                summary_url = f"https://api-inference.huggingface.co/models/{MODELS['text_analysis']}"
-                summary_response = call_huggingface_api(text[:800], summary_url)
+                summary_response = call_huggingface_api(text[:800], MODELS['text_analysis'])
                 
                 if summary_response and isinstance(summary_response, list) and "summary_text" in summary_response[0]:
                     summary = summary_response[0]["summary_text"]
@@ -337,23 +2178,37 @@ def create_comprehensive_flashcards(text):
     flashcards = remove_duplicate_flashcards(flashcards)
     flashcards = improve_flashcard_quality(flashcards)
     
-    # Limit to reasonable number
-    return flashcards[:15]  # Max 15 cards per session
+    # Keep the most salient cards, most relevant first
+    flashcards = rank_flashcards(ranker, flashcards, MAX_SESSION_CARDS)  # Max 15 cards per session
+    yield {"stage": "done", "cards": flashcards, "degraded": degraded}
 
-def remove_duplicate_flashcards(flashcards):
-    """Remove duplicate or very similar flashcards"""
-    unique_cards = []
-    seen_questions = set()
-    
-    for card in flashcards:
-        question_normalized = re.sub(r'[^\w\s]', '', card["question"].lower())
-        
-        if question_normalized not in seen_questions:
-            seen_questions.add(question_normalized)
-            unique_cards.append(card)
-    
-    return unique_cards
+def final_event(events):
+    """Drain a generation event stream and return its "done" event"""
+    done = {"stage": "done", "cards": []}
+    for event in events:
+        if event["stage"] == "done":
+            done = event
+    return done
+
+def final_cards(events):
+    """Drain a generation event stream and return the final card list"""
+    return final_event(events)["cards"]
+
+def create_comprehensive_flashcards(text):
+    """Main function to create comprehensive flashcards from text"""
+    return final_cards(iter_comprehensive_flashcards(text))
+
+@timed_stage("dedup")
+def remove_duplicate_flashcards(flashcards, deduper=None):
+    """Remove duplicate or very similar flashcards.
 
+    Pass a shared QuestionDeduper to deduplicate across batches.
+    """
+    if deduper is None:
+        deduper = QuestionDeduper()
+    return [card for card in flashcards if deduper.add_if_new(card["question"])]
+
+@timed_stage("quality")
 def improve_flashcard_quality(flashcards):
     """Improve the quality and format of flashcards"""
     improved_cards = []
@@ -375,8 +2230,8 @@ def improve_flashcard_quality(flashcards):
         answer = answer[0].upper() + answer[1:] if answer else answer
         
         # Clean up answer
-        answer = re.sub(r'^(Answer:|A:)\s*', '', answer, flags=re.IGNORECASE)
-        answer = re.sub(r'\s+', ' ', answer)
+        answer = ANSWER_PREFIX_RE.sub('', answer)
+        answer = WHITESPACE_RE.sub(' ', answer)
         
         # Limit answer length for better readability
         if len(answer) > 200:
@@ -393,6 +2248,7 @@ def improve_flashcard_quality(flashcards):
     
     return improved_cards
 
+@timed_stage("fallback")
 def create_fallback_flashcards(text):
     """Create basic flashcards when AI processing fails"""
     flashcards = []
@@ -421,33 +2277,1969 @@ def create_fallback_flashcards(text):
     
     return flashcards
 
+class StreamStats:
+    """Time-to-first-card for streamed generations"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.streams = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def record_first_card(self, seconds):
+        with self._lock:
+            self.streams += 1
+            self.total_seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+        logger.info(f"metric time_to_first_card_ms={seconds * 1000:.1f}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "streams": self.streams,
+                "avg_time_to_first_card_ms": round(self.total_seconds / self.streams * 1000, 1) if self.streams else None,
+                "max_time_to_first_card_ms": round(self.max_seconds * 1000, 1)
+            }
+
+stream_stats = StreamStats()
+
+# --- Streaming Generation ---
+# Long notes are processed window by window so cost is bounded by the card
+# budget rather than document size: each window is extracted on its own,
+# cards are deduplicated against everything emitted so far, and reading
+# stops as soon as the budget is met.
+STREAMING_THRESHOLD = int(os.getenv('STREAMING_THRESHOLD', '20000'))  # chars before JSON notes stream
+STREAM_WINDOW_CHARS = int(os.getenv('STREAM_WINDOW_CHARS', '8192'))
+STREAM_HEAD_CHARS = 4000    # leading text kept for AI enhancement and fallbacks
+STREAM_READ_BYTES = 64 * 1024
+
+PARAGRAPH_BREAK_RE = re.compile(r'[.!?][^\S\n]*\n')
+SENTENCE_BREAK_RE = re.compile(r'[.!?]\s')
+
+def iter_request_text(stream, read_size=STREAM_READ_BYTES):
+    """Decode a byte stream (e.g. request.stream) into text blocks"""
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    while True:
+        chunk = stream.read(read_size)
+        if not chunk:
+            break
+        yield decoder.decode(chunk).replace('\r\n', '\n').replace('\r', '\n')
+    tail = decoder.decode(b'', final=True)
+    if tail:
+        yield tail
+
+def _window_cut(buffer, window_size):
+    """Where to end the next window, preferring paragraph then sentence ends"""
+    limit = min(len(buffer), 2 * window_size)
+    for pattern in (PARAGRAPH_BREAK_RE, SENTENCE_BREAK_RE):
+        cut = None
+        for match in pattern.finditer(buffer, window_size // 2, limit):
+            cut = match.end()
+        if cut:
+            return cut
+    if len(buffer) >= 2 * window_size:
+        space = buffer.rfind(' ', window_size, limit)
+        return space + 1 if space > 0 else limit
+    return None  # wait for more text
+
+def iter_text_windows(blocks, window_size=None):
+    """Regroup arbitrary text blocks into windows that end on sentence or
+    paragraph boundaries, holding at most ~2 windows of text in memory"""
+    window_size = window_size or STREAM_WINDOW_CHARS
+    buffer = ""
+    for block in blocks:
+        buffer += block
+        while len(buffer) >= window_size:
+            cut = _window_cut(buffer, window_size)
+            if cut is None:
+                break
+            yield buffer[:cut]
+            buffer = buffer[cut:]
+    if buffer.strip():
+        yield buffer
+
+def iter_streaming_generation_events(blocks, card_limit=MAX_RESPONSE_CARDS):
+    """Generation events for text arriving as a stream of blocks.
+
+    Emits a "rules" event per window with its new cards and stops reading
+    once ``card_limit`` rule-based cards exist. AI enhancement then runs on
+    the leading chunks only, and the usual fallbacks apply to the first
+    STREAM_HEAD_CHARS of text. Ends with a "done" event.
+    """
+    head = ""
+    cards = []
+    deduper = QuestionDeduper()
+    windows = 0
+
+    for window in iter_text_windows(blocks):
+        windows += 1
+        if len(head) < STREAM_HEAD_CHARS:
+            head += window[:STREAM_HEAD_CHARS - len(head)]
+
+        window_cards = generate_questions_from_concepts(extract_key_concepts(window))
+        window_cards = improve_flashcard_quality(remove_duplicate_flashcards(window_cards, deduper))
+        window_cards = window_cards[:card_limit - len(cards)]
+        if window_cards:
+            cards.extend(window_cards)
+            yield {"stage": "rules", "cards": window_cards, "windows": windows}
+        if len(cards) >= card_limit:
+            logger.info(f"Card budget met after {windows} windows, skipping the rest of the text")
+            break
+
+    text_chunks = clean_and_split_text(head)
+    if not text_chunks:
+        yield {"stage": "done", "cards": [{
+            "question": "Unable to process the provided text",
+            "answer": "Please provide more structured content with clear concepts, definitions, or facts."
+        }]}
+        return
+
+    # AI cards can only make the cut if rule-based cards left room
+    degraded = False
+    if len(cards) < card_limit:
+        ai_chunks = SalienceRanker(text_chunks).top_chunks(SALIENCE_AI_CHUNKS)
+        ai_results = {}
+        try:
+            for index, chunk_cards in iter_ai_enhancements(ai_chunks):
+                ai_results[index] = improve_flashcard_quality(remove_duplicate_flashcards(chunk_cards, deduper))
+                yield {
+                    "stage": "ai_chunk",
+                    "chunk": index,
+                    "cards": ai_results[index],
+                    "chunks_done": len(ai_results),
+                    "chunks_total": len(ai_chunks)
+                }
+        except Exception as e:
+            logger.warning(f"AI enhancement failed: {e}")
+        degraded = len(ai_results) < len(ai_chunks)
+        for index in sorted(ai_results):
+            cards.extend(ai_results[index])
+
+    yield from _finish_generation(cards[:MAX_SESSION_CARDS], head, degraded)
+
+def iter_generation_events(text):
+    """Full generation pipeline behind /generate_flashcards, as events.
+
+    Yields the progress events of iter_comprehensive_flashcards followed by
+    an "ai_fallback" event if the fallback models produced cards, and ends
+    with a "done" event holding the final card list. Texts longer than
+    STREAMING_THRESHOLD go through the bounded streaming pipeline instead.
+    """
+    if len(text) > STREAMING_THRESHOLD:
+        yield from iter_streaming_generation_events([text])
+        return
+
+    # Step 1: Create comprehensive flashcards
+    flashcards = []
+    degraded = False
+    for event in iter_comprehensive_flashcards(text):
+        if event["stage"] == "done":
+            flashcards = event["cards"]
+            degraded = event.get("degraded", False)
+        else:
+            yield event
+    
+    yield from _finish_generation(flashcards, text, degraded)
+
+def _finish_generation(flashcards, text, degraded=False):
+    """Fallback and capping steps shared by both generation pipelines.
+
+    The "done" event is marked degraded if AI enhancement did not finish
+    (``degraded``) or the result is made of fallback cards only.
+    """
+    # Step 2: If we have very few cards, try AI enhancement
+    if len(flashcards) < 3:
+        try:
+            logger.info("Attempting AI-enhanced generation...")
+            
+            # Try different AI approaches
+            ai_models_to_try = [
+                {
+                    "model": "google/flan-t5-base",
+                    "prompt": f"Generate 5 study questions and answers from this text: {text[:500]}"
+                },
+                {
+                    "model": MODELS['text_analysis'],
+                    "prompt": text[:800]
+                }
+            ]
+            
+            for model_config in ai_models_to_try:
+                ai_response = call_huggingface_api(model_config["prompt"], model_config["model"])
+                
+                if ai_response:
+                    ai_cards = parse_ai_response(ai_response, text)
+                    if ai_cards:
+                        flashcards.extend(ai_cards)
+                        yield {"stage": "ai_fallback", "cards": ai_cards}
+                        break
+                        
+        except Exception as e:
+            logger.warning(f"AI enhancement failed: {e}")
+    
+    # Step 3: Final fallback if still no good cards
+    if len(flashcards) < 2:
+        logger.info("Using fallback flashcard generation")
+        flashcards = create_fallback_flashcards(text)
+        degraded = True
+    
+    # Step 4: Final processing
+    flashcards = flashcards[:MAX_RESPONSE_CARDS]  # Limit to 12 cards
+    
+    if not flashcards:
+        flashcards = [{
+            "question": "Unable to generate flashcards from this content",
+            "answer": "Please try providing more structured text with clear concepts, definitions, or key facts."
+        }]
+    
+    yield {"stage": "done", "cards": flashcards, "degraded": degraded}
+
+def generate_flashcards_for_text(text):
+    """Run the full generation pipeline and return the final cards"""
+    return final_cards(iter_generation_events(text))
+
+# --- Background Generation Jobs ---
+# Large documents can be generated asynchronously: POST /generate_flashcards
+# with "async": true returns a job id immediately and a worker pool runs the
+# pipeline. Progress events are applied to a job store that /jobs/<id> reads.
+# Set JOB_STORE_PATH to share jobs between gunicorn workers via SQLite.
+JOB_WORKER_MODE = os.getenv('JOB_WORKER_MODE', 'process').lower()  # "process" or "thread"
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '2'))                    # concurrent generation jobs
+JOB_QUEUE_MAX = int(os.getenv('JOB_QUEUE_MAX', '20'))               # queued + running jobs per worker
+JOB_TTL = float(os.getenv('JOB_TTL', '3600'))                       # seconds finished jobs are kept
+JOB_STORE_PATH = os.getenv('JOB_STORE_PATH', '')
+JOB_RELAY_STOP_TIMEOUT = 5  # seconds to wait for a broken pool's event relay to drain
+
+JOB_FINISHED = ("done", "failed")
+
+def _new_job_record(job_id, text_length):
+    now = datetime.now().isoformat()
+    return {
+        "id": job_id,
+        "status": "queued",
+        "progress": {"stage": "queued", "chunks_done": 0, "chunks_total": None},
+        "partial_cards": [],
+        "cards": None,
+        "error": None,
+        "text_length": text_length,
+        "created_at": now,
+        "updated_at": now,
+        "version": 0
+    }
+
+def _apply_job_event(job, event):
+    """Fold one generation event into a job record (in place)"""
+    if job["status"] in JOB_FINISHED:
+        return
+    stage = event.get("stage")
+    job["updated_at"] = datetime.now().isoformat()
+    job["version"] += 1
+    if stage == "failed":
+        job["status"] = "failed"
+        job["error"] = event.get("error")
+    elif stage == "done":
+        job["status"] = "done"
+        job["cards"] = event["cards"]
+    else:
+        job["status"] = "running"
+        job["partial_cards"].extend(event.get("cards", []))
+    job["progress"] = {
+        "stage": stage,
+        "chunks_done": event.get("chunks_done", job["progress"]["chunks_done"]),
+        "chunks_total": event.get("chunks_total", job["progress"]["chunks_total"])
+    }
+
+class InMemoryJobStore:
+    """Job records held in this process; waiters are woken on every update"""
+
+    def __init__(self):
+        self._jobs = {}
+        self._cond = threading.Condition()
+
+    def create(self, job_id, text_length):
+        with self._cond:
+            self._jobs[job_id] = _new_job_record(job_id, text_length)
+
+    def apply(self, job_id, event):
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                _apply_job_event(job, event)
+                self._cond.notify_all()
+
+    def get(self, job_id):
+        with self._cond:
+            job = self._jobs.get(job_id)
+            return json.loads(json.dumps(job)) if job else None
+
+    def wait_for_update(self, job_id, version, timeout):
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self._jobs.get(job_id, {}).get("version", version) != version,
+                timeout=timeout
+            )
+        return self.get(job_id)
+
+    def prune(self, max_age):
+        cutoff = (datetime.now().timestamp() - max_age)
+        with self._cond:
+            for job_id in [
+                job_id for job_id, job in self._jobs.items()
+                if job["status"] in JOB_FINISHED
+                and datetime.fromisoformat(job["updated_at"]).timestamp() < cutoff
+            ]:
+                del self._jobs[job_id]
+
+class SQLiteJobStore:
+    """Job records in a SQLite file so every worker process can serve /jobs"""
+
+    POLL_INTERVAL = 0.25
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        conn = self._connection()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS generation_jobs (
+                id TEXT PRIMARY KEY,
+                record TEXT NOT NULL,
+                status TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        conn.commit()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _save(self, conn, job):
+        conn.execute(
+            "INSERT OR REPLACE INTO generation_jobs (id, record, status, updated_at) VALUES (?, ?, ?, ?)",
+            (job["id"], json.dumps(job), job["status"], time.time())
+        )
+
+    def create(self, job_id, text_length):
+        conn = self._connection()
+        self._save(conn, _new_job_record(job_id, text_length))
+        conn.commit()
+
+    def apply(self, job_id, event):
+        with self._lock:
+            job = self.get(job_id)
+            if job is None:
+                return
+            _apply_job_event(job, event)
+            conn = self._connection()
+            self._save(conn, job)
+            conn.commit()
+
+    def get(self, job_id):
+        row = self._connection().execute(
+            "SELECT record FROM generation_jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def wait_for_update(self, job_id, version, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            if job is None or job["version"] != version or time.monotonic() >= deadline:
+                return job
+            time.sleep(self.POLL_INTERVAL)
+
+    def prune(self, max_age):
+        conn = self._connection()
+        conn.execute(
+            "DELETE FROM generation_jobs WHERE status IN ('done', 'failed') AND updated_at < ?",
+            (time.time() - max_age,)
+        )
+        conn.commit()
+
+job_store = SQLiteJobStore(JOB_STORE_PATH) if JOB_STORE_PATH else InMemoryJobStore()
+
+class JobQueueFullError(Exception):
+    """Raised when JOB_QUEUE_MAX jobs are already queued or running"""
+
+# Set in job worker processes by _init_job_worker; progress events are sent
+# back to the parent through it.
+_job_events_queue = None
+
+def _init_job_worker(events_queue):
+    global _job_events_queue
+    _job_events_queue = events_queue
+
+def run_generation_job(job_id, text, report=None):
+    """Worker entry point: run the pipeline, reporting each event.
+
+    In process mode ``report`` is None and events go through the queue set
+    up by _init_job_worker. Returns the final "done" event.
+    """
+    if report is None:
+        report = lambda event: _job_events_queue.put((job_id, event))
+    done = {"stage": "done", "cards": []}
+    for event in iter_generation_events(text):
+        if event["stage"] == "done":
+            done = event
+        # "done" goes through the same channel so it can't overtake progress
+        report(event)
+    return done
+
+class JobRunner:
+    """Bounded worker pool for generation jobs.
+
+    Process mode uses spawned processes (forking would copy this process's
+    live thread pools and sockets) and relays their progress events through
+    a multiprocessing queue drained by a listener thread. Thread mode runs
+    jobs in this process and applies events directly.
+    """
+
+    def __init__(self, store, workers=2, queue_max=20, mode="process"):
+        self.store = store
+        self.workers = workers
+        self.queue_max = queue_max
+        self.mode = mode
+        self._executor = None
+        self._events = None
+        self._relay = None
+        self._lock = threading.Lock()
+        self._active = 0
+        self._stats = {"submitted": 0, "completed": 0, "failed": 0, "rejected": 0}
+
+    def _ensure_started(self):
+        if self._executor is not None:
+            return
+        if self.mode == "process":
+            context = multiprocessing.get_context("spawn")
+            self._events = context.Queue()
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=context,
+                initializer=_init_job_worker,
+                initargs=(self._events,)
+            )
+            self._relay = threading.Thread(
+                target=self._relay_events, args=(self._events,), name="job-events", daemon=True
+            )
+            self._relay.start()
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="job")
+
+    def _restart(self):
+        """Replace a broken pool, stopping the old pool's event relay first"""
+        executor, events, relay = self._executor, self._events, self._relay
+        self._executor = self._events = self._relay = None
+        executor.shutdown(wait=False, cancel_futures=True)
+        if relay is not None:
+            # The sentinel queues behind any events the old workers sent
+            events.put(None)
+            relay.join(timeout=JOB_RELAY_STOP_TIMEOUT)
+            if relay.is_alive():
+                logger.warning("Job event relay did not stop in time")
+            events.close()
+        self._ensure_started()
+
+    def _relay_events(self, events):
+        while True:
+            item = events.get()
+            if item is None:
+                break
+            job_id, event = item
+            try:
+                self.store.apply(job_id, event)
+            except Exception as e:
+                logger.error(f"Failed to record progress for job {job_id}: {e}")
+
+    def submit(self, text, cache_key=None):
+        with self._lock:
+            if self._active >= self.queue_max:
+                self._stats["rejected"] += 1
+                raise JobQueueFullError(f"{self._active} generation jobs already queued")
+            self._ensure_started()
+            executor = self._executor
+            self._active += 1
+            self._stats["submitted"] += 1
+
+        job_id = uuid.uuid4().hex
+        try:
+            self.store.prune(JOB_TTL)
+            self.store.create(job_id, len(text))
+            try:
+                future = self._submit(job_id, text)
+            except BrokenExecutor:
+                # A crashed worker process poisons the whole pool; start a new one
+                logger.warning("Job worker pool was broken, restarting it")
+                with self._lock:
+                    if self._executor is executor:
+                        self._restart()
+                future = self._submit(job_id, text)
+        except Exception:
+            with self._lock:
+                self._active -= 1
+            raise
+        future.add_done_callback(lambda f: self._finish(job_id, cache_key, f))
+        return job_id
+
+    def _submit(self, job_id, text):
+        if self.mode == "process":
+            return self._executor.submit(run_generation_job, job_id, text)
+        return self._executor.submit(
+            run_generation_job, job_id, text,
+            lambda event: self.store.apply(job_id, event)
+        )
+
+    def _finish(self, job_id, cache_key, future):
+        with self._lock:
+            self._active -= 1
+        try:
+            done = future.result()
+        except Exception as e:
+            logger.error(f"Generation job {job_id} failed: {e}")
+            self.store.apply(job_id, {"stage": "failed", "error": "An error occurred while generating flashcards"})
+            with self._lock:
+                self._stats["failed"] += 1
+            return
+        if cache_key:
+            cache_generation_result(cache_key, done)
+        with self._lock:
+            self._stats["completed"] += 1
+        logger.info(f"Generation job {job_id} finished with {len(done['cards'])} flashcards")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "workers": self.workers,
+                "queue_max": self.queue_max,
+                "active": self._active,
+                **self._stats
+            }
+
+job_runner = JobRunner(job_store, workers=JOB_WORKERS, queue_max=JOB_QUEUE_MAX, mode=JOB_WORKER_MODE)
+
+def job_response(job):
+    """Public view of a job record for /jobs/<id>"""
+    done = job["status"] == "done"
+    return {
+        "id": job["id"],
+        "status": job["status"],
+        "progress": job["progress"],
+        "cards": job["cards"] if done else job["partial_cards"],
+        "partial": not done,
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"]
+    }
+
+# --- Decks and Owners ---
+# Every card belongs to a deck and every deck to an owner. Routes act on
+# one deck, chosen with ?deck_id=, a "deck_id" field in the JSON body or an
+# X-Deck-Id header, and fall back to the default deck created by the
+# migration so existing clients keep working.
+DEFAULT_DECK_ID = 1
+DECK_DELETE_BATCH = int(os.getenv('DECK_DELETE_BATCH', '1000'))  # cards deleted per transaction
+
+class DeckNotFoundError(Exception):
+    pass
+
+def request_deck_id():
+    """Deck id named by the current request; raises ValueError if malformed"""
+    value = request.args.get('deck_id') or request.headers.get('X-Deck-Id')
+    if value is None and request.is_json:
+        body = request.get_json(silent=True)
+        value = body.get('deck_id') if isinstance(body, dict) else None
+    if value is None:
+        return DEFAULT_DECK_ID
+    deck_id = int(value)
+    if deck_id < 1:
+        raise ValueError("deck_id must be positive")
+    return deck_id
+
+def require_deck(cursor, deck_id):
+    """Raise DeckNotFoundError unless the deck exists"""
+    cursor.execute("SELECT 1 FROM decks WHERE id = %s", (deck_id,))
+    if cursor.fetchone() is None:
+        raise DeckNotFoundError(deck_id)
+
+def resolve_request_deck(cursor=None):
+    """(deck id, None) for the current request, or (None, error response)
+
+    Pass the route's cursor to look the deck up on its connection; without
+    one a connection is checked out just for the lookup.
+    """
+    try:
+        deck_id = request_deck_id()
+    except (TypeError, ValueError):
+        return None, (jsonify({"error": "Invalid deck_id"}), 400)
+    conn = None
+    if cursor is None:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+    try:
+        require_deck(cursor, deck_id)
+    except DeckNotFoundError:
+        return None, (jsonify({"error": "Deck not found"}), 404)
+    finally:
+        if conn is not None:
+            conn.close()
+    return deck_id, None
+
+def bump_deck_version(cursor, deck_id):
+    """Mark a deck's cards as changed, inside the caller's transaction.
+
+    The version feeds the ETags of listings and search, so every write that
+    adds or removes cards must call this before committing.
+    """
+    cursor.execute("UPDATE decks SET version = version + 1 WHERE id = %s", (deck_id,))
+
+def deck_version(cursor, deck_id):
+    cursor.execute("SELECT version FROM decks WHERE id = %s", (deck_id,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def delete_deck_cards(deck_id, batch_size=None):
+    """Delete every card of a deck, committing every ``batch_size`` rows.
+
+    Each transaction looks up one batch of ids on the (deck_id, ...) index
+    and deletes them by primary key, so row locks are held briefly and
+    other decks are never touched. Returns the number of cards deleted.
+    """
+    batch_size = batch_size or DECK_DELETE_BATCH
+    deleted = 0
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        while True:
+            # No ORDER BY: any batch will do, and sorting by id would make
+            # every batch sort the whole deck instead of reading the index
+            cursor.execute(
+                "SELECT id FROM flashcards WHERE deck_id = %s LIMIT %s",
+                (deck_id, batch_size)
+            )
+            ids = [row[0] for row in cursor.fetchall()]
+            if not ids:
+                break
+            placeholders = ", ".join(["%s"] * len(ids))
+            with DB_QUERY_SECONDS.time(operation="delete_batch"):
+                cursor.execute(f"DELETE FROM flashcards WHERE id IN ({placeholders})", tuple(ids))
+                bump_deck_version(cursor, deck_id)
+                conn.commit()
+            saved_question_index.remove(ids)
+            deleted += len(ids)
+        cursor.close()
+    finally:
+        conn.close()
+    return deleted
+
+def serialize_deck(deck):
+    if isinstance(deck.get('created_at'), datetime):
+        deck['created_at'] = deck['created_at'].isoformat()
+    return deck
+
+# --- Flashcard Storage Helpers ---
+SAVE_BATCH_MAX = int(os.getenv('SAVE_BATCH_MAX', '500'))  # most cards accepted by /save_flashcards
+
+def question_hash(question):
+    """Stable dedup key for a question: SHA-256 of its case/whitespace-normalized text"""
+    normalized = ' '.join(question.split()).casefold()
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+def _insert_ignore_sql():
+    columns = "deck_id, question, answer, question_hash, question_simhash, created_at, due_at"
+    if DB_BACKEND == "sqlite":
+        return (f"INSERT INTO flashcards ({columns}) VALUES (%s, %s, %s, %s, %s, %s, %s) "
+                "ON CONFLICT (deck_id, question_hash) DO NOTHING")
+    return f"INSERT INTO flashcards ({columns}) VALUES (%s, %s, %s, %s, %s, %s, %s) ON DUPLICATE KEY UPDATE id = id"
+
+def insert_flashcards_batch(cursor, deck_id, cards):
+    """Insert a batch of cards into a deck, skipping questions it already has.
+
+    Duplicates inside the batch are dropped in Python, existing questions are
+    found with one IN query on the (deck_id, question_hash) index, and
+    paraphrases of saved or earlier batch questions are caught by the
+    near-duplicate index. The remaining rows go out in a single executemany;
+    the unique index turns any insert that races another writer into a
+    no-op. The caller commits. Cards may carry a ``created_at`` datetime
+    (imports do); the rest are stamped with the current time.
+
+    Returns (inserted, duplicates) as lists of indexes into ``cards``.
+    """
+    first_index = {}
+    duplicates = []
+    for i, card in enumerate(cards):
+        digest = question_hash(card["question"])
+        if digest in first_index:
+            duplicates.append(i)
+        else:
+            first_index[digest] = i
+
+    existing = set()
+    if first_index:
+        placeholders = ", ".join(["%s"] * len(first_index))
+        cursor.execute(
+            f"SELECT question_hash FROM flashcards WHERE deck_id = %s AND question_hash IN ({placeholders})",
+            (deck_id, *first_index)
+        )
+        existing = {row[0] for row in cursor.fetchall()}
+
+    candidates = sorted(i for digest, i in first_index.items() if digest not in existing)
+    duplicates.extend(first_index[digest] for digest in existing)
+
+    fingerprints = {i: question_simhash(cards[i]["question"]) for i in candidates}
+    near_saved = saved_question_index.find_existing(cursor, deck_id, [fingerprints[i] for i in candidates])
+    batch_index = NearDuplicateIndex(NEAR_DUP_MAX_DISTANCE) if NEAR_DUP_MAX_DISTANCE > 0 else None
+    inserted = []
+    for position, i in enumerate(candidates):
+        if position in near_saved or (batch_index is not None and batch_index.find(fingerprints[i])):
+            duplicates.append(i)
+            continue
+        if batch_index is not None:
+            batch_index.add(i, fingerprints[i])
+        inserted.append(i)
+
+    if inserted:
+        now = datetime.now()
+        cursor.executemany(_insert_ignore_sql(), [
+            (deck_id, cards[i]["question"], cards[i]["answer"], question_hash(cards[i]["question"]),
+             fingerprints[i], cards[i].get("created_at") or now, now)
+            for i in inserted
+        ])
+        if cursor.rowcount >= 0 and cursor.rowcount < len(inserted):
+            logger.warning(f"{len(inserted) - cursor.rowcount} cards were saved concurrently by another request")
+        bump_deck_version(cursor, deck_id)
+
+    return inserted, sorted(duplicates)
+
+# --- Spaced Repetition ---
+# SM-2 scheduling. Each card carries its ease factor, interval (days),
+# successful-repetition streak, lapse count and next due time; new cards
+# are due as soon as they are saved. Grades use the SM-2 0-5 scale, or the
+# usual again/hard/good/easy buttons.
+REVIEW_BATCH_MAX = int(os.getenv('REVIEW_BATCH_MAX', '500'))  # most grades accepted per /review call
+DUE_PAGE_MAX = int(os.getenv('DUE_PAGE_MAX', '200'))          # largest allowed /due_cards?limit=
+DEFAULT_EASE = 2.5
+MIN_EASE = 1.3
+REVIEW_GRADE_NAMES = {"again": 1, "hard": 3, "good": 4, "easy": 5}
+
+def parse_review_grade(value):
+    """SM-2 grade 0-5 from a number or button name; raises ValueError"""
+    if isinstance(value, str) and value.strip().lower() in REVIEW_GRADE_NAMES:
+        return REVIEW_GRADE_NAMES[value.strip().lower()]
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError("grade must be 0-5 or one of again/hard/good/easy")
+    grade = int(value)
+    if not 0 <= grade <= 5 or grade != float(value):
+        raise ValueError("grade must be 0-5 or one of again/hard/good/easy")
+    return grade
+
+def sm2_schedule(ease, interval, repetitions, lapses, grades):
+    """Apply one SM-2 review to every card at once.
+
+    All arguments are equal-length sequences (one entry per card); returns
+    new (ease, interval, repetitions, lapses) arrays. Grades of 3 and up
+    grow the interval (1 day, 6 days, then interval * ease); lower grades
+    restart the card at 1 day and count a lapse. Ease moves by the SM-2
+    formula and never drops below MIN_EASE.
+    """
+    ease = np.asarray(ease, dtype=float)
+    interval = np.asarray(interval, dtype=float)
+    repetitions = np.asarray(repetitions, dtype=np.int64)
+    lapses = np.asarray(lapses, dtype=np.int64)
+    grades = np.asarray(grades, dtype=np.int64)
+
+    passed = grades >= 3
+    grown = np.select([repetitions == 0, repetitions == 1], [1.0, 6.0], default=np.round(interval * ease))
+    new_interval = np.where(passed, grown, 1.0)
+    new_repetitions = np.where(passed, repetitions + 1, 0)
+    new_lapses = np.where(passed, lapses, lapses + 1)
+    miss = 5 - grades
+    new_ease = np.maximum(MIN_EASE, ease + (0.1 - miss * (0.08 + miss * 0.02)))
+    return new_ease, new_interval, new_repetitions, new_lapses
+
+def review_flashcards_batch(cursor, deck_id, reviews, now=None):
+    """Record grades for many cards of a deck and reschedule them in one pass.
+
+    ``reviews`` is a list of (card id, grade). The cards' current schedule
+    is read with one IN query, the SM-2 update is computed for all of them
+    together, and the new schedules and review log rows are written with
+    one executemany each. Later grades for the same card in a batch build
+    on earlier ones. Returns the updated schedules by card id, without ids
+    that aren't in the deck. The caller commits.
+    """
+    now = now or datetime.now()
+    ids = sorted({card_id for card_id, _ in reviews})
+    if not ids:
+        return {}
+    placeholders = ", ".join(["%s"] * len(ids))
+    cursor.execute(
+        f"SELECT id, ease, interval_days, repetitions, lapses FROM flashcards "
+        f"WHERE deck_id = %s AND id IN ({placeholders})",
+        (deck_id, *ids)
+    )
+    state = {row[0]: list(row[1:]) for row in cursor.fetchall()}
+
+    # A card graded twice in one batch needs the first result before the
+    # second, so split the batch into rounds with at most one grade per card
+    rounds = []
+    for card_id, grade in reviews:
+        if card_id not in state:
+            continue
+        for batch in rounds:
+            if card_id not in batch:
+                batch[card_id] = grade
+                break
+        else:
+            rounds.append({card_id: grade})
+
+    log_rows = []
+    for batch in rounds:
+        card_ids = list(batch)
+        columns = list(zip(*(state[card_id] for card_id in card_ids)))
+        ease, interval, repetitions, lapses = sm2_schedule(*columns, [batch[c] for c in card_ids])
+        for i, card_id in enumerate(card_ids):
+            state[card_id] = [float(ease[i]), float(interval[i]), int(repetitions[i]), int(lapses[i])]
+            log_rows.append((card_id, batch[card_id], state[card_id][0], state[card_id][1], now))
+
+    updated = {
+        card_id: {
+            "ease": round(values[0], 3),
+            "interval_days": values[1],
+            "repetitions": values[2],
+            "lapses": values[3],
+            "due_at": now + timedelta(days=values[1])
+        }
+        for card_id, values in state.items()
+        if any(card_id in batch for batch in rounds)
+    }
+    if updated:
+        cursor.executemany(
+            "UPDATE flashcards SET ease = %s, interval_days = %s, repetitions = %s, lapses = %s, "
+            "due_at = %s, last_reviewed_at = %s WHERE id = %s",
+            [(s["ease"], s["interval_days"], s["repetitions"], s["lapses"], s["due_at"], now, card_id)
+             for card_id, s in updated.items()]
+        )
+        cursor.executemany(
+            "INSERT INTO flashcard_reviews (card_id, grade, ease, interval_days, reviewed_at) "
+            "VALUES (%s, %s, %s, %s, %s)",
+            log_rows
+        )
+    return updated
+
+def query_due_cards(deck_id, limit, now=None):
+    """The ``limit`` most overdue cards of a deck, served by the (deck_id, due_at, id) index"""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor(dictionary=True)
+        with DB_QUERY_SECONDS.time(operation="due"):
+            cursor.execute(
+                "SELECT id, question, answer, created_at, due_at, ease, interval_days, repetitions, lapses "
+                "FROM flashcards WHERE deck_id = %s AND due_at <= %s ORDER BY due_at, id LIMIT %s",
+                (deck_id, now or datetime.now(), limit)
+            )
+            rows = cursor.fetchall()
+        cursor.close()
+    finally:
+        conn.close()
+    for card in rows:
+        serialize_flashcard(card)
+        if isinstance(card.get("due_at"), datetime):
+            card["due_at"] = card["due_at"].isoformat()
+    return rows
+
+# --- Flashcard Listing Helpers ---
+FLASHCARD_PAGE_MAX = int(os.getenv('FLASHCARD_PAGE_MAX', '500'))  # largest allowed ?limit=
+STREAM_FETCH_SIZE = 500  # rows pulled from the DB per round trip while streaming
+
+def serialize_flashcard(card):
+    """Convert a DB row into a JSON-safe dict"""
+    if card.get('created_at') and isinstance(card['created_at'], datetime):
+        card['created_at'] = card['created_at'].isoformat()
+    return card
+
+def encode_page_cursor(card):
+    """Build the keyset cursor (created_at,id) pointing just past this card"""
+    return f"{card['created_at']},{card['id']}"
+
+def decode_page_cursor(value):
+    """Parse a '<created_at>,<id>' cursor; raises ValueError when malformed"""
+    created_at, card_id = value.rsplit(',', 1)
+    return datetime.fromisoformat(created_at.strip()), int(card_id)
+
+def query_flashcards(deck_id, after=None, limit=None, conn=None):
+    """Run the listing query for a deck and return an iterator over serialized rows.
+
+    Rows come back newest first, ordered by (created_at, id) so the
+    idx_flashcards_deck_created index serves the deck filter, the sort and
+    the keyset seek. The query runs before this returns, so connection and SQL errors
+    surface to the caller. It runs on ``conn`` when given, otherwise on a
+    fresh pooled connection; either way the connection is returned to the
+    pool once the iterator is exhausted or closed.
+    """
+    sql = "SELECT id, question, answer, created_at FROM flashcards WHERE deck_id = %s"
+    params = [deck_id]
+    if after:
+        created_at, card_id = after
+        sql += " AND (created_at < %s OR (created_at = %s AND id < %s))"
+        params.extend([created_at, created_at, card_id])
+    sql += " ORDER BY created_at DESC, id DESC"
+    if limit:
+        sql += " LIMIT %s"
+        params.append(limit)
+
+    conn = conn or get_db_connection()
+    try:
+        cursor = conn.cursor(dictionary=True)
+        with DB_QUERY_SECONDS.time(operation="list"):
+            cursor.execute(sql, tuple(params))
+    except Exception:
+        conn.close()
+        raise
+
+    def rows():
+        try:
+            while True:
+                batch = cursor.fetchmany(STREAM_FETCH_SIZE)
+                if not batch:
+                    break
+                for card in batch:
+                    yield serialize_flashcard(card)
+        finally:
+            cursor.close()
+            conn.close()
+
+    return rows()
+
+def stream_json_array(cards):
+    """Stream an iterable of cards as a chunked JSON array"""
+    count = 0
+    yield "["
+    for card in cards:
+        yield ("," if count else "") + json.dumps(card)
+        count += 1
+    yield "]"
+    logger.info(f"Streamed {count} flashcards from database")
+
+def stream_ndjson(cards):
+    """Stream an iterable of cards as newline-delimited JSON"""
+    count = 0
+    for card in cards:
+        yield json.dumps(card) + "\n"
+        count += 1
+    logger.info(f"Streamed {count} flashcards from database")
+
+def wants_ndjson():
+    return (request.args.get('format') == 'ndjson'
+            or request.accept_mimetypes.best == 'application/x-ndjson')
+
+# --- Flashcard Search ---
+SEARCH_PAGE_SIZE = int(os.getenv('SEARCH_PAGE_SIZE', '20'))  # default ?limit= for /search_flashcards
+SEARCH_MAX_TERMS = 16  # query words passed to the full-text index
+SEARCH_SNIPPET_CHARS = int(os.getenv('SEARCH_SNIPPET_CHARS', '160'))  # length of highlight snippets
+SEARCH_TERM_RE = re.compile(r'\w+')
+
+def search_terms(query):
+    """Lowercased words of a search query, without repeats"""
+    terms = []
+    for term in SEARCH_TERM_RE.findall(query.lower()):
+        if term not in terms:
+            terms.append(term)
+    return terms[:SEARCH_MAX_TERMS]
+
+def full_text_query(terms):
+    """Match expression requiring every term; the last one matches as a prefix.
+
+    Terms are plain words, so they can't smuggle operators into the
+    FTS5 or InnoDB boolean syntax.
+    """
+    if DB_BACKEND == "sqlite":
+        parts = [f'"{term}"' for term in terms]
+    else:
+        parts = [f'+{term}' for term in terms]
+    parts[-1] += '*'
+    return ' '.join(parts)
+
+def highlight_snippet(text, terms, width=None):
+    """HTML-escaped excerpt of ``text`` around the first match, matches in <mark>"""
+    width = width or SEARCH_SNIPPET_CHARS
+    pattern = re.compile(r'\b(?:' + '|'.join(re.escape(t) for t in terms) + r')\w*', re.IGNORECASE)
+    start, end = 0, len(text)
+    if len(text) > width:
+        first = pattern.search(text)
+        start = max(0, (first.start() if first else 0) - width // 4)
+        if start:
+            space = text.find(' ', start)
+            start = space + 1 if 0 <= space < start + 20 else start
+        end = min(len(text), start + width)
+        if end < len(text):
+            space = text.rfind(' ', start, end)
+            end = space if space > start + width // 2 else end
+
+    parts = ['\u2026'] if start else []
+    position = start
+    for match in pattern.finditer(text, start, end):
+        parts.append(html.escape(text[position:match.start()]))
+        parts.append(f"<mark>{html.escape(match.group())}</mark>")
+        position = match.end()
+    parts.append(html.escape(text[position:end]))
+    if end < len(text):
+        parts.append('\u2026')
+    return ''.join(parts)
+
+def search_flashcards_page(conn, deck_id, terms, limit, offset=0):
+    """Rank a deck's cards against ``terms`` using the database's full-text index.
+
+    SQLite uses the flashcards_fts FTS5 table (BM25, questions weighted
+    double); MySQL uses the FULLTEXT index on (question, answer). Returns up
+    to ``limit`` serialized rows with a score and highlight snippets. The
+    query runs on the caller's connection, which stays open.
+    """
+    match = full_text_query(terms)
+    if DB_BACKEND == "sqlite":
+        sql = ("SELECT f.id, f.question, f.answer, f.created_at, -flashcards_fts.rank AS score "
+               "FROM flashcards_fts JOIN flashcards f ON f.id = flashcards_fts.rowid "
+               "WHERE flashcards_fts MATCH %s AND f.deck_id = %s "
+               "ORDER BY flashcards_fts.rank, f.id DESC LIMIT %s OFFSET %s")
+        params = (match, deck_id, limit, offset)
+    else:
+        sql = ("SELECT id, question, answer, created_at, "
+               "MATCH (question, answer) AGAINST (%s IN BOOLEAN MODE) AS score FROM flashcards "
+               "WHERE MATCH (question, answer) AGAINST (%s IN BOOLEAN MODE) AND deck_id = %s "
+               "ORDER BY score DESC, id DESC LIMIT %s OFFSET %s")
+        params = (match, match, deck_id, limit, offset)
+
+    cursor = conn.cursor(dictionary=True)
+    with DB_QUERY_SECONDS.time(operation="search"):
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+    cursor.close()
+
+    results = []
+    for card in rows:
+        card = serialize_flashcard(card)
+        card["score"] = round(float(card["score"]), 4)
+        card["highlights"] = {
+            "question": highlight_snippet(card["question"], terms),
+            "answer": highlight_snippet(card["answer"], terms)
+        }
+        results.append(card)
+    return results
+
+# --- Import and Export ---
+# Decks move in and out as NDJSON ({"question", "answer", "created_at"} per
+# line) or CSV with a question,answer[,created_at] header. Both directions
+# stream: exports page through the deck with a keyset query per chunk and
+# imports parse the request body line by line, inserting IMPORT_CHUNK_SIZE
+# cards per transaction, so memory stays flat however large the deck.
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', '1000'))  # rows per export query
+IMPORT_CHUNK_SIZE = int(os.getenv('IMPORT_CHUNK_SIZE', '1000'))  # cards per import transaction
+IMPORT_MAX_ERRORS = 20  # invalid records reported back in detail
+TRANSFER_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv"
+}
+
+def transfer_format(default="ndjson"):
+    """Format named by ?format= or implied by the request's Content-Type"""
+    requested = request.args.get('format')
+    if requested:
+        return requested.lower()
+    for name, mimetype in TRANSFER_FORMATS.items():
+        if request.mimetype == mimetype:
+            return name
+    return default
+
+def iter_deck_export(deck_id, chunk_size=None):
+    """Yield a deck's cards oldest first, one short keyset query per chunk.
+
+    Each chunk runs on its own pooled connection, so a slow client never
+    keeps a transaction or snapshot open, and the (deck_id, created_at, id)
+    index serves every page.
+    """
+    chunk_size = chunk_size or EXPORT_CHUNK_SIZE
+    after = None
+    while True:
+        sql = "SELECT id, question, answer, created_at FROM flashcards WHERE deck_id = %s"
+        params = [deck_id]
+        if after:
+            sql += " AND (created_at > %s OR (created_at = %s AND id > %s))"
+            params.extend([after[0], after[0], after[1]])
+        sql += " ORDER BY created_at, id LIMIT %s"
+        params.append(chunk_size)
+
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor(dictionary=True)
+            with DB_QUERY_SECONDS.time(operation="export"):
+                cursor.execute(sql, tuple(params))
+                rows = cursor.fetchall()
+            cursor.close()
+            conn.commit()  # end the read transaction before yielding
+        finally:
+            conn.close()
+
+        for card in rows:
+            yield card
+        if len(rows) < chunk_size:
+            return
+        after = (rows[-1]["created_at"], rows[-1]["id"])
+
+def _export_record(card):
+    created_at = card["created_at"]
+    return {
+        "question": card["question"],
+        "answer": card["answer"],
+        "created_at": created_at.isoformat() if isinstance(created_at, datetime) else created_at
+    }
+
+def export_ndjson(cards):
+    for card in cards:
+        yield json.dumps(_export_record(card)) + "\n"
+
+def export_csv(cards, rows_per_chunk=500):
+    """CSV with a header row, written out a few hundred rows at a time"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["question", "answer", "created_at"])
+    rows = 0
+    for card in cards:
+        record = _export_record(card)
+        writer.writerow([record["question"], record["answer"], record["created_at"]])
+        rows += 1
+        if rows % rows_per_chunk == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def iter_request_lines(stream):
+    """Lines (with their newline) of a UTF-8 request body, read incrementally"""
+    pending = ""
+    for block in iter_request_text(stream):
+        pending += block
+        lines = pending.split("\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line + "\n"
+    if pending:
+        yield pending
+
+def iter_import_records(lines, fmt):
+    """Yield (record number, card dict or error message) from NDJSON or CSV lines"""
+    if fmt == "ndjson":
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                yield number, "not valid JSON"
+                continue
+            yield number, record if isinstance(record, dict) else "expected a JSON object"
+        return
+
+    reader = csv.reader(lines)
+    header = next(reader, None)
+    if header is None:
+        return
+    columns = [name.strip().lower() for name in header]
+    c_col = None
+    if "question" in columns and "answer" in columns:
+        q_col, a_col = columns.index("question"), columns.index("answer")
+        c_col = columns.index("created_at") if "created_at" in columns else None
+    else:
+        # No header: the first row is already a question,answer pair
+        q_col, a_col = 0, 1
+        yield 1, {"question": header[0] if header else "", "answer": header[1] if len(header) > 1 else ""}
+    for row in reader:
+        if not any(field.strip() for field in row):
+            continue
+        if len(row) <= max(q_col, a_col):
+            yield reader.line_num, "missing question or answer column"
+            continue
+        record = {"question": row[q_col], "answer": row[a_col]}
+        if c_col is not None and c_col < len(row):
+            record["created_at"] = row[c_col]
+        yield reader.line_num, record
+
+def parse_import_timestamp(value):
+    """created_at of an imported record as a local naive datetime, or None.
+
+    Accepts the ISO 8601 strings exports write; missing, malformed and
+    future values give None so the card is stamped with the import time.
+    """
+    if not isinstance(value, str) or not value.strip():
+        return None
+    try:
+        created_at = datetime.fromisoformat(value.strip())
+    except ValueError:
+        return None
+    if created_at.tzinfo is not None:
+        created_at = created_at.astimezone().replace(tzinfo=None)
+    return created_at if created_at <= datetime.now() else None
+
+def import_flashcards(deck_id, records, chunk_size=None):
+    """Insert streamed records into a deck in chunks, one transaction each.
+
+    Every chunk goes through insert_flashcards_batch, so duplicates of
+    cards already in the deck (or earlier in the import) are skipped.
+    A valid created_at is kept; cards without one get the import time.
+    Returns counts plus the first IMPORT_MAX_ERRORS invalid records.
+    """
+    chunk_size = chunk_size or IMPORT_CHUNK_SIZE
+    summary = {"inserted": 0, "duplicates": 0, "invalid": 0, "errors": []}
+
+    def invalid(number, message):
+        summary["invalid"] += 1
+        if len(summary["errors"]) < IMPORT_MAX_ERRORS:
+            summary["errors"].append({"record": number, "error": message})
+
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+
+        def flush(chunk):
+            with DB_QUERY_SECONDS.time(operation="import_batch"):
+                inserted, duplicates = insert_flashcards_batch(cursor, deck_id, chunk)
+                conn.commit()
+            summary["inserted"] += len(inserted)
+            summary["duplicates"] += len(duplicates)
+
+        chunk = []
+        for number, record in records:
+            if isinstance(record, str):
+                invalid(number, record)
+                continue
+            question = str(record.get("question") or "").strip()
+            answer = str(record.get("answer") or "").strip()
+            if not question or not answer:
+                invalid(number, "Question and answer are required")
+                continue
+            chunk.append({
+                "question": question,
+                "answer": answer,
+                "created_at": parse_import_timestamp(record.get("created_at"))
+            })
+            if len(chunk) >= chunk_size:
+                flush(chunk)
+                chunk = []
+        if chunk:
+            flush(chunk)
+        cursor.close()
+    finally:
+        conn.close()
+    return summary
+
+# --- HTTP Caching and Compression ---
+# Listings carry a weak ETag built from the deck's version counter, so a
+# poll that finds nothing changed costs one indexed lookup and a 304.
+# Responses above COMPRESS_MIN_BYTES are gzip (or brotli, if installed)
+# encoded, and frontend assets are referenced with a content fingerprint
+# (?v=<hash>) so browsers can cache them for a year without revalidating.
+# Streamed listings and exports are gzipped incrementally as they are sent.
+COMPRESS_MIN_BYTES = int(os.getenv('COMPRESS_MIN_BYTES', '1024'))  # smaller bodies are sent as is
+COMPRESS_LEVEL = int(os.getenv('COMPRESS_LEVEL', '6'))             # gzip level; brotli uses quality 5
+STATIC_MAX_AGE = int(os.getenv('STATIC_MAX_AGE', str(365 * 24 * 3600)))  # for fingerprinted assets
+STATIC_COMPRESSED_CACHE_SIZE = 64
+COMPRESS_STREAM_FLUSH_BYTES = 16 * 1024  # streamed input compressed between flushes
+COMPRESSIBLE_MIMETYPES = frozenset([
+    "application/json", "application/x-ndjson", "application/javascript", "text/javascript",
+    "text/css", "text/html", "text/plain", "text/csv", "image/svg+xml"
+])
+STREAM_COMPRESSIBLE_MIMETYPES = frozenset(["application/json", "application/x-ndjson", "text/csv"])
+ASSET_REF_RE = re.compile(r'(\b(?:href|src)=")([\w./-]+\.(?:css|js))(")')
+
+def listing_etag(cursor, deck_id):
+    """ETag for a listing: the deck version plus every query parameter"""
+    variant = json.dumps([request.path, sorted(request.args.items(multi=True)), wants_ndjson()])
+    digest = hashlib.blake2b(variant.encode('utf-8'), digest_size=8).hexdigest()
+    return f"{deck_id}-{deck_version(cursor, deck_id)}-{digest}"
+
+def check_listing_etag(cursor, deck_id):
+    """(etag, None) for a listing that must be built, or (etag, 304 response)"""
+    etag = listing_etag(cursor, deck_id)
+    if request.if_none_match.contains_weak(etag):
+        return etag, revalidated(Response(status=304), etag)
+    return etag, None
+
+def revalidated(response, etag):
+    """Tag a listing response so clients revalidate it on every poll"""
+    response.set_etag(etag, weak=True)
+    response.cache_control.no_cache = True
+    return response
+
+def negotiate_encoding():
+    """Best content coding this server and the client share, or None"""
+    accepted = request.accept_encodings
+    if brotli is not None and accepted["br"]:
+        return "br"
+    if accepted["gzip"]:
+        return "gzip"
+    return None
+
+def compress_body(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data, quality=5)
+    return gzip.compress(data, compresslevel=COMPRESS_LEVEL, mtime=0)
+
+def compress_stream(chunks):
+    """gzip a streamed body incrementally.
+
+    Output is flushed every COMPRESS_STREAM_FLUSH_BYTES of input, so the
+    client keeps receiving data while rows are still being read without
+    paying a flush per row.
+    """
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 31)
+    pending = 0
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        pending += len(chunk)
+        if pending >= COMPRESS_STREAM_FLUSH_BYTES:
+            data += compressor.flush(zlib.Z_SYNC_FLUSH)
+            pending = 0
+        if data:
+            yield data
+    yield compressor.flush()
+
+_static_compressed = OrderedDict()  # (path, etag, encoding) -> compressed body
+_static_compressed_lock = threading.Lock()
+
+def compress_static_body(key, data, encoding):
+    """compress_body for static files, remembering the result by file ETag"""
+    with _static_compressed_lock:
+        body = _static_compressed.get(key)
+        if body is not None:
+            _static_compressed.move_to_end(key)
+            return body
+    body = compress_body(data, encoding)
+    with _static_compressed_lock:
+        _static_compressed[key] = body
+        while len(_static_compressed) > STATIC_COMPRESSED_CACHE_SIZE:
+            _static_compressed.popitem(last=False)
+    return body
+
+@functools.lru_cache(maxsize=128)
+def _file_fingerprint(path, mtime_ns, size):
+    digest = hashlib.blake2b(digest_size=8)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(64 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def static_fingerprint(filename):
+    """Content hash of a frontend file, or None if it doesn't exist"""
+    path = os.path.join(app.static_folder, filename)
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return _file_fingerprint(path, st.st_mtime_ns, st.st_size)
+
+def fingerprint_asset_refs(page):
+    """Append ?v=<content hash> to the page's local stylesheet and script URLs"""
+    def versioned(match):
+        fingerprint = static_fingerprint(match.group(2))
+        if fingerprint is None:
+            return match.group(0)
+        return f"{match.group(1)}{match.group(2)}?v={fingerprint}{match.group(3)}"
+    return ASSET_REF_RE.sub(versioned, page)
+
+@app.after_request
+def cache_static_assets(response):
+    """Immutable caching for fingerprinted assets, revalidation otherwise"""
+    if request.endpoint == "static" and response.status_code in (200, 304):
+        version = request.args.get("v")
+        if version and version == static_fingerprint(request.view_args.get("filename", "")):
+            response.cache_control.no_cache = None
+            response.cache_control.public = True
+            response.cache_control.max_age = STATIC_MAX_AGE
+            response.cache_control.immutable = True
+        else:
+            response.cache_control.no_cache = True
+    return response
+
+@app.after_request
+def compress_response(response):
+    """gzip/brotli-encode sizeable text responses the client accepts.
+
+    Streamed listings and exports are gzipped chunk by chunk with
+    compress_stream; event streams are left alone so each event reaches
+    the client at once. Compressed static files are cached by their ETag,
+    so repeat loads cost no compression CPU.
+    """
+    if (response.status_code != 200 or "Content-Encoding" in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    if response.is_streamed and not response.direct_passthrough:
+        if response.mimetype not in STREAM_COMPRESSIBLE_MIMETYPES:
+            return response
+        response.vary.add("Accept-Encoding")
+        if not request.accept_encodings["gzip"]:
+            return response
+        body = response.response
+        response.response = compress_stream(response.iter_encoded())
+        if hasattr(body, "close"):
+            # Werkzeug only closes the wrapper; the rows hold a pooled connection
+            response.call_on_close(body.close)
+        response.headers["Content-Encoding"] = "gzip"
+        response.headers.pop("Content-Length", None)
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = negotiate_encoding()
+    if encoding is None:
+        return response
+    if response.content_length is not None and response.content_length < COMPRESS_MIN_BYTES:
+        return response
+
+    response.direct_passthrough = False  # read send_file bodies into memory
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_BYTES:
+        return response
+    etag, _ = response.get_etag()
+    if request.endpoint == "static" and etag:
+        body = compress_static_body((request.path, etag, encoding), data, encoding)
+    else:
+        body = compress_body(data, encoding)
+    response.set_data(body)
+    response.headers["Content-Encoding"] = encoding
+    if etag:
+        # Compressed bytes differ from the identity ones; a weak tag still
+        # matches If-None-Match, so conditional requests keep working
+        response.set_etag(etag, weak=True)
+    return response
+
+# --- Admission Control ---
+# Generation is the only expensive route, so it is the only one metered.
+# Each client has a token bucket that holds up to RATE_LIMIT_BURST tokens
+# and refills at RATE_LIMIT_REFILL per second. A generation costs one token,
+# plus one per GENERATION_COST_CHARS of input, plus GENERATION_AI_COST when
+# it will call a model. Generations that call a model also need one of
+# AI_GENERATION_SLOTS per worker, so a flood of them cannot take every
+# request thread away from cheap routes.
+RATE_LIMIT_BURST = float(os.getenv('RATE_LIMIT_BURST', '30'))       # bucket size; 0 disables rate limiting
+RATE_LIMIT_REFILL = float(os.getenv('RATE_LIMIT_REFILL', '0.5'))    # tokens per second
+RATE_LIMIT_STATE_PATH = os.getenv('RATE_LIMIT_STATE_PATH', '')      # SQLite file shared by workers
+RATE_LIMIT_TRUST_PROXY = os.getenv('RATE_LIMIT_TRUST_PROXY', '0') == '1'  # key clients by X-Forwarded-For
+RATE_LIMIT_MAX_CLIENTS = 100000  # buckets kept; dropping an idle one only refills it
+GENERATE_MAX_CHARS = int(os.getenv('GENERATE_MAX_CHARS', '200000'))          # longest notes accepted
+GENERATE_MAX_BODY_BYTES = GENERATE_MAX_CHARS * 6 + 64 * 1024  # JSON body for the longest notes, \uXXXX-escaped
+GENERATION_COST_CHARS = int(os.getenv('GENERATION_COST_CHARS', '5000'))      # input chars per extra token
+GENERATION_AI_COST = float(os.getenv('GENERATION_AI_COST', '4'))             # extra tokens when a model is called
+AI_GENERATION_SLOTS = int(os.getenv('AI_GENERATION_SLOTS', '4'))             # concurrent AI generations per worker
+AI_GENERATION_WAIT = float(os.getenv('AI_GENERATION_WAIT', '2'))             # seconds to wait for a free slot
+
+class TokenBucketLimiter:
+    """Per-client token buckets kept in a state store.
+
+    Buckets are refilled lazily from the wall clock on each take, so the
+    store only holds (tokens, updated) per client and a shared SQLite store
+    works across processes.
+    """
+
+    def __init__(self, store, burst, refill_rate):
+        self.store = store
+        self.burst = burst
+        self.refill_rate = refill_rate
+
+    @property
+    def enabled(self):
+        return self.burst > 0 and self.refill_rate > 0
+
+    def _update(self, client, cost):
+        def spend(state):
+            now = time.time()
+            elapsed = max(0.0, now - state.get("updated", now))
+            tokens = min(self.burst, state.get("tokens", self.burst) + elapsed * self.refill_rate)
+            state["updated"] = now
+            if tokens >= cost:
+                state["tokens"] = min(self.burst, tokens - cost)
+                return 0.0
+            state["tokens"] = tokens
+            return (cost - tokens) / self.refill_rate
+        return self.store.update(f"client:{client}", spend)
+
+    def take(self, client, cost):
+        """Spend ``cost`` tokens; returns 0 if allowed, else seconds until it would be.
+
+        A cost above the bucket size is capped at it, so the largest
+        requests need a full bucket rather than being refused forever.
+        """
+        return self._update(client, min(cost, self.burst))
+
+    def refund(self, client, cost):
+        self._update(client, -min(cost, self.burst))
+
+rate_limit_store = (
+    SQLiteStateStore(RATE_LIMIT_STATE_PATH, table="rate_limits", max_entries=RATE_LIMIT_MAX_CLIENTS)
+    if RATE_LIMIT_STATE_PATH else InMemoryStateStore(max_entries=RATE_LIMIT_MAX_CLIENTS)
+)
+rate_limiter = TokenBucketLimiter(rate_limit_store, RATE_LIMIT_BURST, RATE_LIMIT_REFILL)
+ai_generation_slots = threading.BoundedSemaphore(AI_GENERATION_SLOTS)
+
+class GenerationSlot:
+    """Admission granted to one generation; release() frees its AI slot (if any)"""
+
+    def __init__(self, semaphore=None):
+        self._semaphore = semaphore
+        if semaphore is not None:
+            AI_GENERATIONS_IN_FLIGHT.inc()
+
+    def release(self):
+        semaphore, self._semaphore = self._semaphore, None
+        if semaphore is not None:
+            AI_GENERATIONS_IN_FLIGHT.dec()
+            semaphore.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+def client_key():
+    """Who a request is charged to: its address, or the first forwarded one"""
+    if RATE_LIMIT_TRUST_PROXY and request.access_route:
+        return request.access_route[0]
+    return request.remote_addr or "unknown"
+
+def generation_uses_ai():
+    """Whether a generation started now would call a model"""
+    if INFERENCE_BACKEND == "stub":
+        return False
+    return not (INFERENCE_BACKEND == "huggingface" and inference_breaker.is_open())
+
+def generation_cost(chars, uses_ai):
+    return 1 + chars / GENERATION_COST_CHARS + (GENERATION_AI_COST if uses_ai else 0)
+
+def retry_later(message, retry_after, status, reason):
+    ADMISSION_REJECTED.inc(reason=reason)
+    response = jsonify({"error": message, "retry_after": round(retry_after, 1)})
+    response.headers["Retry-After"] = str(max(1, math.ceil(retry_after)))
+    return response, status
+
+def admit_generation(chars, cached=False, background=False):
+    """(slot, None) if the client may run this generation, else (None, error response).
+
+    Charges the client's bucket: a cached result costs a single token.
+    Synchronous generations that will call a model also take an AI slot,
+    waiting up to AI_GENERATION_WAIT for one; background jobs are bounded
+    by the job queue instead. The caller must release the returned slot.
+    """
+    if chars > GENERATE_MAX_CHARS:
+        ADMISSION_REJECTED.inc(reason="too_large")
+        return None, (jsonify({"error": f"Notes are limited to {GENERATE_MAX_CHARS} characters"}), 413)
+
+    uses_ai = not cached and generation_uses_ai()
+    cost = 1 if cached else generation_cost(chars, uses_ai)
+    client = client_key()
+    if rate_limiter.enabled:
+        wait = rate_limiter.take(client, cost)
+        if wait > 0:
+            logger.warning(f"Rate limited {client}: generation costs {cost:.1f} tokens, retry in {wait:.1f}s")
+            return None, retry_later("Too many generation requests, please slow down", wait, 429, "rate_limit")
+
+    if not uses_ai or background:
+        return GenerationSlot(), None
+    if not ai_generation_slots.acquire(timeout=AI_GENERATION_WAIT):
+        if rate_limiter.enabled:
+            rate_limiter.refund(client, cost)
+        logger.warning("All AI generation slots busy, turning a generation away")
+        return None, retry_later("Too many generations in progress, please retry shortly",
+                                 AI_GENERATION_WAIT, 503, "busy")
+    return GenerationSlot(ai_generation_slots), None
+
+# --- File Ingestion ---
+# /generate_from_file takes a multipart upload. Werkzeug spools file parts
+# larger than 500 KB to a temporary file, and each extractor reads that
+# file incrementally, yielding text blocks straight into the streaming
+# generation pipeline. Memory therefore stays bounded by the window size,
+# not the document, and reading stops once the card budget is met.
+UPLOAD_MAX_BYTES = int(os.getenv('UPLOAD_MAX_BYTES', str(50 * 1024 * 1024)))  # largest accepted upload
+
+def format_size(num_bytes):
+    """Human-readable size for error messages, e.g. '50 MB' or '512 KB'"""
+    for unit, scale in (("MB", 1024 * 1024), ("KB", 1024)):
+        if num_bytes >= scale:
+            return f"{num_bytes / scale:.4g} {unit}"
+    return f"{num_bytes} bytes"
+
+class UnsupportedUploadError(Exception):
+    pass
+
+class UnreadableUploadError(Exception):
+    pass
+
+MARKDOWN_HEADING_RE = re.compile(r'^[^\S\n]{0,3}#{1,6}[^\S\n]+(.*?)[^\S\n#]*#*[^\S\n]*$', re.MULTILINE)
+MARKDOWN_LINK_RE = re.compile(r'!?\[([^\]\n]*)\]\([^)\n]*\)')
+MARKDOWN_EMPHASIS_RE = re.compile(r'\*\*|__|~~|`+')
+WORD_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+def limit_text(blocks, limit):
+    """Pass text blocks through until ``limit`` characters have gone by"""
+    remaining = limit
+    for block in blocks:
+        if remaining <= 0:
+            return
+        block = block[:remaining]
+        remaining -= len(block)
+        yield block
+
+def _batched(pieces, size=STREAM_READ_BYTES):
+    """Join small text pieces into blocks of about ``size`` characters"""
+    batch = []
+    length = 0
+    for piece in pieces:
+        batch.append(piece)
+        length += len(piece)
+        if length >= size:
+            yield "".join(batch)
+            batch = []
+            length = 0
+    if batch:
+        yield "".join(batch)
+
+def _heading_sentence(match):
+    # End headings like sentences so they don't run into the next paragraph
+    heading = match.group(1).rstrip()
+    return heading if heading.endswith(('.', '!', '?', ':')) else heading + '.'
+
+def iter_markdown_text(stream):
+    """Markdown as plain text: headings turned into sentences, link targets
+    and emphasis markers dropped, list bullets kept for list extraction"""
+    for block in _batched(iter_request_lines(stream)):
+        block = MARKDOWN_HEADING_RE.sub(_heading_sentence, block)
+        block = MARKDOWN_LINK_RE.sub(r'\1', block)
+        yield MARKDOWN_EMPHASIS_RE.sub('', block)
+
+def iter_pdf_text(stream):
+    """Text of a PDF, one page at a time (needs the optional pypdf package)"""
+    from pypdf import PdfReader
+    from pypdf.errors import PdfReadError
+
+    try:
+        reader = PdfReader(stream)
+        for page in reader.pages:
+            text = page.extract_text() or ""
+            if text.strip():
+                yield text + "\n\n"
+    except PdfReadError as e:
+        raise UnreadableUploadError(f"Could not read the PDF: {e}") from e
+
+def iter_docx_text(stream):
+    """Paragraph text of a .docx, parsed incrementally from word/document.xml"""
+    try:
+        archive = zipfile.ZipFile(stream)
+        document = archive.open("word/document.xml")
+    except (zipfile.BadZipFile, KeyError) as e:
+        raise UnreadableUploadError("Not a valid .docx file") from e
+
+    def pieces():
+        for _, element in ElementTree.iterparse(document, events=("end",)):
+            if element.tag == WORD_NS + "t":
+                yield element.text or ""
+            elif element.tag == WORD_NS + "tab":
+                yield "\t"
+            elif element.tag in (WORD_NS + "br", WORD_NS + "cr"):
+                yield "\n"
+            elif element.tag == WORD_NS + "p":
+                yield "\n\n"
+                element.clear()  # drop the finished paragraph's runs
+
+    with archive, document:
+        try:
+            yield from _batched(pieces())
+        except ElementTree.ParseError as e:
+            raise UnreadableUploadError("Not a valid .docx file") from e
+
+UPLOAD_EXTRACTORS = {
+    ".txt": iter_request_text,
+    ".md": iter_markdown_text,
+    ".markdown": iter_markdown_text,
+    ".pdf": iter_pdf_text,
+    ".docx": iter_docx_text
+}
+
+def upload_extractor(filename):
+    """Text extractor for an uploaded file name; raises UnsupportedUploadError"""
+    extension = os.path.splitext(filename or "")[1].lower()
+    extractor = UPLOAD_EXTRACTORS.get(extension)
+    if extractor is None:
+        raise UnsupportedUploadError(
+            f"Unsupported file type '{extension or filename}', upload a .txt, .md, .pdf or .docx file")
+    if extractor is iter_pdf_text:
+        try:
+            import pypdf  # noqa: F401
+        except ImportError:
+            raise UnsupportedUploadError("PDF uploads need the optional pypdf package (pip install pypdf)")
+    return extractor
+
 # --- Enhanced Routes ---
 @app.route("/")
 def index():
-    return send_from_directory("frontend", "index.html")
+    # index.html is small and always revalidated; the assets it references
+    # are fingerprinted so they can be cached indefinitely
+    path = os.path.join(app.static_folder, "index.html")
+    with open(path, encoding="utf-8") as f:
+        page = fingerprint_asset_refs(f.read())
+    response = Response(page, mimetype="text/html")
+    response.set_etag(hashlib.blake2b(page.encode("utf-8"), digest_size=8).hexdigest())
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
 
 @app.route('/get_flashcards', methods=['GET'])
 def get_flashcards():
+    """List saved flashcards, newest first.
+
+    Query parameters:
+      limit  - page size (max FLASHCARD_PAGE_MAX); omit to stream every card
+      after  - keyset cursor '<created_at>,<id>' from a previous X-Next-Cursor
+      format - 'ndjson' for newline-delimited JSON instead of a JSON array
+      deck_id - deck to list (default deck when omitted)
+    """
     try:
+        limit = request.args.get('limit', type=int)
+        after = request.args.get('after')
+
+        try:
+            after = decode_page_cursor(after) if after else None
+        except ValueError:
+            return jsonify({"error": "Invalid 'after' cursor, expected '<created_at>,<id>'"}), 400
+
+        if limit is not None and not 1 <= limit <= FLASHCARD_PAGE_MAX:
+            return jsonify({"error": f"'limit' must be between 1 and {FLASHCARD_PAGE_MAX}"}), 400
+
+        # One connection serves the deck check, the ETag and the listing;
+        # query_flashcards returns it to the pool when its rows run out
+        cards = None
         conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT id, question, answer, created_at FROM flashcards ORDER BY created_at DESC")
-        flashcards = cursor.fetchall()
-        cursor.close()
-        conn.close()
-        
-        # Convert datetime to string for JSON serialization
-        for card in flashcards:
-            if 'created_at' in card and card['created_at']:
-                card['created_at'] = card['created_at'].isoformat()
-        
+        try:
+            cursor = conn.cursor()
+            deck_id, error = resolve_request_deck(cursor)
+            if error:
+                return error
+            etag, not_modified = check_listing_etag(cursor, deck_id)
+            cursor.close()
+            if not_modified:
+                return not_modified
+            cards = query_flashcards(deck_id, after=after, limit=limit and limit + 1, conn=conn)
+        finally:
+            if cards is None:
+                conn.close()
+
+        if limit is None:
+            # Unpaged: stream rows straight from the cursor instead of
+            # materializing the whole table
+            if wants_ndjson():
+                return revalidated(Response(stream_ndjson(cards), mimetype='application/x-ndjson'), etag)
+            return revalidated(Response(stream_json_array(cards), mimetype='application/json'), etag)
+
+        # Paged: fetch one extra row to learn whether another page exists
+        flashcards = list(cards)
+        has_more = len(flashcards) > limit
+        flashcards = flashcards[:limit]
+
+        if wants_ndjson():
+            response = Response(''.join(stream_ndjson(flashcards)), mimetype='application/x-ndjson')
+        else:
+            response = jsonify(flashcards)
+        if has_more:
+            response.headers['X-Next-Cursor'] = encode_page_cursor(flashcards[-1])
+
         logger.info(f"Retrieved {len(flashcards)} flashcards from database")
-        return jsonify(flashcards)
+        return revalidated(response, etag)
         
     except Exception as e:
         logger.error(f"Error retrieving flashcards: {e}")
         return jsonify({"error": "Failed to retrieve flashcards"}), 500
 
+@app.route('/search_flashcards', methods=['GET'])
+def search_flashcards():
+    """Full-text search over saved flashcards, best matches first.
+
+    Query parameters:
+      q      - search words; all must match, the last one as a prefix
+      limit  - page size (default SEARCH_PAGE_SIZE, max FLASHCARD_PAGE_MAX)
+      offset - number of results to skip, from a previous next_offset
+      deck_id - deck to search (default deck when omitted)
+    """
+    try:
+        terms = search_terms(request.args.get('q', ''))
+        limit = request.args.get('limit', SEARCH_PAGE_SIZE, type=int)
+        offset = request.args.get('offset', 0, type=int)
+
+        if not terms:
+            return jsonify({"error": "Query parameter 'q' must contain at least one word"}), 400
+        if not 1 <= limit <= FLASHCARD_PAGE_MAX:
+            return jsonify({"error": f"'limit' must be between 1 and {FLASHCARD_PAGE_MAX}"}), 400
+        if offset < 0:
+            return jsonify({"error": "'offset' must not be negative"}), 400
+
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            deck_id, error = resolve_request_deck(cursor)
+            if error:
+                return error
+            etag, not_modified = check_listing_etag(cursor, deck_id)
+            cursor.close()
+            if not_modified:
+                return not_modified
+
+            # Fetch one extra row to learn whether another page exists
+            results = search_flashcards_page(conn, deck_id, terms, limit + 1, offset)
+        finally:
+            conn.close()
+
+        has_more = len(results) > limit
+        results = results[:limit]
+
+        logger.info(f"Search for {terms} returned {len(results)} flashcards")
+        return revalidated(jsonify({
+            "query": request.args.get('q', ''),
+            "results": results,
+            "next_offset": offset + limit if has_more else None
+        }), etag)
+
+    except Exception as e:
+        logger.error(f"Error searching flashcards: {e}")
+        return jsonify({"error": "Failed to search flashcards"}), 500
+
+@app.route('/due_cards', methods=['GET'])
+def due_cards():
+    """Cards due for review, most overdue first.
+
+    Query parameters:
+      limit   - number of cards (default 20, max DUE_PAGE_MAX)
+      deck_id - deck to study (default deck when omitted)
+    """
+    try:
+        deck_id, error = resolve_request_deck()
+        if error:
+            return error
+        limit = request.args.get('limit', 20, type=int)
+        if not 1 <= limit <= DUE_PAGE_MAX:
+            return jsonify({"error": f"'limit' must be between 1 and {DUE_PAGE_MAX}"}), 400
+
+        cards = query_due_cards(deck_id, limit)
+        logger.info(f"Retrieved {len(cards)} due flashcards")
+        return jsonify(cards)
+
+    except Exception as e:
+        logger.error(f"Error retrieving due flashcards: {e}")
+        return jsonify({"error": "Failed to retrieve due flashcards"}), 500
+
+@app.route('/review', methods=['POST'])
+def review():
+    """Record review grades and reschedule the cards.
+
+    Accepts {"id": 1, "grade": "good"} or {"reviews": [{"id": 1, "grade": 4}, ...]}.
+    Grades are SM-2 0-5 or again/hard/good/easy. Returns each card's new
+    schedule; ids that aren't in the deck are listed under "not_found".
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        items = data.get("reviews") if isinstance(data.get("reviews"), list) else [data]
+
+        if not items:
+            return jsonify({"error": "A card id and grade are required"}), 400
+        if len(items) > REVIEW_BATCH_MAX:
+            return jsonify({"error": f"At most {REVIEW_BATCH_MAX} reviews can be recorded per request"}), 400
+
+        reviews = []
+        for i, item in enumerate(items):
+            try:
+                if not isinstance(item, dict) or item.get("id") is None or item.get("grade") is None:
+                    raise ValueError("a card id and grade are required")
+                reviews.append((int(item["id"]), parse_review_grade(item["grade"])))
+            except (TypeError, ValueError) as e:
+                return jsonify({"error": f"Invalid review at index {i}: {e}"}), 400
+
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            deck_id, error = resolve_request_deck(cursor)
+            if error:
+                return error
+            with DB_QUERY_SECONDS.time(operation="review"):
+                updated = review_flashcards_batch(cursor, deck_id, reviews)
+                conn.commit()
+        finally:
+            cursor.close()
+            conn.close()
+
+        logger.info(f"Recorded {len(reviews)} reviews for {len(updated)} flashcards")
+        return jsonify({
+            "reviewed": [
+                {"id": card_id, **schedule, "due_at": schedule["due_at"].isoformat()}
+                for card_id, schedule in updated.items()
+            ],
+            "not_found": sorted({card_id for card_id, _ in reviews} - set(updated))
+        })
+
+    except Exception as e:
+        logger.error(f"Error recording reviews: {e}")
+        return jsonify({"error": "Failed to record reviews"}), 500
+
+@app.route('/export', methods=['GET'])
+def export_deck():
+    """Stream a deck as NDJSON (default) or CSV.
+
+    Query parameters:
+      format  - 'ndjson' or 'csv'
+      deck_id - deck to export (default deck when omitted)
+    """
+    try:
+        deck_id, error = resolve_request_deck()
+        if error:
+            return error
+        fmt = transfer_format()
+        if fmt not in TRANSFER_FORMATS:
+            return jsonify({"error": f"'format' must be one of {', '.join(TRANSFER_FORMATS)}"}), 400
+
+        cards = iter_deck_export(deck_id)
+        body = export_csv(cards) if fmt == "csv" else export_ndjson(cards)
+        logger.info(f"Exporting deck {deck_id} as {fmt}")
+        return Response(body, mimetype=TRANSFER_FORMATS[fmt], headers={
+            "Content-Disposition": f'attachment; filename="deck-{deck_id}.{fmt}"'
+        })
+
+    except Exception as e:
+        logger.error(f"Error exporting flashcards: {e}")
+        return jsonify({"error": "Failed to export flashcards"}), 500
+
+@app.route('/import', methods=['POST'])
+def import_deck():
+    """Import cards from an NDJSON or CSV request body into a deck.
+
+    The format comes from ?format= or the Content-Type (application/x-ndjson
+    or text/csv). Cards already in the deck are skipped as duplicates.
+    """
+    try:
+        deck_id, error = resolve_request_deck()
+        if error:
+            return error
+        fmt = transfer_format()
+        if fmt not in TRANSFER_FORMATS:
+            return jsonify({"error": f"'format' must be one of {', '.join(TRANSFER_FORMATS)}"}), 400
+
+        records = iter_import_records(iter_request_lines(request.stream), fmt)
+        summary = import_flashcards(deck_id, records)
+
+        logger.info(f"Imported into deck {deck_id}: {summary['inserted']} inserted, "
+                    f"{summary['duplicates']} duplicates, {summary['invalid']} invalid")
+        return jsonify({
+            "message": f"Imported {summary['inserted']} flashcards, skipped {summary['duplicates']} duplicates",
+            **summary
+        })
+
+    except Exception as e:
+        logger.error(f"Error importing flashcards: {e}")
+        return jsonify({"error": "Failed to import flashcards"}), 500
+
 @app.route('/save_flashcard', methods=['POST'])
 def save_flashcard():
     try:
@@ -459,23 +4251,21 @@ def save_flashcard():
             return jsonify({"error": "Question and answer are required"}), 400
 
         conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Check for duplicates
-        cursor.execute("SELECT COUNT(*) FROM flashcards WHERE question = %s", (question,))
-        if cursor.fetchone()[0] > 0:
+        try:
+            cursor = conn.cursor()
+            deck_id, error = resolve_request_deck(cursor)
+            if error:
+                return error
+            # Check for duplicates and insert in one indexed pass
+            with DB_QUERY_SECONDS.time(operation="insert"):
+                inserted, _ = insert_flashcards_batch(cursor, deck_id, [{"question": question, "answer": answer}])
+                conn.commit()
             cursor.close()
+        finally:
             conn.close()
+
+        if not inserted:
             return jsonify({"message": "This flashcard already exists!"}), 200
-        
-        # Insert new flashcard
-        cursor.execute(
-            "INSERT INTO flashcards (question, answer, created_at) VALUES (%s, %s, %s)", 
-            (question, answer, datetime.now())
-        )
-        conn.commit()
-        cursor.close()
-        conn.close()
 
         logger.info(f"Saved flashcard: {question[:50]}...")
         return jsonify({"message": "Flashcard saved successfully!"})
@@ -484,9 +4274,88 @@ def save_flashcard():
         logger.error(f"Error saving flashcard: {e}")
         return jsonify({"error": "Failed to save flashcard"}), 500
 
+@app.route('/save_flashcards', methods=['POST'])
+def save_flashcards():
+    """Save many flashcards in one request and one transaction.
+
+    Accepts either a JSON list of {question, answer} objects or
+    {"flashcards": [...]}. Reports which cards were inserted, which were
+    skipped as duplicates and which were rejected as invalid, by their
+    index in the submitted list.
+    """
+    try:
+        data = request.get_json(silent=True)
+        cards = data.get("flashcards") if isinstance(data, dict) else data
+
+        if not isinstance(cards, list) or not cards:
+            return jsonify({"error": "A non-empty list of flashcards is required"}), 400
+        if len(cards) > SAVE_BATCH_MAX:
+            return jsonify({"error": f"At most {SAVE_BATCH_MAX} flashcards can be saved per request"}), 400
+
+        valid_cards = []
+        valid_indexes = []
+        invalid = []
+        for i, card in enumerate(cards):
+            question = str(card.get("question") or "").strip() if isinstance(card, dict) else ""
+            answer = str(card.get("answer") or "").strip() if isinstance(card, dict) else ""
+            if not question or not answer:
+                invalid.append({"index": i, "error": "Question and answer are required"})
+                continue
+            valid_cards.append({"question": question, "answer": answer})
+            valid_indexes.append(i)
+
+        inserted, duplicates = [], []
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            deck_id, error = resolve_request_deck(cursor)
+            if error:
+                return error
+            if valid_cards:
+                with DB_QUERY_SECONDS.time(operation="insert_batch"):
+                    inserted, duplicates = insert_flashcards_batch(cursor, deck_id, valid_cards)
+                    conn.commit()
+        finally:
+            cursor.close()
+            conn.close()
+
+        logger.info(f"Bulk save: {len(inserted)} inserted, {len(duplicates)} duplicates, {len(invalid)} invalid")
+        return jsonify({
+            "message": f"Saved {len(inserted)} flashcards, skipped {len(duplicates)} duplicates",
+            "inserted": [{"index": valid_indexes[i], "question": valid_cards[i]["question"]} for i in inserted],
+            "duplicates": [{"index": valid_indexes[i], "question": valid_cards[i]["question"]} for i in duplicates],
+            "invalid": invalid
+        })
+
+    except Exception as e:
+        logger.error(f"Error bulk saving flashcards: {e}")
+        return jsonify({"error": "Failed to save flashcards"}), 500
+
 @app.route("/generate_flashcards", methods=["POST"])
 def generate_flashcards():
     try:
+        if request.mimetype == 'text/plain':
+            # Raw text body: read and process it incrementally, charged by
+            # its declared length and never read past GENERATE_MAX_CHARS
+            slot, error = admit_generation(min(request.content_length or GENERATE_MAX_CHARS, GENERATE_MAX_CHARS))
+            if error:
+                return error
+            received = [0]
+
+            def blocks():
+                for block in limit_text(iter_request_text(request.stream), GENERATE_MAX_CHARS):
+                    received[0] += len(block.strip())
+                    yield block
+
+            with slot:
+                flashcards = final_cards(iter_streaming_generation_events(blocks()))
+            if received[0] < 20:
+                return jsonify({"error": "Please provide more substantial content to generate flashcards"}), 400
+            logger.info(f"Successfully generated {len(flashcards)} flashcards from streamed text")
+            return jsonify(flashcards)
+
+        # Refuse oversized JSON bodies before parsing them
+        request.max_content_length = GENERATE_MAX_BODY_BYTES
         data = request.get_json()
         
         # Handle both 'text' and 'notes' keys for compatibility
@@ -495,61 +4364,141 @@ def generate_flashcards():
         if not text or len(text.strip()) < 20:
             return jsonify({"error": "Please provide more substantial content to generate flashcards"}), 400
 
-        logger.info(f"Generating flashcards for {len(text)} characters of text")
-        
-        # Step 1: Create comprehensive flashcards
-        flashcards = create_comprehensive_flashcards(text)
-        
-        # Step 2: If we have very few cards, try AI enhancement
-        if len(flashcards) < 3:
+        text = normalize_input_text(text)
+        cache_key = generation_cache_key(text)
+        flashcards = generation_cache.get(cache_key)
+        background = bool(data.get("async") or request.args.get("async") == "1")
+        slot, error = admit_generation(len(text), cached=flashcards is not _MISSING, background=background)
+        if error:
+            return error
+        if flashcards is not _MISSING:
+            logger.info(f"Returning cached flashcards for {len(text)} characters of text")
+            return jsonify(flashcards)
+
+        if background:
             try:
-                logger.info("Attempting AI-enhanced generation...")
-                
-                # Try different AI approaches
-                ai_models_to_try = [
-                    {
-                        "url": f"https://api-inference.huggingface.co/models/google/flan-t5-base",
-                        "prompt": f"Generate 5 study questions and answers from this text: {text[:500]}"
-                    },
-                    {
-                        "url": f"https://api-inference.huggingface.co/models/{MODELS['text_analysis']}",
-                        "prompt": text[:800]
-                    }
-                ]
-                
-                for model_config in ai_models_to_try:
-                    ai_response = call_huggingface_api(model_config["prompt"], model_config["url"])
-                    
-                    if ai_response:
-                        ai_cards = parse_ai_response(ai_response, text)
-                        if ai_cards:
-                            flashcards.extend(ai_cards)
-                            break
-                            
-            except Exception as e:
-                logger.warning(f"AI enhancement failed: {e}")
-        
-        # Step 3: Final fallback if still no good cards
-        if len(flashcards) < 2:
-            logger.info("Using fallback flashcard generation")
-            flashcards = create_fallback_flashcards(text)
-        
-        # Step 4: Final processing
-        flashcards = flashcards[:12]  # Limit to 12 cards
-        
-        if not flashcards:
-            return jsonify([{
-                "question": "Unable to generate flashcards from this content",
-                "answer": "Please try providing more structured text with clear concepts, definitions, or key facts."
-            }])
-        
+                job_id = job_runner.submit(text, cache_key=cache_key)
+            except JobQueueFullError as e:
+                logger.warning(f"Rejected generation job: {e}")
+                response = jsonify({"error": "Too many generation jobs in progress, please retry shortly"})
+                response.headers["Retry-After"] = "10"
+                return response, 503
+            logger.info(f"Queued generation job {job_id} for {len(text)} characters of text")
+            response = jsonify({"job_id": job_id, "status": "queued", "status_url": f"/jobs/{job_id}"})
+            response.headers["Location"] = f"/jobs/{job_id}"
+            return response, 202
+
+        logger.info(f"Generating flashcards for {len(text)} characters of text")
+        with slot:
+            done = final_event(iter_generation_events(text))
+        flashcards = done["cards"]
+        cache_generation_result(cache_key, done)
+
         logger.info(f"Successfully generated {len(flashcards)} flashcards")
         return jsonify(flashcards)
-        
+
+    except RequestEntityTooLarge:
+        ADMISSION_REJECTED.inc(reason="too_large")
+        return jsonify({"error": f"Notes are limited to {GENERATE_MAX_CHARS} characters"}), 413
     except Exception as e:
         logger.error(f"Error in generate_flashcards: {e}")
         return jsonify({"error": "An error occurred while generating flashcards"}), 500
 
+@app.route("/generate_from_file", methods=["POST"])
+def generate_from_file():
+    """Generate flashcards from an uploaded .txt, .md, .pdf or .docx file.
+
+    Send multipart/form-data with the document in the "file" field. Text is
+    extracted as the generation reads it, and at most GENERATE_MAX_CHARS of
+    it are processed.
+    """
+    try:
+        request.max_content_length = UPLOAD_MAX_BYTES
+        upload = request.files.get("file")
+        if upload is None or not upload.filename:
+            return jsonify({"error": "Upload a document in the 'file' field"}), 400
+        extractor = upload_extractor(upload.filename)
+
+        upload.stream.seek(0, os.SEEK_END)
+        size = upload.stream.tell()
+        upload.stream.seek(0)
+        slot, error = admit_generation(min(size, GENERATE_MAX_CHARS))
+        if error:
+            return error
+        received = [0]
+
+        def blocks():
+            for block in limit_text(extractor(upload.stream), GENERATE_MAX_CHARS):
+                received[0] += len(block.strip())
+                yield block
+
+        logger.info(f"Generating flashcards from uploaded file {upload.filename!r} ({size} bytes)")
+        with slot:
+            flashcards = final_cards(iter_streaming_generation_events(blocks()))
+        if received[0] < 20:
+            return jsonify({"error": "Could not find enough text in the uploaded file"}), 400
+        logger.info(f"Successfully generated {len(flashcards)} flashcards from {upload.filename!r}")
+        return jsonify(flashcards)
+
+    except RequestEntityTooLarge:
+        return jsonify({"error": f"Uploads are limited to {format_size(UPLOAD_MAX_BYTES)}"}), 413
+    except UnsupportedUploadError as e:
+        return jsonify({"error": str(e)}), 415
+    except UnreadableUploadError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error in generate_from_file: {e}")
+        return jsonify({"error": "An error occurred while generating flashcards"}), 500
+
+@app.route("/generate_flashcards/stream", methods=["POST"])
+def generate_flashcards_stream():
+    """Server-Sent Events version of /generate_flashcards.
+
+    Emits a "cards" event as soon as rule-based cards exist and another as
+    each AI call completes, then a "done" event with the final card list.
+    """
+    started = time.monotonic()
+    data = request.get_json(silent=True) or {}
+    text = data.get("notes") or data.get("text", "")
+
+    if not text or len(text.strip()) < 20:
+        return jsonify({"error": "Please provide more substantial content to generate flashcards"}), 400
+
+    text = normalize_input_text(text)
+    cache_key = generation_cache_key(text)
+    cached = generation_cache.get(cache_key)
+    slot, error = admit_generation(len(text), cached=cached is not _MISSING)
+    if error:
+        return error
+
+    def sse(event, payload):
+        return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+    def events():
+        first_card_at = None
+        try:
+            source = [{"stage": "done", "cards": cached}] if cached is not _MISSING else iter_generation_events(text)
+            for event in source:
+                if event["cards"] and first_card_at is None:
+                    first_card_at = time.monotonic()
+                    stream_stats.record_first_card(first_card_at - started)
+                if event["stage"] == "done":
+                    if cached is _MISSING:
+                        cache_generation_result(cache_key, event)
+                    yield sse("done", {"cards": event["cards"]})
+                else:
+                    yield sse("cards", event)
+        except Exception as e:
+            logger.error(f"Error in generate_flashcards_stream: {e}")
+            yield sse("error", {"error": "An error occurred while generating flashcards"})
+
+    response = Response(events(), mimetype='text/event-stream', headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"  # don't let nginx buffer the stream
+    })
+    response.call_on_close(slot.release)  # hold the AI slot until the stream ends
+    return response
+
 def parse_ai_response(ai_response, original_text):
     """Parse AI response to extract question-answer pairs"""
     cards = []
@@ -562,14 +4511,8 @@ def parse_ai_response(ai_response, original_text):
                 generated = result["generated_text"]
                 
                 # Try to parse structured Q&A format
-                qa_patterns = [
-                    r'(?:Question|Q):\s*([^?\n]+\?)\s*(?:Answer|A):\s*([^\n]+)',
-                    r'(\d+\.\s*[^?\n]+\?)\s*([^\d\n]+?)(?=\d+\.|$)',
-                    r'([^?\n]+\?)\s*([^\?\n]+?)(?=[^?\n]+\?|$)'
-                ]
-                
-                for pattern in qa_patterns:
-                    matches = re.finditer(pattern, generated, re.MULTILINE | re.IGNORECASE)
+                for pattern in AI_QA_PATTERNS:
+                    matches = pattern.finditer(generated)
                     for match in matches:
                         question = match.group(1).strip()
                         answer = match.group(2).strip()
@@ -596,22 +4539,58 @@ def parse_ai_response(ai_response, original_text):
     return cards
 
 # --- Additional Routes for Enhanced Functionality ---
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Status, progress and (partial) cards of a generation job"""
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job_response(job))
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def stream_job_events(job_id):
+    """Server-Sent Events stream of job progress until it finishes"""
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+
+    def events(job):
+        yield f"event: progress\ndata: {json.dumps(job_response(job))}\n\n"
+        while job["status"] not in JOB_FINISHED:
+            updated = job_store.wait_for_update(job_id, job["version"], timeout=15)
+            if updated is None:
+                return
+            if updated["version"] == job["version"]:
+                yield ": keep-alive\n\n"
+                continue
+            job = updated
+            yield f"event: progress\ndata: {json.dumps(job_response(job))}\n\n"
+
+    return Response(events(job), mimetype='text/event-stream', headers={"Cache-Control": "no-cache"})
+
 @app.route('/delete_flashcard/<int:card_id>', methods=['DELETE'])
 def delete_flashcard(card_id):
     try:
         conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM flashcards WHERE id = %s", (card_id,))
-        conn.commit()
-        
-        if cursor.rowcount > 0:
+        try:
+            cursor = conn.cursor()
+            deck_id, error = resolve_request_deck(cursor)
+            if error:
+                return error
+            with DB_QUERY_SECONDS.time(operation="delete"):
+                cursor.execute("DELETE FROM flashcards WHERE id = %s AND deck_id = %s", (card_id, deck_id))
+                deleted = cursor.rowcount
+                if deleted > 0:
+                    bump_deck_version(cursor, deck_id)
+                conn.commit()
             cursor.close()
+        finally:
             conn.close()
+        saved_question_index.remove([card_id])
+        
+        if deleted > 0:
             return jsonify({"message": "Flashcard deleted successfully!"})
-        else:
-            cursor.close()
-            conn.close()
-            return jsonify({"error": "Flashcard not found"}), 404
+        return jsonify({"error": "Flashcard not found"}), 404
             
     except Exception as e:
         logger.error(f"Error deleting flashcard: {e}")
@@ -619,14 +4598,12 @@ def delete_flashcard(card_id):
 
 @app.route('/clear_all_flashcards', methods=['DELETE'])
 def clear_all_flashcards():
+    """Delete every card in one deck (the default deck unless deck_id is given)"""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM flashcards")
-        conn.commit()
-        deleted_count = cursor.rowcount
-        cursor.close()
-        conn.close()
+        deck_id, error = resolve_request_deck()
+        if error:
+            return error
+        deleted_count = delete_deck_cards(deck_id)
         
         return jsonify({"message": f"Deleted {deleted_count} flashcards successfully!"})
         
@@ -634,20 +4611,179 @@ def clear_all_flashcards():
         logger.error(f"Error clearing flashcards: {e}")
         return jsonify({"error": "Failed to clear flashcards"}), 500
 
+@app.route('/owners', methods=['POST'])
+def create_owner():
+    try:
+        data = request.get_json(silent=True) or {}
+        name = str(data.get("name") or "").strip()
+        if not name or len(name) > 191:
+            return jsonify({"error": "A name of at most 191 characters is required"}), 400
+
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT id FROM owners WHERE name = %s", (name,))
+            if cursor.fetchone():
+                return jsonify({"error": "An owner with this name already exists"}), 409
+            cursor.execute("INSERT INTO owners (name, created_at) VALUES (%s, %s)", (name, datetime.now()))
+            owner_id = cursor.lastrowid
+            conn.commit()
+        finally:
+            cursor.close()
+            conn.close()
+
+        logger.info(f"Created owner {owner_id}")
+        return jsonify({"id": owner_id, "name": name}), 201
+
+    except Exception as e:
+        logger.error(f"Error creating owner: {e}")
+        return jsonify({"error": "Failed to create owner"}), 500
+
+@app.route('/owners/<int:owner_id>/decks', methods=['GET'])
+def list_decks(owner_id):
+    """An owner's decks, read from the (owner_id, name) index"""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute("SELECT id FROM owners WHERE id = %s", (owner_id,))
+            if cursor.fetchone() is None:
+                return jsonify({"error": "Owner not found"}), 404
+            cursor.execute(
+                "SELECT id, name, created_at FROM decks WHERE owner_id = %s ORDER BY name",
+                (owner_id,)
+            )
+            decks = [serialize_deck(deck) for deck in cursor.fetchall()]
+        finally:
+            cursor.close()
+            conn.close()
+        return jsonify(decks)
+
+    except Exception as e:
+        logger.error(f"Error listing decks: {e}")
+        return jsonify({"error": "Failed to list decks"}), 500
+
+@app.route('/owners/<int:owner_id>/decks', methods=['POST'])
+def create_deck(owner_id):
+    try:
+        data = request.get_json(silent=True) or {}
+        name = str(data.get("name") or "").strip()
+        if not name or len(name) > 191:
+            return jsonify({"error": "A name of at most 191 characters is required"}), 400
+
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT id FROM owners WHERE id = %s", (owner_id,))
+            if cursor.fetchone() is None:
+                return jsonify({"error": "Owner not found"}), 404
+            cursor.execute("SELECT id FROM decks WHERE owner_id = %s AND name = %s", (owner_id, name))
+            if cursor.fetchone():
+                return jsonify({"error": "This owner already has a deck with this name"}), 409
+            cursor.execute(
+                "INSERT INTO decks (owner_id, name, created_at) VALUES (%s, %s, %s)",
+                (owner_id, name, datetime.now())
+            )
+            deck_id = cursor.lastrowid
+            conn.commit()
+        finally:
+            cursor.close()
+            conn.close()
+
+        logger.info(f"Created deck {deck_id} for owner {owner_id}")
+        return jsonify({"id": deck_id, "owner_id": owner_id, "name": name}), 201
+
+    except Exception as e:
+        logger.error(f"Error creating deck: {e}")
+        return jsonify({"error": "Failed to create deck"}), 500
+
+@app.route('/decks/<int:deck_id>', methods=['DELETE'])
+def delete_deck(deck_id):
+    """Delete a deck and its cards.
+
+    The cards are removed first, DECK_DELETE_BATCH at a time with each batch
+    in its own short transaction, and the deck row goes last. A deletion
+    that fails part way leaves the deck in place, so it can be retried
+    instead of leaving orphaned cards behind.
+    """
+    try:
+        if deck_id == DEFAULT_DECK_ID:
+            return jsonify({"error": "The default deck can't be deleted"}), 400
+
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            require_deck(cursor, deck_id)
+            cursor.close()
+        except DeckNotFoundError:
+            return jsonify({"error": "Deck not found"}), 404
+        finally:
+            conn.close()
+
+        deleted_count = delete_deck_cards(deck_id)
+
+        # Cards saved while the batches ran go in the same transaction as the deck row
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT id FROM flashcards WHERE deck_id = %s", (deck_id,))
+            stragglers = [row[0] for row in cursor.fetchall()]
+            if stragglers:
+                placeholders = ", ".join(["%s"] * len(stragglers))
+                cursor.execute(f"DELETE FROM flashcards WHERE id IN ({placeholders})", tuple(stragglers))
+            cursor.execute("DELETE FROM decks WHERE id = %s", (deck_id,))
+            conn.commit()
+        finally:
+            cursor.close()
+            conn.close()
+        saved_question_index.remove(stragglers)
+        deleted_count += len(stragglers)
+
+        logger.info(f"Deleted deck {deck_id} with {deleted_count} flashcards")
+        return jsonify({"message": f"Deleted deck and {deleted_count} flashcards successfully!"})
+
+    except Exception as e:
+        logger.error(f"Error deleting deck: {e}")
+        return jsonify({"error": "Failed to delete deck"}), 500
+
+def service_stats():
+    """Runtime stats for connection pools and caches, reported on /health"""
+    return {
+        "pool": get_db_pool().stats(),
+        "caches": {
+            "generation": generation_cache.stats(),
+            "segment": segment_cache.stats(),
+            "inference": {**inference_cache.stats(), "coalesced": inference_calls.coalesced}
+        },
+        "inference": get_inference_backend().stats(),
+        "near_duplicates": saved_question_index.stats(),
+        "jobs": job_runner.stats(),
+        "streaming": stream_stats.stats(),
+        "admission": {
+            "rate_limited": rate_limiter.enabled,
+            "shared": bool(RATE_LIMIT_STATE_PATH),
+            "ai_generation_slots": AI_GENERATION_SLOTS
+        }
+    }
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
     try:
         conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT 1")
-        cursor.fetchone()
-        cursor.close()
-        conn.close()
+        try:
+            cursor = conn.cursor()
+            with DB_QUERY_SECONDS.time(operation="ping"):
+                cursor.execute("SELECT 1")
+                cursor.fetchone()
+            cursor.close()
+        finally:
+            conn.close()
         
         return jsonify({
             "status": "healthy",
             "database": "connected",
+            **service_stats(),
             "timestamp": datetime.now().isoformat()
         })
     except Exception as e:
@@ -655,9 +4791,68 @@ def health_check():
             "status": "unhealthy",
             "database": "disconnected",
             "error": str(e),
+            **service_stats(),
             "timestamp": datetime.now().isoformat()
         }), 500
 
+def collect_service_metrics():
+    """Expose service_stats() counters and levels as Prometheus samples"""
+    stats = service_stats()
+    caches = stats["caches"]
+    pool = stats["pool"]
+    jobs = stats["jobs"]
+    families = [
+        ("flashcards_cache_lookups_total", "counter", "Result cache lookups by cache and outcome", [
+            ({"cache": name, "outcome": outcome}, cache[key])
+            for name, cache in caches.items()
+            for outcome, key in (("hit", "hits"), ("shared_hit", "shared_hits"), ("miss", "misses"))
+        ]),
+        ("flashcards_inference_coalesced_total", "counter", "Inference calls served by an identical in-flight call",
+         [({}, caches["inference"]["coalesced"])]),
+        ("flashcards_db_pool_connections", "gauge", "Database pool connections by state",
+         [({"state": "in_use"}, pool["in_use"]), ({"state": "idle"}, pool["idle"])]),
+        ("flashcards_db_pool_waits_total", "counter", "Connection checkouts that had to wait", [({}, pool["waits"])]),
+        ("flashcards_db_pool_timeouts_total", "counter", "Connection checkouts that timed out", [({}, pool["timeouts"])]),
+        ("flashcards_jobs_in_flight", "gauge", "Generation jobs queued or running", [({}, jobs["active"])]),
+        ("flashcards_jobs_total", "counter", "Generation jobs by outcome", [
+            ({"outcome": outcome}, jobs[outcome]) for outcome in ("submitted", "completed", "failed", "rejected")
+        ]),
+        ("flashcards_saved_questions_indexed", "gauge", "Saved questions in the near-duplicate index",
+         [({}, stats["near_duplicates"]["indexed"])])
+    ]
+    breaker = stats["inference"].get("circuit_breaker")
+    if breaker:
+        families.append(("flashcards_inference_breaker_open", "gauge", "1 while the inference circuit breaker is open",
+                         [({"state": breaker["state"]}, 0 if breaker["state"] == "closed" else 1)]))
+        families.append(("flashcards_inference_breaker_rejected_total", "counter",
+                         "Inference calls skipped by the open circuit breaker", [({}, breaker["rejected"])]))
+    return families
+
+metrics.add_collector(collect_service_metrics)
+
+@app.before_request
+def start_request_metrics():
+    g.metrics_started = time.perf_counter()
+    HTTP_REQUESTS_IN_FLIGHT.inc()
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop("metrics_started", None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started,
+                                     method=request.method, route=route, status=response.status_code)
+    return response
+
+@app.teardown_request
+def finish_request_metrics(error=None):
+    HTTP_REQUESTS_IN_FLIGHT.dec()
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus metrics for this worker process"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 # --- Error Handlers ---
 @app.errorhandler(404)
 def not_found(error):
@@ -668,25 +4863,298 @@ def internal_error(error):
     logger.error(f"Internal server error: {error}")
     return jsonify({"error": "Internal server error"}), 500
 
-if __name__ == "__main__":
-    # Ensure database table exists
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS flashcards (
+# --- Database Schema ---
+MYSQL_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS flashcards (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        question TEXT NOT NULL,
+        answer TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """
+]
+
+SQLITE_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS flashcards (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        question TEXT NOT NULL,
+        answer TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """
+]
+
+def _backfill_question_hashes(cursor):
+    """Hash existing questions; pre-existing duplicates keep a NULL hash"""
+    cursor.execute("SELECT id, question FROM flashcards ORDER BY id")
+    rows = cursor.fetchall()
+    seen = set()
+    updates = []
+    for card_id, question in rows:
+        digest = question_hash(question)
+        if digest not in seen:
+            seen.add(digest)
+            updates.append((digest, card_id))
+    for i in range(0, len(updates), 1000):
+        cursor.executemany("UPDATE flashcards SET question_hash = %s WHERE id = %s", updates[i:i + 1000])
+
+def _backfill_question_simhashes(cursor):
+    """Fingerprint existing questions for the near-duplicate index"""
+    cursor.execute("SELECT id, question FROM flashcards WHERE question_simhash IS NULL ORDER BY id")
+    updates = [(question_simhash(question), card_id) for card_id, question in cursor.fetchall()]
+    for i in range(0, len(updates), 1000):
+        cursor.executemany("UPDATE flashcards SET question_simhash = %s WHERE id = %s", updates[i:i + 1000])
+
+# Ordered schema migrations: (version, MySQL statements, SQLite statements).
+# A statement may also be a callable taking the cursor, for data backfills.
+# Applied versions are recorded in schema_migrations so each runs once.
+MIGRATIONS = [
+    (
+        "0001_flashcards_created_id_index",
+        ["CREATE INDEX idx_flashcards_created_id ON flashcards (created_at, id)"],
+        ["CREATE INDEX IF NOT EXISTS idx_flashcards_created_id ON flashcards (created_at, id)"]
+    ),
+    (
+        "0002_flashcards_question_hash",
+        [
+            "ALTER TABLE flashcards ADD COLUMN question_hash CHAR(64) NULL",
+            _backfill_question_hashes,
+            "CREATE UNIQUE INDEX uq_flashcards_question_hash ON flashcards (question_hash)"
+        ],
+        [
+            "ALTER TABLE flashcards ADD COLUMN question_hash TEXT",
+            _backfill_question_hashes,
+            "CREATE UNIQUE INDEX IF NOT EXISTS uq_flashcards_question_hash ON flashcards (question_hash)"
+        ]
+    ),
+    (
+        "0003_flashcards_question_simhash",
+        ["ALTER TABLE flashcards ADD COLUMN question_simhash BIGINT NULL", _backfill_question_simhashes],
+        ["ALTER TABLE flashcards ADD COLUMN question_simhash INTEGER", _backfill_question_simhashes]
+    ),
+    (
+        "0004_flashcards_full_text",
+        ["CREATE FULLTEXT INDEX ft_flashcards_question_answer ON flashcards (question, answer)"],
+        [
+            # External-content FTS5 index kept in sync by triggers
+            """
+            CREATE VIRTUAL TABLE IF NOT EXISTS flashcards_fts USING fts5(
+                question, answer, content='flashcards', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2'
+            )
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS flashcards_fts_insert AFTER INSERT ON flashcards BEGIN
+                INSERT INTO flashcards_fts (rowid, question, answer) VALUES (new.id, new.question, new.answer);
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS flashcards_fts_delete AFTER DELETE ON flashcards BEGIN
+                INSERT INTO flashcards_fts (flashcards_fts, rowid, question, answer)
+                VALUES ('delete', old.id, old.question, old.answer);
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS flashcards_fts_update AFTER UPDATE OF question, answer ON flashcards BEGIN
+                INSERT INTO flashcards_fts (flashcards_fts, rowid, question, answer)
+                VALUES ('delete', old.id, old.question, old.answer);
+                INSERT INTO flashcards_fts (rowid, question, answer) VALUES (new.id, new.question, new.answer);
+            END
+            """,
+            "INSERT INTO flashcards_fts (flashcards_fts, rank) VALUES ('rank', 'bm25(2.0, 1.0)')",
+            "INSERT INTO flashcards_fts (flashcards_fts) VALUES ('rebuild')"
+        ]
+    ),
+    (
+        "0005_flashcards_review_schedule",
+        [
+            f"ALTER TABLE flashcards ADD COLUMN ease DOUBLE NOT NULL DEFAULT {DEFAULT_EASE}, "
+            "ADD COLUMN interval_days DOUBLE NOT NULL DEFAULT 0, "
+            "ADD COLUMN repetitions INT NOT NULL DEFAULT 0, "
+            "ADD COLUMN lapses INT NOT NULL DEFAULT 0, "
+            "ADD COLUMN due_at TIMESTAMP NULL, "
+            "ADD COLUMN last_reviewed_at TIMESTAMP NULL",
+            "UPDATE flashcards SET due_at = created_at WHERE due_at IS NULL",
+            "CREATE INDEX idx_flashcards_due ON flashcards (due_at, id)",
+            """
+            CREATE TABLE IF NOT EXISTS flashcard_reviews (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                card_id INT NOT NULL,
+                grade TINYINT NOT NULL,
+                ease DOUBLE NOT NULL,
+                interval_days DOUBLE NOT NULL,
+                reviewed_at TIMESTAMP NOT NULL,
+                INDEX idx_flashcard_reviews_card (card_id, reviewed_at),
+                FOREIGN KEY (card_id) REFERENCES flashcards (id) ON DELETE CASCADE
+            ) ENGINE=InnoDB
+            """
+        ],
+        [
+            f"ALTER TABLE flashcards ADD COLUMN ease REAL NOT NULL DEFAULT {DEFAULT_EASE}",
+            "ALTER TABLE flashcards ADD COLUMN interval_days REAL NOT NULL DEFAULT 0",
+            "ALTER TABLE flashcards ADD COLUMN repetitions INTEGER NOT NULL DEFAULT 0",
+            "ALTER TABLE flashcards ADD COLUMN lapses INTEGER NOT NULL DEFAULT 0",
+            "ALTER TABLE flashcards ADD COLUMN due_at TIMESTAMP",
+            "ALTER TABLE flashcards ADD COLUMN last_reviewed_at TIMESTAMP",
+            "UPDATE flashcards SET due_at = created_at WHERE due_at IS NULL",
+            "CREATE INDEX IF NOT EXISTS idx_flashcards_due ON flashcards (due_at, id)",
+            """
+            CREATE TABLE IF NOT EXISTS flashcard_reviews (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                card_id INTEGER NOT NULL REFERENCES flashcards (id) ON DELETE CASCADE,
+                grade INTEGER NOT NULL,
+                ease REAL NOT NULL,
+                interval_days REAL NOT NULL,
+                reviewed_at TIMESTAMP NOT NULL
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_flashcard_reviews_card ON flashcard_reviews (card_id, reviewed_at)"
+        ]
+    ),
+    (
+        # Decks and owners; every flashcards index now leads with deck_id
+        "0006_decks_and_owners",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS owners (
                 id INT AUTO_INCREMENT PRIMARY KEY,
-                question TEXT NOT NULL,
-                answer TEXT NOT NULL,
+                name VARCHAR(191) NOT NULL,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+                UNIQUE INDEX uq_owners_name (name)
             ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
-        """)
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS decks (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                owner_id INT NOT NULL,
+                name VARCHAR(191) NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE INDEX uq_decks_owner_name (owner_id, name),
+                FOREIGN KEY (owner_id) REFERENCES owners (id)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+            """,
+            "INSERT INTO owners (id, name) VALUES (1, 'default')",
+            f"INSERT INTO decks (id, owner_id, name) VALUES ({DEFAULT_DECK_ID}, 1, 'Default')",
+            f"ALTER TABLE flashcards ADD COLUMN deck_id INT NOT NULL DEFAULT {DEFAULT_DECK_ID}, "
+            "ADD UNIQUE INDEX uq_flashcards_deck_question (deck_id, question_hash), "
+            "ADD INDEX idx_flashcards_deck_created (deck_id, created_at, id), "
+            "ADD INDEX idx_flashcards_deck_due (deck_id, due_at, id), "
+            "DROP INDEX uq_flashcards_question_hash, "
+            "DROP INDEX idx_flashcards_created_id, "
+            "DROP INDEX idx_flashcards_due"
+        ],
+        [
+            """
+            CREATE TABLE IF NOT EXISTS owners (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL UNIQUE,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS decks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                owner_id INTEGER NOT NULL REFERENCES owners (id),
+                name TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE (owner_id, name)
+            )
+            """,
+            "INSERT OR IGNORE INTO owners (id, name) VALUES (1, 'default')",
+            f"INSERT OR IGNORE INTO decks (id, owner_id, name) VALUES ({DEFAULT_DECK_ID}, 1, 'Default')",
+            f"ALTER TABLE flashcards ADD COLUMN deck_id INTEGER NOT NULL DEFAULT {DEFAULT_DECK_ID}",
+            "CREATE UNIQUE INDEX IF NOT EXISTS uq_flashcards_deck_question ON flashcards (deck_id, question_hash)",
+            "CREATE INDEX IF NOT EXISTS idx_flashcards_deck_created ON flashcards (deck_id, created_at, id)",
+            "CREATE INDEX IF NOT EXISTS idx_flashcards_deck_due ON flashcards (deck_id, due_at, id)",
+            "DROP INDEX IF EXISTS uq_flashcards_question_hash",
+            "DROP INDEX IF EXISTS idx_flashcards_created_id",
+            "DROP INDEX IF EXISTS idx_flashcards_due"
+        ]
+    ),
+    (
+        # Per-deck change counter behind listing ETags
+        "0007_deck_version",
+        ["ALTER TABLE decks ADD COLUMN version BIGINT NOT NULL DEFAULT 0"],
+        ["ALTER TABLE decks ADD COLUMN version INTEGER NOT NULL DEFAULT 0"]
+    )
+]
+
+def run_migrations(conn):
+    """Apply any migrations that haven't been recorded yet"""
+    cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version VARCHAR(191) PRIMARY KEY,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("SELECT version FROM schema_migrations")
+    applied = {row[0] for row in cursor.fetchall()}
+
+    for version, mysql_statements, sqlite_statements in MIGRATIONS:
+        if version in applied:
+            continue
+        statements = sqlite_statements if DB_BACKEND == "sqlite" else mysql_statements
+        for statement in statements:
+            if callable(statement):
+                statement(cursor)
+            else:
+                cursor.execute(statement)
+        cursor.execute("INSERT INTO schema_migrations (version) VALUES (%s)", (version,))
+        conn.commit()
+        logger.info(f"Applied database migration {version}")
+    cursor.close()
+
+def init_db():
+    """Create the database tables if they don't exist yet and migrate them"""
+    statements = SQLITE_SCHEMA if DB_BACKEND == "sqlite" else MYSQL_SCHEMA
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        for statement in statements:
+            cursor.execute(statement)
         conn.commit()
         cursor.close()
+        run_migrations(conn)
+    finally:
         conn.close()
-        logger.info("Database table verified/created successfully")
-    except Exception as e:
-        logger.error(f"Database initialization error: {e}")
+
+_db_ready = False
+_db_ready_lock = threading.Lock()
+
+def ensure_db():
+    """Run init_db once per process; a failed attempt is retried on the next call"""
+    global _db_ready
+    if _db_ready:
+        return
+    with _db_ready_lock:
+        if _db_ready:
+            return
+        try:
+            init_db()
+            _db_ready = True
+            logger.info("Database table verified/created successfully")
+        except Exception as e:
+            logger.error(f"Database initialization error: {e}")
+
+@app.before_request
+def prepare_database():
+    # `flask run` and gunicorn import the app without running __main__, so
+    # the schema and migrations are applied before the first request instead
+    ensure_db()
+
+@app.cli.command("init-db")
+def init_db_command():
+    """Create the tables and apply pending migrations."""
+    init_db()
+    print("Database is up to date")
+
+if __name__ == "__main__":
+    # Ensure database table exists
+    ensure_db()
     
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,370 @@
+"""Benchmarks for the flashcard generation pipeline and the Flask routes.
+
+Runs entirely offline: the app is pointed at a throwaway SQLite database
+and a local mock of the inference API, so results only reflect this code.
+
+    python benchmarks/bench.py                         # full run, JSON to stdout
+    python benchmarks/bench.py --quick -o before.json  # smaller corpora, fewer requests
+    python benchmarks/bench.py -o after.json --compare before.json
+
+Results are JSON so runs from different commits can be compared; --compare
+prints the timing ratio for every measurement present in both files.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SIZES = {"1kb": 1_000, "10kb": 10_000, "100kb": 100_000, "1mb": 1_000_000}
+QUICK_SIZES = ("1kb", "10kb", "100kb")
+
+# --- Corpus ---
+TOPICS = [
+    "photosynthesis", "mitochondria", "osmosis", "the water cycle", "plate tectonics",
+    "inflation", "supply and demand", "the french revolution", "recursion", "entropy",
+    "natural selection", "the immune system", "electric current", "democracy", "erosion"
+]
+TERMS = [
+    "Photosynthesis", "Mitochondria", "Osmosis", "Evaporation", "Subduction", "Inflation",
+    "Recursion", "Entropy", "Mutation", "Antibody", "Voltage", "Sediment", "Catalyst", "Enzyme"
+]
+FILLER = (
+    "students often review this material before exams and connect it with earlier chapters "
+    "while the textbook gives several worked examples and a short summary at the end"
+).split()
+
+# Hand-written notes in the shape users actually paste in
+REAL_NOTES = """Cell Biology - Lecture 3
+
+Mitochondria is the powerhouse of the cell. It produces ATP through cellular respiration.
+The nucleus contains the genetic material of the cell. Ribosomes are responsible for protein synthesis.
+
+Key points:
+- Osmosis is the movement of water across a semipermeable membrane
+- Diffusion moves particles from high to low concentration
+- Active transport requires energy in the form of ATP
+
+Definition: Homeostasis - the maintenance of a stable internal environment.
+Important: enzymes lower the activation energy of reactions.
+High temperature causes enzymes to denature, which leads to a loss of function.
+Note: exam covers chapters 3 to 5.
+"""
+
+
+def synthetic_notes(size, seed=0, head=REAL_NOTES):
+    """Deterministic notes mixing every pattern the extractor looks for"""
+    rng = random.Random(seed)
+    parts = [head]
+    length = len(head)
+    while length < size:
+        term, other = rng.sample(TERMS, 2)
+        topic = rng.choice(TOPICS)
+        filler = " ".join(rng.sample(FILLER, rng.randint(4, 12)))
+        kind = rng.randrange(6)
+        if kind == 0:
+            piece = f"{term} is a process that explains {topic} and {filler}. "
+        elif kind == 1:
+            piece = f"Rising {term.lower()} causes changes in {topic}, which {filler}. "
+        elif kind == 2:
+            piece = f"\nKey: {term} - the part of {topic} where {filler}.\n"
+        elif kind == 3:
+            piece = "\n" + "\n".join(f"- {rng.choice(TERMS)} relates to {rng.choice(TOPICS)}" for _ in range(3)) + "\n"
+        elif kind == 4:
+            piece = f"{term}: a concept in {topic} that {filler}. {other} refers to {filler}. "
+        else:
+            piece = f"\n\n{topic.title()}\n{filler.capitalize()}. "
+        parts.append(piece)
+        length += len(piece)
+    return "".join(parts)[:size]
+
+
+def pathological_inputs():
+    """Inputs that used to trigger super-linear regex backtracking"""
+    words = [FILLER[i % len(FILLER)] for i in range(2000)]
+    return {
+        "unpunctuated_10kb": " ".join(words)[:10_000],
+        "keyword_runs": ("concept is " * 1500)[:15_000],
+        "colon_chain": ("term: " * 2500)[:15_000],
+        "dash_chain": ("word - " * 2500)[:15_000],
+        "whitespace_runs": ("alpha" + " \t " * 50) * 200,
+        "bullet_lines": "\n".join(f"- item {i} without an ending" for i in range(3000)),
+        "long_token": "x" * 100_000,
+        "causes_chain": ("heat causes " * 1500)[:15_000],
+    }
+
+
+# --- Mock inference API ---
+class MockInferenceHandler(BaseHTTPRequestHandler):
+    latency = 0.02
+    calls = 0
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        MockInferenceHandler.calls += 1
+        time.sleep(self.latency)
+        inputs = body["inputs"]
+
+        def answer(text):
+            head = " ".join(str(text).split()[:6])
+            if "bart" in self.path:
+                return {"summary_text": f"Summary: {head}."}
+            return {"generated_text": f"Question: What does the text say about {head}? Answer: It explains {head}."}
+
+        result = [answer(text) for text in inputs] if isinstance(inputs, list) else [answer(inputs)]
+        data = json.dumps(result).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def start_mock_server(latency):
+    MockInferenceHandler.latency = latency
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockInferenceHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# --- Measurement ---
+def time_call(fn, repeat, setup=None):
+    """Run ``fn`` ``repeat`` times, calling ``setup`` untimed before each; timings in milliseconds"""
+    samples = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return {
+        "min_ms": round(min(samples), 3),
+        "median_ms": round(statistics.median(samples), 3),
+        "mean_ms": round(statistics.fmean(samples), 3),
+        "runs": repeat
+    }
+
+
+def clear_caches(app):
+    """Empty the in-memory result caches so the next generation does all the work"""
+    for cache in (app.inference_cache, app.segment_cache, app.generation_cache):
+        cache.clear()
+
+
+def cache_hits(app):
+    return sum(cache.stats()["hits"] for cache in (app.inference_cache, app.segment_cache, app.generation_cache))
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def bench_pipeline(app, corpora, repeat):
+    results = {}
+    for name, text in corpora.items():
+        chunks = app.clean_and_split_text(text)
+        concepts = app.extract_key_concepts(text)
+        cards = app.generate_questions_from_concepts(concepts)
+        runs = max(1, repeat if len(text) <= 100_000 else repeat // 5)
+        results[name] = {
+            "chars": len(text),
+            "clean_and_split_text": time_call(lambda: app.clean_and_split_text(text), runs),
+            "extract_key_concepts": time_call(lambda: app.extract_key_concepts(text), runs),
+            "generate_questions_from_concepts": time_call(lambda: app.generate_questions_from_concepts(concepts), runs),
+            "remove_duplicate_flashcards": time_call(lambda: app.remove_duplicate_flashcards(cards), runs),
+            "improve_flashcard_quality": time_call(lambda: app.improve_flashcard_quality(cards), runs),
+            # Without clearing, every run after the first is served by the caches
+            "generate_flashcards_for_text": time_call(lambda: app.generate_flashcards_for_text(text), runs,
+                                                      setup=lambda: clear_caches(app)),
+            "chunks": len(chunks),
+            "concepts": len(concepts),
+        }
+        print(f"  pipeline {name}: extract {results[name]['extract_key_concepts']['median_ms']} ms", file=sys.stderr)
+    return results
+
+
+def load_test(app, name, make_request, requests_total, concurrency):
+    """Fire ``requests_total`` requests from ``concurrency`` threads"""
+    clients = threading.local()
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def one(i):
+        client = getattr(clients, "client", None)
+        if client is None:
+            client = clients.client = app.app.test_client()
+        started = time.perf_counter()
+        response = make_request(client, i)
+        elapsed = (time.perf_counter() - started) * 1000
+        response.get_data()
+        with lock:
+            latencies.append(elapsed)
+            if response.status_code >= 400:
+                errors.append(response.status_code)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one, range(requests_total)))
+    wall = time.perf_counter() - started
+    print(f"  route {name}: {requests_total / wall:.1f} req/s", file=sys.stderr)
+    return {
+        "requests": requests_total,
+        "concurrency": concurrency,
+        "errors": len(errors),
+        "throughput_rps": round(requests_total / wall, 1),
+        "p50_ms": round(percentile(latencies, 0.50), 3),
+        "p95_ms": round(percentile(latencies, 0.95), 3),
+        "p99_ms": round(percentile(latencies, 0.99), 3),
+        "max_ms": round(max(latencies), 3)
+    }
+
+
+def bench_routes(app, requests_total, concurrency):
+    notes = synthetic_notes(3_000, seed=1)
+    cards = [{"question": f"What is benchmark card {i}?", "answer": f"Answer number {i}"} for i in range(5_000)]
+    client = app.app.test_client()
+    for start in range(0, len(cards), app.SAVE_BATCH_MAX):
+        client.post("/save_flashcards", json=cards[start:start + app.SAVE_BATCH_MAX])
+
+    # Distinct notes per request, so no paragraph or model input repeats
+    # and neither the segment nor the inference cache can answer
+    fresh_notes = [synthetic_notes(3_000, seed=10_000 + i, head="") for i in range(requests_total)]
+    clear_caches(app)
+    hits_before = cache_hits(app)
+    generate_uncached = load_test(app, "generate_uncached", lambda c, i: c.post(
+        "/generate_flashcards", json={"notes": fresh_notes[i]}), requests_total, concurrency)
+    generate_uncached["cache_hits"] = cache_hits(app) - hits_before
+
+    return {
+        "generate_uncached": generate_uncached,
+        "generate_cached": load_test(app, "generate_cached", lambda c, i: c.post(
+            "/generate_flashcards", json={"notes": notes}), requests_total, concurrency),
+        "save_flashcards": load_test(app, "save_flashcards", lambda c, i: c.post(
+            "/save_flashcards", json=[{"question": f"Load test question {i}-{j}?", "answer": "A"} for j in range(20)]),
+            requests_total, concurrency),
+        "get_flashcards_page": load_test(app, "get_flashcards_page", lambda c, i: c.get(
+            "/get_flashcards?limit=50"), requests_total, concurrency),
+        "search_flashcards": load_test(app, "search_flashcards", lambda c, i: c.get(
+            f"/search_flashcards?q=benchmark+card+{i % 500}"), requests_total, concurrency),
+        "health": load_test(app, "health", lambda c, i: c.get("/health"), requests_total, concurrency),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def flatten(results, prefix=""):
+    """Map 'section.name.metric' -> timing for every *_ms value"""
+    flat = {}
+    for key, value in results.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, path + "."))
+        elif key.endswith("_ms") and key not in ("mean_ms", "max_ms"):
+            flat[path] = value
+    return flat
+
+
+def compare(baseline, current):
+    old = flatten(baseline["results"])
+    new = flatten(current["results"])
+    print(f"{'measurement':70} {'before':>10} {'after':>10} {'ratio':>7}")
+    for key in sorted(old.keys() & new.keys()):
+        ratio = new[key] / old[key] if old[key] else float("inf")
+        flag = "  slower" if ratio > 1.2 else ("  faster" if ratio < 0.8 else "")
+        print(f"{key:70} {old[key]:10.3f} {new[key]:10.3f} {ratio:7.2f}{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-o", "--output", help="write results to this JSON file instead of stdout")
+    parser.add_argument("--compare", help="baseline JSON file to compare the results against")
+    parser.add_argument("--quick", action="store_true", help="skip the 1 MB corpus and send fewer requests")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per pipeline measurement")
+    parser.add_argument("--requests", type=int, default=200, help="requests per route")
+    parser.add_argument("--concurrency", type=int, default=8, help="client threads for the route load test")
+    parser.add_argument("--mock-latency", type=float, default=0.02, help="seconds the mock inference API waits")
+    args = parser.parse_args()
+    if args.quick:
+        args.requests = min(args.requests, 50)
+
+    workdir = tempfile.mkdtemp(prefix="flashcards-bench-")
+    server = start_mock_server(args.mock_latency)
+    # Configure the app before importing it; it reads settings at import time
+    os.environ.update({
+        "DB_BACKEND": "sqlite",
+        "SQLITE_PATH": os.path.join(workdir, "bench.db"),
+        "INFERENCE_BACKEND": "huggingface",
+        "HF_API_BASE_URL": f"http://127.0.0.1:{server.server_port}",
+        "INFERENCE_CACHE_PATH": "",
+        "GENERATION_CACHE_PATH": "",
+        "JOB_WORKER_MODE": "thread",
+        # The load test is one client hammering the app; measure throughput,
+        # not admission control
+        "RATE_LIMIT_BURST": "0",
+        "AI_GENERATION_SLOTS": "64",
+    })
+    sys.path.insert(0, ROOT)
+    import logging
+    logging.disable(logging.INFO)
+    import app
+    app.init_db()
+
+    sizes = QUICK_SIZES if args.quick else tuple(SIZES)
+    corpora = {f"synthetic_{size}": synthetic_notes(SIZES[size]) for size in sizes}
+    corpora["real_notes"] = REAL_NOTES
+
+    print("Benchmarking pipeline functions...", file=sys.stderr)
+    pipeline = bench_pipeline(app, corpora, args.repeat)
+    print("Benchmarking pathological inputs...", file=sys.stderr)
+    pathological = bench_pipeline(app, pathological_inputs(), args.repeat)
+    print("Load testing routes...", file=sys.stderr)
+    routes = bench_routes(app, args.requests, args.concurrency)
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": vars(args),
+        "mock_inference_calls": MockInferenceHandler.calls,
+        "results": {"pipeline": pipeline, "pathological": pathological, "routes": routes}
+    }
+    server.shutdown()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+        print(f"Wrote {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
@@ -658,32 +658,14 @@ async function generateFlashcards() {
     showLoadingState(true);
     updateLoadingMessage("Analyzing your notes...");
     
-    // Simulate processing steps for better UX
-    await new Promise(resolve => setTimeout(resolve, 800));
-    updateLoadingMessage("Extracting key concepts...");
-    
-    const response = await fetch("/generate_flashcards", {
-      method: "POST",
-      headers: { "Content-Type": "application/json" },
-      body: JSON.stringify({ notes })
-    });
-
-    if (!response.ok) {
-      throw new Error(`Server error: ${response.status} ${response.statusText}`);
-    }
-
-    await new Promise(resolve => setTimeout(resolve, 500));
-    updateLoadingMessage("Creating flashcards...");
-
-    const flashcards = await response.json();
+    const flashcards = await streamFlashcards(notes);
     
     if (!flashcards || !Array.isArray(flashcards) || flashcards.length === 0) {
       throw new Error("No flashcards were generated from your notes");
     }
 
+    // Replace the progressive preview with the final, deduplicated set
     currentFlashcards = flashcards;
-    await new Promise(resolve => setTimeout(resolve, 300));
-    
     showLoadingState(false);
     displayFlashcards(flashcards, false);
     
@@ -707,6 +689,86 @@ async function generateFlashcards() {
   }
 }
 
+// Stream cards from /generate_flashcards/stream, rendering each batch as it
+// arrives. Resolves with the final card list from the "done" event.
+async function streamFlashcards(notes) {
+  const response = await fetch("/generate_flashcards/stream", {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({ notes })
+  });
+
+  if (!response.ok) {
+    throw new Error(`Server error: ${response.status} ${response.statusText}`);
+  }
+
+  // Browsers without streaming fetch bodies fall back to the plain endpoint
+  if (!response.body || !response.body.getReader) {
+    const fallback = await fetch("/generate_flashcards", {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({ notes })
+    });
+    if (!fallback.ok) {
+      throw new Error(`Server error: ${fallback.status} ${fallback.statusText}`);
+    }
+    return fallback.json();
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  let preview = [];
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    let boundary;
+    while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+      const frame = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+
+      let eventName = "message";
+      let data = "";
+      frame.split("\n").forEach(line => {
+        if (line.startsWith("event:")) eventName = line.slice(6).trim();
+        else if (line.startsWith("data:")) data += line.slice(5).trim();
+      });
+      if (!data) continue;
+      const payload = JSON.parse(data);
+
+      if (eventName === "cards" && payload.cards.length > 0) {
+        if (preview.length === 0) {
+          showLoadingState(false);
+          displayFlashcards([], false);
+        }
+        appendFlashcards(payload.cards, preview.length);
+        preview = preview.concat(payload.cards);
+        currentFlashcards = preview;
+      } else if (eventName === "done") {
+        reader.cancel();
+        return payload.cards;
+      } else if (eventName === "error") {
+        throw new Error(`Server error: ${payload.error}`);
+      }
+    }
+  }
+
+  throw new Error("Server error: stream ended unexpectedly");
+}
+
+// Add cards to the grid without re-rendering the ones already shown
+function appendFlashcards(cards, startIndex) {
+  cards.forEach((card, offset) => {
+    const cardElement = createFlashcardElement(card, startIndex + offset, false);
+    flashcardsContainer.appendChild(cardElement);
+  });
+  totalCards = startIndex + cards.length;
+  updateProgress();
+}
+
 // Enhanced loadFlashcards function
 async function loadFlashcards() {
   try {
@@ -881,6 +943,75 @@ async function saveFlashcard(question, answer, index) {
   }
 }
 
+// Save every unsaved card in a single request
+async function saveAllFlashcards() {
+  const pending = [];
+  document.querySelectorAll('.flashcard').forEach(cardElement => {
+    const saveBtn = cardElement.querySelector('.save-btn');
+    if (saveBtn && !saveBtn.disabled && saveBtn.style.display !== 'none') {
+      pending.push(Number(cardElement.dataset.index));
+    }
+  });
+
+  if (pending.length === 0) {
+    showNotification("All cards are already saved.", "info");
+    return;
+  }
+
+  pending.forEach(index => {
+    const saveBtn = document.querySelector(`[data-index="${index}"] .save-btn`);
+    saveBtn.innerHTML = '<i class="fas fa-spinner fa-spin"></i> <span>Saving...</span>';
+    saveBtn.disabled = true;
+  });
+
+  try {
+    const response = await fetch("/save_flashcards", {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({
+        flashcards: pending.map(index => ({
+          question: currentFlashcards[index].question,
+          answer: currentFlashcards[index].answer
+        }))
+      })
+    });
+
+    if (!response.ok) {
+      throw new Error(`HTTP error! status: ${response.status}`);
+    }
+
+    const result = await response.json();
+    const stored = [...result.inserted, ...result.duplicates].map(item => pending[item.index]);
+
+    pending.forEach(index => {
+      const saveBtn = document.querySelector(`[data-index="${index}"] .save-btn`);
+      if (stored.includes(index)) {
+        saveBtn.innerHTML = '<i class="fas fa-check"></i> <span>Saved!</span>';
+        saveBtn.style.background = 'linear-gradient(135deg, #10b981, #059669)';
+        setTimeout(() => {
+          saveBtn.style.display = 'none';
+        }, 1500);
+      } else {
+        saveBtn.innerHTML = '<i class="fas fa-save"></i> <span>Save Card</span>';
+        saveBtn.disabled = false;
+      }
+    });
+
+    showNotification(result.message || "Flashcards saved successfully!", "success");
+
+  } catch (error) {
+    console.error("Error saving flashcards:", error);
+
+    pending.forEach(index => {
+      const saveBtn = document.querySelector(`[data-index="${index}"] .save-btn`);
+      saveBtn.innerHTML = '<i class="fas fa-save"></i> <span>Save Card</span>';
+      saveBtn.disabled = false;
+    });
+
+    showNotification("Could not save flashcards. Please try again.", "error");
+  }
+}
+
 // Utility Functions
 function escapeHtml(text) {
   const div = document.createElement('div');
@@ -912,7 +1043,7 @@ document.addEventListener('keydown', function(e) {
     e.preventDefault();
     const unsavedCards = document.querySelectorAll('.save-btn:not([style*="display: none"])');
     if (unsavedCards.length > 0) {
-      showNotification("Use individual save buttons on each card.", "info");
+      saveAllFlashcards();
     }
   }
 });